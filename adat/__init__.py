@@ -1,2 +1,34 @@
-from .receiver import *
-from .transmitter import *
\ No newline at end of file
+""" ADAT receiver and transmitter cores.
+    The submodules are only imported when one of their names is first used,
+    so that importing the package or ``adat.protocol`` does not pull in amaranth.
+"""
+import importlib
+
+# the submodule, which defines each public name of the package
+_SUBMODULES = {
+    "NRZIDecoder":           "nrzidecoder",
+    "ADATReceiver":          "receiver",
+    "ADATTransmitter":       "transmitter",
+    "ADATRepeater":          "repeater",
+    "ADATBitClockGenerator": "bitclock",
+    "ADATRingBufferWriter":  "ringbuffer",
+    "ADATRingBufferReader":  "ringbuffer",
+    "ADATFrameAligner":      "aligner",
+    "ADATTDMBridge":         "tdm",
+    "adat_freq":             "protocol",
+    "transmit_fifo_depth":   "protocol",
+}
+
+__all__ = list(_SUBMODULES)
+
+def __getattr__(name: str):
+    if name not in _SUBMODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(f".{_SUBMODULES[name]}", __name__), name)
+    # cache it, so that __getattr__ is only called once per name
+    globals()[name] = value
+    return value
+
+def __dir__() -> list:
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+"""align the frames of several ADAT inputs, which share a word clock"""
+from amaranth import Elaboratable, Signal, Module, Cat, Array, Memory, signed
+
+from adat.protocol import CHANNELS, USER_BITS
+
+class ADATFrameAligner(Elaboratable):
+    """buffer the frames of several ADATReceivers and output them
+       together, when every input has a frame of the same word clock period
+
+    Each port writes the frames of its receiver into its own memory, like ADATRingBufferWriter.
+    The receivers need to run with timestamps=True in the same clock domain.
+    Two frames belong to the same word clock period, when their timestamps differ
+    by at most max_skew sync clock cycles.
+
+    When every port has a frame, the aligner compares the timestamps of the oldest frames,
+    one port per cycle. If they belong to the same period, it outputs them as one aligned frame,
+    port after port, eight channels each. Otherwise it drops the oldest of these frames,
+    which has no partner in the other ports, and counts it as a slip of its port.
+    When a frame is complete while the memory of its port is full, the oldest frame
+    of the port is dropped and counted as a slip, too, so that the memory always holds
+    the most recent periods. Only while an aligned frame is output, its frames are kept,
+    and the new frame is dropped instead. So ports, which lost frames or relocked later,
+    fall in line again with the next common period, and a port, which has no signal,
+    stalls the output, until it comes back.
+
+    Parameters
+    ----------
+    ports: number of inputs
+    clk_freq: the frequency of the sync clock
+    max_samplerate: the highest sample rate of the inputs
+    frames: number of frame slots of each port, a power of two >= 2.
+        One slot is always free for the frame which is being received
+    max_skew: the largest difference of timestamps of the same period, in sync clock cycles.
+        Defaults to half a frame period at max_samplerate
+    timestamp_width: width of ``ADATReceiver.timestamp_out``
+
+    Attributes
+    ----------
+    addr_in, sample_in, valid_in, user_data_in, timestamp_in: list of Signal
+        one per port, connect to the outputs of the receivers, see ``connect_receiver``
+    port_out: Signal
+        the port of the current output word
+    addr_out: Signal
+        the channel of the current output word
+    sample_out: Signal
+        the sample of the current output word
+    user_data_out, timestamp_out: Signal
+        of the frame of the current port
+    valid_out: Signal
+        high, while the output word is valid
+    ready_in: Signal
+        the consumer takes the output word, when both valid_out and ready_in are high
+    last_out: Signal
+        high with the last word of an aligned frame, channel 7 of the last port
+    skew_out: Signal
+        difference between the latest and the earliest timestamp of the current aligned frame
+    frame_counter_out: Signal
+        number of aligned frames output since reset, wraps around
+    slips_out: list of Signal
+        one per port, number of frames dropped since reset, wraps around
+    level_out: list of Signal
+        one per port, number of complete frames in its memory
+    """
+    def __init__(self, ports: int, clk_freq: float, max_samplerate: int=48000, frames: int=4,
+                 max_skew: int=None, timestamp_width: int=32):
+        if ports < 1:
+            raise ValueError(f"at least one port is needed, not {ports}")
+        if frames < 2 or (frames & (frames - 1)) != 0:
+            raise ValueError(f"frame slots must be a power of two >= 2, not {frames}")
+        if max_skew is None:
+            max_skew = int(clk_freq / max_samplerate) // 2
+
+        self._ports            = ports
+        self._frames           = frames
+        self.max_skew          = max_skew
+
+        self.addr_in           = [Signal(3,               name=f"addr_in_{port}")      for port in range(ports)]
+        self.sample_in         = [Signal(24,              name=f"sample_in_{port}")    for port in range(ports)]
+        self.valid_in          = [Signal(                 name=f"valid_in_{port}")     for port in range(ports)]
+        self.user_data_in      = [Signal(USER_BITS,       name=f"user_data_in_{port}") for port in range(ports)]
+        self.timestamp_in      = [Signal(timestamp_width, name=f"timestamp_in_{port}") for port in range(ports)]
+
+        self.port_out          = Signal(range(ports))
+        self.addr_out          = Signal(3)
+        self.sample_out        = Signal(24)
+        self.user_data_out     = Signal(USER_BITS)
+        self.timestamp_out     = Signal(timestamp_width)
+        self.valid_out         = Signal()
+        self.ready_in          = Signal(reset=1)
+        self.last_out          = Signal()
+        self.skew_out          = Signal(timestamp_width)
+        self.frame_counter_out = Signal(32)
+
+        self.slips_out         = [Signal(16,                 name=f"slips_out_{port}") for port in range(ports)]
+        self.level_out         = [Signal(range(frames + 1),  name=f"level_out_{port}") for port in range(ports)]
+
+        self.sample_mems = [Memory(width=24, depth=frames * CHANNELS, name=f"aligner_samples_{port}")
+                            for port in range(ports)]
+        self.header_mems = [Memory(width=USER_BITS + timestamp_width, depth=frames, name=f"aligner_headers_{port}")
+                            for port in range(ports)]
+
+    def connect_receiver(self, port: int, receiver) -> list:
+        """the statements, which connect the outputs of an ADATReceiver to port"""
+        return [
+            self.addr_in[port]      .eq(receiver.addr_out),
+            self.sample_in[port]    .eq(receiver.sample_out),
+            self.valid_in[port]     .eq(receiver.output_enable),
+            self.user_data_in[port] .eq(receiver.user_data_out),
+            self.timestamp_in[port] .eq(receiver.timestamp_out),
+        ]
+
+    def elaborate(self, platform) -> Module:
+        m = Module()
+        sync = m.d.sync
+        comb = m.d.comb
+
+        ports           = self._ports
+        slot_bits       = (self._frames - 1).bit_length()
+        timestamp_width = len(self.timestamp_out)
+
+        # the oldest frame of each port, and the port which is being scanned or output
+        has_frame       = Array(Signal(name=f"has_frame_{port}") for port in range(ports))
+        head_timestamp  = Array(Signal(timestamp_width, name=f"head_timestamp_{port}") for port in range(ports))
+        head_user_data  = Array(Signal(USER_BITS, name=f"head_user_data_{port}") for port in range(ports))
+        head_sample     = Array(Signal(24, name=f"head_sample_{port}") for port in range(ports))
+        read_pointers   = Array(Signal(range(2 * self._frames), name=f"read_pointer_{port}") for port in range(ports))
+        # the oldest frame of the port has been output, or is dropped
+        release         = Array(Signal(name=f"release_{port}") for port in range(ports))
+        slip            = Array(Signal(name=f"slip_{port}") for port in range(ports))
+        # the oldest frame of the port is dropped to make room for a new one
+        drop_oldest     = Array(Signal(name=f"drop_oldest_{port}") for port in range(ports))
+        # the frames at the heads are being output, and must not be dropped
+        outputting      = Signal()
+
+        for port in range(ports):
+            sample_write = self.sample_mems[port].write_port()
+            sample_read  = self.sample_mems[port].read_port(domain="comb")
+            header_write = self.header_mems[port].write_port()
+            header_read  = self.header_mems[port].read_port(domain="comb")
+            m.submodules[f"sample_write_{port}"] = sample_write
+            m.submodules[f"sample_read_{port}"]  = sample_read
+            m.submodules[f"header_write_{port}"] = header_write
+            m.submodules[f"header_read_{port}"]  = header_read
+
+            write_pointer = Signal.like(read_pointers[port], name=f"write_pointer_{port}")
+            read_pointer  = read_pointers[port]
+            level         = self.level_out[port]
+            complete      = Signal(name=f"complete_{port}")
+            full          = Signal(name=f"full_{port}")
+            drop_write    = Signal(name=f"drop_write_{port}")
+
+            comb += [
+                level                .eq((write_pointer - read_pointer)[:len(read_pointer)]),
+                has_frame[port]      .eq(level != 0),
+                complete             .eq(self.valid_in[port] & (self.addr_in[port] == CHANNELS - 1)),
+                # no room is needed, when the oldest frame is released or slipped in the same cycle
+                full                 .eq(complete & (level == self._frames - 1) & ~release[port] & ~slip[port]),
+                drop_oldest[port]    .eq(full & ~outputting),
+                drop_write           .eq(full & outputting),
+
+                # incomplete frames (after loss of sync) will just be overwritten
+                sample_write.addr    .eq(Cat(self.addr_in[port], write_pointer[:slot_bits])),
+                sample_write.data    .eq(self.sample_in[port]),
+                sample_write.en      .eq(self.valid_in[port]),
+                header_write.addr    .eq(write_pointer[:slot_bits]),
+                header_write.data    .eq(Cat(self.user_data_in[port], self.timestamp_in[port])),
+                header_write.en      .eq(complete),
+
+                sample_read.addr     .eq(Cat(self.addr_out, read_pointer[:slot_bits])),
+                header_read.addr     .eq(read_pointer[:slot_bits]),
+                head_sample[port]    .eq(sample_read.data),
+                head_user_data[port] .eq(header_read.data[:USER_BITS]),
+                head_timestamp[port] .eq(header_read.data[USER_BITS:]),
+            ]
+
+            with m.If(complete & ~drop_write):
+                sync += write_pointer.eq(write_pointer + 1)
+            with m.If(release[port] | slip[port] | drop_oldest[port]):
+                sync += read_pointer.eq(read_pointer + 1)
+            with m.If(drop_write | slip[port] | drop_oldest[port]):
+                sync += self.slips_out[port].eq(self.slips_out[port] + 1)
+
+        # the timestamps relative to the timestamp of port 0
+        reference    = Signal(timestamp_width)
+        offset       = Signal(signed(timestamp_width))
+        offset_min   = Signal(signed(timestamp_width))
+        offset_max   = Signal(signed(timestamp_width))
+        oldest_port  = Signal(range(ports))
+        accepted     = Signal()
+        # a head frame was dropped after it has been scanned
+        rescan       = Signal()
+
+        with m.If(Cat(drop_oldest).any()):
+            sync += rescan.eq(1)
+
+        comb += [
+            offset             .eq((head_timestamp[self.port_out] - reference)[:timestamp_width]),
+            accepted           .eq(self.valid_out & self.ready_in),
+            self.sample_out    .eq(head_sample[self.port_out]),
+            self.user_data_out .eq(head_user_data[self.port_out]),
+            self.timestamp_out .eq(head_timestamp[self.port_out]),
+            self.last_out      .eq(self.valid_out & (self.port_out == ports - 1) & (self.addr_out == CHANNELS - 1)),
+        ]
+
+        with m.FSM():
+            # one port per cycle, port_out is the port being scanned
+            with m.State("SCAN"):
+                with m.If(has_frame[self.port_out]):
+                    with m.If(self.port_out == 0):
+                        sync += [
+                            reference   .eq(head_timestamp[0]),
+                            offset_min  .eq(0),
+                            offset_max  .eq(0),
+                            oldest_port .eq(0),
+                        ]
+                    with m.Else():
+                        with m.If(offset < offset_min):
+                            sync += [
+                                offset_min  .eq(offset),
+                                oldest_port .eq(self.port_out),
+                            ]
+                        with m.If(offset > offset_max):
+                            sync += offset_max.eq(offset)
+
+                    with m.If(self.port_out == ports - 1):
+                        sync += self.port_out.eq(0)
+                        m.next = "DECIDE"
+                    with m.Else():
+                        sync += self.port_out.eq(self.port_out + 1)
+
+            with m.State("DECIDE"):
+                sync += rescan.eq(0)
+                with m.If(rescan | Cat(drop_oldest).any()):
+                    m.next = "SCAN"
+                with m.Elif(offset_max - offset_min <= self.max_skew):
+                    sync += [
+                        self.skew_out  .eq(offset_max - offset_min),
+                        self.addr_out  .eq(0),
+                        self.valid_out .eq(1),
+                    ]
+                    m.next = "OUTPUT"
+                with m.Else():
+                    # the oldest frame has no partner in the other ports
+                    comb += slip[oldest_port].eq(1)
+                    m.next = "SCAN"
+
+            with m.State("OUTPUT"):
+                comb += outputting.eq(1)
+                with m.If(accepted):
+                    sync += self.addr_out.eq(self.addr_out + 1)
+                    with m.If(self.addr_out == CHANNELS - 1):
+                        comb += release[self.port_out].eq(1)
+                        with m.If(self.port_out == ports - 1):
+                            sync += [
+                                self.port_out          .eq(0),
+                                self.valid_out         .eq(0),
+                                self.frame_counter_out .eq(self.frame_counter_out + 1),
+                            ]
+                            m.next = "SCAN"
+                        with m.Else():
+                            sync += self.port_out.eq(self.port_out + 1)
+
+        return m
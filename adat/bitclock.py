@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+"""Generate the ADAT bit rate from the sync clock"""
+
+from amaranth import Elaboratable, Signal, Module, signed
+
+from adat.protocol import adat_freq
+
+class ADATBitClockGenerator(Elaboratable):
+    """Numerically controlled oscillator, which strobes ``bit_enable_out``
+       at the ADAT bit rate (256 * samplerate) on average.
+       Each strobe is aligned to the sync clock, so the output
+       has a jitter of one sync clock period peak to peak.
+
+    Parameters
+    ----------
+    clk_freq: frequency of the sync clock domain
+    samplerate: the ADAT sample rate to generate
+    width: width of the phase accumulator. The frequency resolution is clk_freq / 2**width
+
+    Attributes
+    ----------
+    bit_enable_out: Signal
+        strobed once per ADAT bit
+    trim_in: Signal
+        signed correction, which is added to the phase increment.
+        One LSB changes the bit rate by clk_freq / 2**width
+    """
+    def __init__(self, clk_freq: int, samplerate: int=48000, width: int=32):
+        bit_rate = adat_freq(samplerate)
+        if bit_rate * 2 > clk_freq:
+            raise ValueError(f"clk_freq needs to be at least twice the ADAT bit rate of {bit_rate} Hz, "
+                             f"but is only {clk_freq} Hz")
+
+        self.clk_freq       = clk_freq
+        self.samplerate     = samplerate
+        self.width          = width
+        self.increment      = self.phase_increment(clk_freq, samplerate, width)
+
+        self.bit_enable_out = Signal()
+        self.trim_in        = Signal(signed(width - 8))
+
+    @staticmethod
+    def phase_increment(clk_freq: int, samplerate: int=48000, width: int=32) -> int:
+        """calculate the phase increment, which generates the ADAT bit rate of the given samplerate"""
+        return round(adat_freq(samplerate) * 2**width / clk_freq)
+
+    def elaborate(self, platform) -> Module:
+        m = Module()
+
+        phase = Signal(self.width + 1)
+
+        # the carry of the phase accumulator is the bit enable
+        m.d.sync += phase.eq(phase[:self.width] + self.increment + self.trim_in)
+        m.d.comb += self.bit_enable_out.eq(phase[self.width])
+
+        return m
@@ -10,23 +10,78 @@ import math
 from amaranth         import Elaboratable, Signal, Module
 from amaranth.lib.cdc import FFSynchronizer
 
-from amlib.utils.dividingcounter import DividingCounter
+from adat import protocol
 
 class NRZIDecoder(Elaboratable):
-    """Converts a NRZI encoded ADAT stream into a synchronous stream of bits"""
-    def __init__(self, clk_freq: int):
+    """Converts a NRZI encoded ADAT stream into a synchronous stream of bits
+
+       All counter widths and thresholds are derived from clk_freq
+       and the supported range of samplerates.
+       With pipelined=True, the bit timing thresholds are registered
+       when the sync pad has been measured, and the sampling and dead signal
+       decisions are registered one cycle ahead, so that no adder sits
+       in front of a comparator. The output timing is the same.
+
+       While the input has no edges, the sync counter stops after the length
+       of a sync pad at the lowest samplerate, so no state changes any more.
+       idle_out signals this, and falls in the cycle after the next edge.
+    """
+
+    # number of bit times between the two edges of the sync pad
+    SYNC_BITS = 11
+    # the phase of the clock cycle after an edge: one cycle to compensate
+    # for the sync delay, plus half a cycle, because the edge happened
+    # somewhere in the cycle before it was detected
+    EDGE_PHASE = SYNC_BITS + SYNC_BITS // 2
+
+    def __init__(self, clk_freq: int, min_samplerate: int = 44100, max_samplerate: int = 48000,
+                 pipelined: bool = False):
         self.nrzi_in             = Signal()
         self.invalid_frame_in    = Signal()
         self.data_out            = Signal()
         self.data_out_en         = Signal()
         self.recovered_clock_out = Signal()
         self.running             = Signal()
+        self.idle_out            = Signal()
         self.clk_freq            = clk_freq
+        self.min_samplerate      = min_samplerate
+        self.max_samplerate      = max_samplerate
+        self.pipelined           = pipelined
+
+        # length of an ADAT bit in clock cycles at the lowest samplerate, plus 10%
+        self.max_bit_time        = math.ceil(110 * (clk_freq/self.adat_freq(min_samplerate) / 100))
+        self.check_clk_freq()
 
     @staticmethod
     def adat_freq(samplerate: int = 48000) -> int:
         """calculate the ADAT bit rate for the given samplerate"""
-        return samplerate * ((24 + 6) * 8 + 1 + 10 + 1 + 4)
+        return protocol.adat_freq(samplerate)
+
+    def timing_thresholds(self, sync_length) -> dict:
+        """the bit timing thresholds for the given length of the sync pad"""
+        half_bit = sync_length >> 1
+        return {
+            "half_bit":    half_bit,
+            # the phase one cycle before the middle of the bit
+            "sample_from": half_bit - self.SYNC_BITS,
+            # the phase, at which the bit wraps around in the next cycle
+            "wrap_at":     sync_length - self.SYNC_BITS,
+            # 16 bits worth of time without an edge, minus one cycle
+            "dead_from":   sync_length + half_bit - 1,
+        }
+
+    def check_clk_freq(self):
+        """make sure the bit timing can be recovered at all supported samplerates"""
+        min_bit_time = self.clk_freq / self.adat_freq(self.max_samplerate)
+        # we need to be able to tell the middle of a bit from its edges
+        if min_bit_time < 4:
+            raise ValueError(f"clk_freq of {self.clk_freq} Hz is too low, it needs to be at least "
+                             f"{4 * self.adat_freq(self.max_samplerate)} Hz for {self.max_samplerate} Hz samplerate")
+        # the sync pad at the highest samplerate has to be
+        # longer than the sync threshold at the lowest samplerate
+        if self.SYNC_BITS * min_bit_time <= 7 * self.max_bit_time:
+            raise ValueError(f"samplerate range {self.min_samplerate} - {self.max_samplerate} Hz is too wide "
+                             "to detect the sync pad at all samplerates")
 
     def elaborate(self, platform) -> Module:
         """assemble the module"""
@@ -44,104 +99,136 @@ class NRZIDecoder(Elaboratable):
         comb += got_edge.eq(nrzi_prev ^ nrzi)
 
         # we are looking for 10 non changing bits
-        # and those will be ~900ns long @48kHz
-        # and if we clock at not more than 100MHz
-        # the counter will run up to 900ns/10ns = 90
-        # so 7 bits will suffice for the counter
-        sync_counter = DividingCounter(divisor=12, width=7)
-        m.submodules.sync_counter = sync_counter
-        bit_time = sync_counter.divided_counter_out
+        # and those will be ~900ns long @48kHz.
+        # The counter stops just above the dead signal threshold
+        # in find_bit_timings, so it never wraps around
+        sync_counter = Signal(range(10 * self.max_bit_time + 2))
+        # the length of the sync pad in clock cycles,
+        # which is SYNC_BITS bit times
+        sync_length  = Signal(range(10 * self.max_bit_time + 3))
+        # The position inside the current bit, in units of 1/SYNC_BITS clock cycles.
+        # One bit is sync_length units long, so the bit timing does not
+        # suffer from rounding the bit time to whole clock cycles
+        bit_phase    = Signal(range(10 * self.max_bit_time + 3 + self.SYNC_BITS))
+        # this counter is used to detect a dead signal
+        # to determine when to go back to SYNC state
+        dead_counter = Signal(range(2 * (10 * self.max_bit_time + 3)))
+
+        thresholds = {
+            "half_bit":    Signal.like(sync_length, name="half_bit"),
+            "sample_from": Signal.like(sync_length, name="sample_from"),
+            "wrap_at":     Signal.like(sync_length, name="wrap_at"),
+            "dead_from":   Signal.like(dead_counter, name="dead_from"),
+        }
+        # in pipelined mode, find_bit_timings registers them together with sync_length
+        if not self.pipelined:
+            comb += [thresholds[name].eq(value) for name, value in self.timing_thresholds(sync_length).items()]
 
         with m.FSM():
             with m.State("SYNC"):
-                comb += self.running.eq(0)
+                comb += [
+                    self.running.eq(0),
+                    self.idle_out.eq(sync_counter > 10 * self.max_bit_time),
+                ]
                 sync += [
                     self.data_out.eq(0),
                     self.data_out_en.eq(0),
-                    sync_counter.reset_in.eq(0)
+                    # the edge at the end of the sync pad
+                    # starts the first bit of the DECODE state
+                    bit_phase.eq(self.EDGE_PHASE),
                 ]
-                self.find_bit_timings(m, sync_counter, got_edge)
+                self.find_bit_timings(m, sync_counter, sync_length, thresholds, got_edge)
 
             with m.State("DECODE"):
                 comb += self.running.eq(1)
-                self.decode_nrzi(m, bit_time, got_edge, sync_counter)
+                self.decode_nrzi(m, thresholds, bit_phase, dead_counter, got_edge, sync_counter)
 
         return m
 
-    def find_bit_timings(self, m: Module, sync_counter: DividingCounter, got_edge: Signal):
+    def find_bit_timings(self, m: Module, sync_counter: Signal, sync_length: Signal, thresholds: dict, got_edge: Signal):
         """Waits for the ten zero bits of the SYNC section to determine the length of an ADAT bit"""
         sync = m.d.sync
-        bit_time_44100 = math.ceil(110 * (self.clk_freq/self.adat_freq(44100) / 100))
+        max_bit_time = self.max_bit_time
 
         # as long as the input does not change, count up
         # else reset
         with m.If(got_edge):
-            # if the sync counter is 10% over the sync time @44100Hz, then
+            # if the sync counter is 10% over the sync time at the lowest samplerate, then
             # the signal just woke up from the dead. Start counting again.
-            with m.If(sync_counter.counter_out > 10 * bit_time_44100):
-                sync += sync_counter.reset_in.eq(1)
+            with m.If(sync_counter > 10 * max_bit_time):
+                sync += sync_counter.eq(0)
 
             # if we are in the middle of the signal,
             # and got an edge, then we reset the counter on each edge
             with m.Else():
                 # when the counter is bigger than 3/4 of the old max, then we have a sync frame
-                with m.If(sync_counter.counter_out > 7 * bit_time_44100):
-                    sync += sync_counter.active_in.eq(0) # stop counting, we found it
+                with m.If(sync_counter > 7 * max_bit_time):
+                    # the counter started one cycle after the last edge
+                    sync += sync_length.eq(sync_counter + 1)
+                    if self.pipelined:
+                        sync += [thresholds[name].eq(value)
+                                 for name, value in self.timing_thresholds(sync_counter + 1).items()]
                     m.next = "DECODE"
                 with m.Else():
-                    sync += sync_counter.reset_in.eq(1)
+                    sync += sync_counter.eq(0)
 
         # when we have no edge, count...
-        with m.Else():
-            sync += [
-                sync_counter.reset_in.eq(0),
-                sync_counter.active_in.eq(1)
-            ]
+        with m.Elif(sync_counter <= 10 * max_bit_time):
+            sync += sync_counter.eq(sync_counter + 1)
 
-    def decode_nrzi(self, m: Module, bit_time: Signal, got_edge: Signal, sync_counter: DividingCounter):
+    def decode_nrzi(self, m: Module, thresholds: dict, bit_phase: Signal, dead_counter: Signal,
+                    got_edge: Signal, sync_counter: Signal):
         """Do the actual decoding of the NRZI bitstream"""
         sync = m.d.sync
-        bit_counter  = Signal(7)
-        # this counter is used to detect a dead signal
-        # to determine when to go back to SYNC state
-        dead_counter = Signal(8)
+
+        half_bit     = thresholds["half_bit"]
         output       = Signal(reset=1)
+        # sample the current bit
+        sample       = Signal()
+        # no edge for too long, the signal is dead
+        dead         = Signal()
+
+        if self.pipelined:
+            # decide one cycle ahead. There is no edge in this cycle,
+            # so the phase advances into the middle of the bit
+            # and the dead counter reaches its limit in the next cycle
+            sync += [
+                sample .eq(~got_edge & (bit_phase >= thresholds["sample_from"]) & (bit_phase < half_bit)),
+                dead   .eq(~got_edge & (dead_counter == thresholds["dead_from"])),
+            ]
+        else:
+            # output at the middle of the bit, which is the first
+            # clock cycle, in which the phase reaches half a bit
+            m.d.comb += [
+                sample .eq((bit_phase >= half_bit) & (bit_phase < half_bit + self.SYNC_BITS)),
+                dead   .eq(dead_counter > thresholds["dead_from"]),
+            ]
 
         # recover ADAT clock
-        with m.If(bit_counter <= (bit_time >> 1)):
+        with m.If(bit_phase <= half_bit):
             m.d.comb += self.recovered_clock_out.eq(1)
         with m.Else():
             m.d.comb += self.recovered_clock_out.eq(0)
 
-        # when the frame decoder got garbage
-        # then we need to go back to SYNC state
-        with m.If(self.invalid_frame_in):
-            sync += [
-                sync_counter.reset_in.eq(1),
-                bit_counter.eq(0),
-                dead_counter.eq(0)
-            ]
-            m.next = "SYNC"
+        # wrap the phase at the end of the bit
+        with m.If(bit_phase >= thresholds["wrap_at"]):
+            sync += bit_phase.eq(bit_phase - thresholds["wrap_at"])
+        with m.Else():
+            sync += bit_phase.eq(bit_phase + self.SYNC_BITS)
 
-        sync += bit_counter.eq(bit_counter + 1)
         with m.If(got_edge):
             sync += [
                 # latch 1 until we read it in the middle of the bit
                 output.eq(1),
-                # resynchronize at each bit edge, 1 to compensate
-                # for sync delay
-                bit_counter.eq(1),
+                # resynchronize at each bit edge
+                bit_phase.eq(self.EDGE_PHASE),
                 # when we get an edge, the signal is alive, reset counter
                 dead_counter.eq(0)
             ]
         with m.Else():
             sync += dead_counter.eq(dead_counter + 1)
 
-        # wrap the counter
-        with m.If(bit_counter == bit_time):
-            sync += bit_counter.eq(0)
-        # output at the middle of the bit
-        with m.Elif(bit_counter == (bit_time >> 1)):
+        with m.If(sample):
             sync += [
                 self.data_out.eq(output),
                 self.data_out_en.eq(1), # pulse out_en
@@ -151,7 +238,26 @@ class NRZIDecoder(Elaboratable):
             sync += self.data_out_en.eq(0)
 
         # when we had no edge for 16 bits worth of time
-        # then we go back to sync state
-        with m.If(dead_counter >= bit_time << 4):
+        # (sync_length is 11 bits long), then we go back to sync state
+        with m.If(dead):
             sync += dead_counter.eq(0)
             m.next = "SYNC"
+
+        # when the frame decoder got garbage
+        # then we need to go back to SYNC state
+        with m.If(self.invalid_frame_in):
+            sync += [
+                sync_counter.eq(0),
+                dead_counter.eq(0),
+                # drop any edge latched from the garbage
+                output.eq(0),
+            ]
+            m.next = "SYNC"
+
+        if self.pipelined:
+            # do not carry decisions over into the next DECODE state
+            with m.If(dead | self.invalid_frame_in):
+                sync += [
+                    sample.eq(0),
+                    dead.eq(0),
+                ]
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+""" ADAT frame layout and bit rate.
+    This module does not depend on amaranth, so that tools which only
+    need to calculate with ADAT parameters can import it cheaply.
+"""
+
+# audio channels per frame
+CHANNELS      = 8
+# a 24 bit sample, coded as six 4b/5b nibbles
+CHANNEL_BITS  = 24 + 6
+# 1 separator bit, 10 zero bits and 1 separator bit
+SYNC_PAD_BITS = 1 + 10 + 1
+USER_BITS     = 4
+FRAME_BITS    = CHANNELS * CHANNEL_BITS + SYNC_PAD_BITS + USER_BITS
+# the transmit FIFO holds a frame border word with the user bits, and one word per channel
+FIFO_WORDS_PER_FRAME = CHANNELS + 1
+
+def adat_freq(samplerate: int = 48000) -> int:
+    """calculate the ADAT bit rate for the given samplerate"""
+    return samplerate * FRAME_BITS
+
+def transmit_fifo_depth(latency_frames: int, jitter_frames: int = 1) -> int:
+    """calculate the transmit FIFO depth for a latency target
+
+    Parameters
+    ----------
+    latency_frames: the number of frames waiting in the FIFO, when the producer is on time.
+        Every frame adds one frame period of latency between sample input and ADAT output
+    jitter_frames: how many frames the producer may be early or late.
+        So that a late producer does not underflow the FIFO, latency_frames
+        needs to be at least jitter_frames. An early producer needs room for its
+        frames, plus one frame, which is committed, while the oldest is transmitted.
+    """
+    if jitter_frames < 0:
+        raise ValueError(f"jitter_frames needs to be positive, not {jitter_frames}")
+    if latency_frames < max(jitter_frames, 1):
+        raise ValueError(f"latency_frames needs to be at least 1 and jitter_frames ({jitter_frames}), "
+                         f"not {latency_frames}")
+    return (latency_frames + jitter_frames + 1) * FIFO_WORDS_PER_FRAME
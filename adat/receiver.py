@@ -4,7 +4,7 @@
 # SPDX-License-Identifier: CERN-OHL-W-2.0
 #
 """ADAT receiver core"""
-from amaranth          import Elaboratable, Signal, Module, Mux
+from amaranth          import Elaboratable, Signal, Module, Mux, Cat, Const
 
 from adat.nrzidecoder  import NRZIDecoder
 from amlib.utils       import InputShiftRegister, EdgeToPulse
@@ -12,8 +12,35 @@ from amlib.utils       import InputShiftRegister, EdgeToPulse
 class ADATReceiver(Elaboratable):
     """
         implements the ADAT protocol
+
+        With pipelined=True, the decision to output a sample is registered
+        one cycle ahead, and the NRZI decoder runs in pipelined mode as well.
+        The output timing is the same.
+
+        Only the channels set in channel_mask_in are output. The mask is taken over
+        at the start of every frame, after the user bits, so that a frame is never
+        output with two different masks.
+
+        output_format selects an additional 32 bit word output of the enabled channels:
+        "sample" has no word output, "left_justified" outputs one word per channel
+        with the sample in the upper 24 bits, "packed16" outputs two 16 bit samples
+        per word, truncated to their upper 16 bits, the lower channel in the lower half.
+        When an odd number of channels is enabled, the upper half of the last word
+        of the frame is zero. The words are output one cycle after the samples.
+
+        With timestamps=True, frame_counter_out counts the frames received and
+        timestamp_out holds the sync clock cycle at which the current frame started,
+        taken at the end of the user bits. Both change together with user_data_out.
+        The cycle counter runs from reset, so the timestamps of all receivers
+        in the same clock domain can be compared directly.
     """
-    def __init__(self, clk_freq):
+    OUTPUT_FORMATS = ("sample", "left_justified", "packed16")
+
+    def __init__(self, clk_freq, min_samplerate=44100, max_samplerate=48000, pipelined=False, output_format="sample",
+                 timestamps=False, timestamp_width=32):
+        if output_format not in self.OUTPUT_FORMATS:
+            raise ValueError(f"output_format needs to be one of {', '.join(self.OUTPUT_FORMATS)}, not '{output_format}'")
+
         # I/O
         self.adat_in             = Signal()
         self.addr_out            = Signal(3)
@@ -22,9 +49,31 @@ class ADATReceiver(Elaboratable):
         self.user_data_out       = Signal(4)
         self.recovered_clock_out = Signal()
         self.synced_out          = Signal()
+        # no input edges for longer than a sync pad, see NRZIDecoder
+        self.idle_out            = Signal()
+        # strobed in the middle of every ADAT bit, see NRZIDecoder.data_out_en
+        self.bit_strobe_out      = Signal()
+        self.channel_mask_in     = Signal(8, reset=0xff)
+
+        # word output, only with output_format other than "sample"
+        self.word_out            = Signal(32)
+        # the channel of the sample in the lower half of a packed word
+        self.word_channel_out    = Signal(3)
+        self.word_valid_out      = Signal()
+        # the last word of the frame
+        self.word_last_out       = Signal()
+
+        # frame sequence counter and start time, only with timestamps=True
+        self.frame_counter_out   = Signal(16)
+        self.timestamp_out       = Signal(timestamp_width)
 
         # Parameters
         self.clk_freq            = clk_freq
+        self.min_samplerate      = min_samplerate
+        self.max_samplerate      = max_samplerate
+        self.pipelined           = pipelined
+        self.output_format       = output_format
+        self.timestamps          = timestamps
 
     def elaborate(self, platform) -> Module:
         """build the module"""
@@ -32,7 +81,7 @@ class ADATReceiver(Elaboratable):
         sync = m.d.sync
         comb = m.d.comb
 
-        nrzidecoder = NRZIDecoder(self.clk_freq)
+        nrzidecoder = NRZIDecoder(self.clk_freq, self.min_samplerate, self.max_samplerate, self.pipelined)
         m.submodules.nrzi_decoder = nrzidecoder
 
         framedata_shifter = InputShiftRegister(24)
@@ -48,13 +97,33 @@ class ADATReceiver(Elaboratable):
         nibble_counter   = Signal(3)
         # counts, how many 0 bits it got in a row
         sync_bit_counter = Signal(4)
+        # at which bit of bit_counter to output sample data at
+        output_at        = Signal(8)
+        # output the sample of the current channel
+        output_sample    = Signal()
+        # output_enable, before the channel mask is applied
+        sample_enable    = Signal()
+        # the channel mask of the current frame
+        frame_mask       = Signal(8, reset=0xff)
+        frame_start      = Signal()
 
         comb += [
             nrzidecoder.nrzi_in.eq(self.adat_in),
             self.synced_out.eq(nrzidecoder.running),
+            self.idle_out.eq(nrzidecoder.idle_out),
+            self.bit_strobe_out.eq(nrzidecoder.data_out_en),
             self.recovered_clock_out.eq(nrzidecoder.recovered_clock_out),
+            self.output_enable.eq(sample_enable & frame_mask.bit_select(self.addr_out, 1)),
         ]
 
+        if self.pipelined:
+            # one bit before the bit at which the sample is output, minus one cycle:
+            # bit_counter is output_at in the next cycle
+            output_before = Signal(8)
+            sync += output_sample.eq(nrzidecoder.data_out_en & (bit_counter >= 5) & (bit_counter == output_before))
+        else:
+            comb += output_sample.eq((bit_counter > 5) & (bit_counter == output_at))
+
         with m.FSM():
             # wait for SYNC
             with m.State("WAIT_SYNC"):
@@ -77,29 +146,32 @@ class ADATReceiver(Elaboratable):
                             m.next = "READ_FRAME"
 
             with m.State("READ_FRAME"):
-                # at which bit of bit_counter to output sample data at
-                output_at = Signal(8)
-
                 # user bits have been read
                 with m.If(bit_counter == 5):
+                    comb += frame_start.eq(1)
                     sync += [
+                        frame_mask.eq(self.channel_mask_in),
                         # output user bits
                         self.user_data_out.eq(framedata_shifter.value_out[0:4]),
                         # at bit 35 the first channel has been read
                         output_at.eq(35)
                     ]
+                    if self.pipelined:
+                        sync += output_before.eq(34)
 
                 # when each channel has been read, output the channel's sample
-                with m.If((bit_counter > 5) & (bit_counter == output_at)):
+                with m.If(output_sample):
                     sync += [
-                        self.output_enable.eq(1),
+                        sample_enable.eq(1),
                         self.addr_out.eq(active_channel),
                         self.sample_out.eq(framedata_shifter.value_out),
                         output_at.eq(output_at + 30),
                         active_channel.eq(active_channel + 1)
                     ]
+                    if self.pipelined:
+                        sync += output_before.eq(output_before + 30)
                 with m.Else():
-                    sync += self.output_enable.eq(0)
+                    sync += sample_enable.eq(0)
 
                 # we work and count only when we get
                 # a new bit fron the NRZI decoder
@@ -141,7 +213,7 @@ class ADATReceiver(Elaboratable):
             # read the sync bits
             with m.State("READ_SYNC"):
                 sync += [
-                    self.output_enable.eq(output_pulser.pulse_out),
+                    sample_enable.eq(output_pulser.pulse_out),
                     self.addr_out.eq(active_channel),
                     self.sample_out.eq(framedata_shifter.value_out),
                 ]
@@ -181,4 +253,68 @@ class ADATReceiver(Elaboratable):
                 with m.If(~nrzidecoder.running):
                     m.next = "WAIT_SYNC"
 
-        return m
\ No newline at end of file
+        if self.output_format != "sample":
+            self.word_output(m, frame_mask, frame_start)
+
+        if self.timestamps:
+            cycle_counter = Signal.like(self.timestamp_out)
+            sync += cycle_counter.eq(cycle_counter + 1)
+            # bit_counter advances with the next data bit, so this is true for one cycle per frame
+            with m.If(frame_start & nrzidecoder.data_out_en):
+                sync += [
+                    self.frame_counter_out .eq(self.frame_counter_out + 1),
+                    self.timestamp_out     .eq(cycle_counter),
+                ]
+
+        return m
+
+    def word_output(self, m: Module, frame_mask: Signal, frame_start: Signal):
+        """pack the samples of the enabled channels into 32 bit words"""
+        sync = m.d.sync
+
+        # no enabled channel follows the current one in this frame
+        last_channel = Signal()
+        m.d.comb += last_channel.eq((frame_mask >> (self.addr_out + 1)) == 0)
+
+        sync += self.word_valid_out.eq(0)
+
+        if self.output_format == "left_justified":
+            with m.If(self.output_enable):
+                sync += [
+                    self.word_out         .eq(Cat(Const(0, 8), self.sample_out)),
+                    self.word_channel_out .eq(self.addr_out),
+                    self.word_valid_out   .eq(1),
+                    self.word_last_out    .eq(last_channel),
+                ]
+            return
+
+        # packed16: hold the first sample of a pair, until the second one arrives
+        pending         = Signal()
+        pending_sample  = Signal(16)
+        pending_channel = Signal(3)
+
+        with m.If(frame_start):
+            sync += pending.eq(0)
+
+        with m.If(self.output_enable):
+            with m.If(pending):
+                sync += [
+                    self.word_out         .eq(Cat(pending_sample, self.sample_out[8:])),
+                    self.word_channel_out .eq(pending_channel),
+                    self.word_valid_out   .eq(1),
+                    self.word_last_out    .eq(last_channel),
+                    pending               .eq(0),
+                ]
+            with m.Elif(last_channel):
+                sync += [
+                    self.word_out         .eq(self.sample_out[8:]),
+                    self.word_channel_out .eq(self.addr_out),
+                    self.word_valid_out   .eq(1),
+                    self.word_last_out    .eq(1),
+                ]
+            with m.Else():
+                sync += [
+                    pending_sample  .eq(self.sample_out[8:]),
+                    pending_channel .eq(self.addr_out),
+                    pending         .eq(1),
+                ]
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+"""ADAT repeater core"""
+from amaranth import Elaboratable, Signal, Module, Cat, Const, Mux, Memory, DomainRenamer, EnableInserter
+
+from amlib.utils import NRZIEncoder
+
+from adat.nrzidecoder import NRZIDecoder
+from adat.protocol    import CHANNELS, CHANNEL_BITS, USER_BITS
+
+class ADATRepeater(Elaboratable):
+    """regenerate an ADAT signal bit by bit, with the bit timing recovered by NRZIDecoder
+
+    Every decoded bit is NRZI encoded again one clock cycle after the decoder outputs it,
+    so the output follows the input half a bit and about four sync clock cycles later,
+    about one bit at 100 MHz, instead of after a whole frame and a FIFO,
+    like with ADATReceiver and ADATTransmitter. The output edges are retimed
+    to the sync clock at the middle of the recovered bits, so the pulse width distortion
+    of the input does not pass through. The decoder follows every input edge, so slow jitter does.
+    While the decoder is not locked, the output does not change.
+
+    The repeater follows the frames after every sync pad, without resynchronizing
+    the decoder on errors, so it repeats malformed frames as they are.
+
+    Parameters
+    ----------
+    clk_freq, min_samplerate, max_samplerate, pipelined: see ADATReceiver
+    tap: output the received samples like ADATReceiver does
+
+    Attributes
+    ----------
+    adat_in: Signal
+        the ADAT signal from the optical receiver
+    adat_out: Signal
+        the regenerated ADAT signal, in the sync domain
+    synced_out: Signal
+        high while the repeater knows the position of the bits in the frame
+    recovered_clock_out: Signal
+        the recovered ADAT bit clock, see ``NRZIDecoder.recovered_clock_out``
+    overwrite_mask_in: Signal
+        the channels set in the mask are replaced by the samples written with ``addr_in``,
+        ``sample_in`` and ``valid_in``. The mask is taken over at the end of every sync pad
+    addr_in: Signal
+        the channel to write the overwrite sample of
+    sample_in: Signal
+        the 24 bit sample, which replaces the channel, until another sample is written
+    valid_in: Signal
+        writes sample_in
+    addr_out, sample_out, output_enable, user_data_out: Signal
+        only with tap=True: the received samples, before they are overwritten, see ADATReceiver
+    """
+    def __init__(self, clk_freq, min_samplerate=44100, max_samplerate=48000, pipelined=False, tap=False):
+        self.adat_in             = Signal()
+        self.adat_out            = Signal()
+        self.synced_out          = Signal()
+        self.recovered_clock_out = Signal()
+
+        self.overwrite_mask_in   = Signal(CHANNELS)
+        self.addr_in             = Signal(3)
+        self.sample_in           = Signal(24)
+        self.valid_in            = Signal()
+
+        self.addr_out            = Signal(3)
+        self.sample_out          = Signal(24)
+        self.output_enable       = Signal()
+        self.user_data_out       = Signal(USER_BITS)
+
+        self.clk_freq            = clk_freq
+        self.min_samplerate      = min_samplerate
+        self.max_samplerate      = max_samplerate
+        self.pipelined           = pipelined
+        self.tap                 = tap
+
+        self.mem = Memory(width=24, depth=CHANNELS, name="overwrite_samples")
+
+    @staticmethod
+    def channel_word(sample: Signal) -> Signal:
+        """the 30 bits of a channel, MSB first: every nibble is preceded by a 1"""
+        return Cat(*[Cat(sample[4 * nibble:4 * nibble + 4], Const(1, 1)) for nibble in range(6)])
+
+    def elaborate(self, platform) -> Module:
+        m = Module()
+        sync = m.d.sync
+        comb = m.d.comb
+
+        m.submodules.nrzi_decoder = decoder = \
+            NRZIDecoder(self.clk_freq, self.min_samplerate, self.max_samplerate, self.pipelined)
+
+        # encode one bit per decoded bit, in the sync domain
+        nrzi_encoder = NRZIEncoder()
+        m.submodules.nrzi_encoder = DomainRenamer({"adat": "sync"})(EnableInserter({"adat": decoder.data_out_en})(nrzi_encoder))
+
+        write_port = self.mem.write_port()
+        read_port  = self.mem.read_port(domain="comb")
+        m.submodules += [write_port, read_port]
+
+        bit = decoder.data_out
+
+        comb += [
+            decoder.nrzi_in          .eq(self.adat_in),
+            self.recovered_clock_out .eq(decoder.recovered_clock_out),
+            self.adat_out            .eq(nrzi_encoder.nrzi_out),
+            write_port.addr          .eq(self.addr_in),
+            write_port.data          .eq(self.sample_in),
+            write_port.en            .eq(self.valid_in),
+        ]
+
+        # zero bits in a row, only the sync pad has ten of them
+        zero_bits      = Signal(range(11))
+        # between the end of the sync pad and the end of the last channel
+        in_frame       = Signal()
+        in_channel     = Signal()
+        channel        = Signal(3)
+        next_channel   = Signal(range(CHANNELS + 1))
+        # bits left in the user bits or the current channel, including the current bit
+        bits_left      = Signal(range(CHANNEL_BITS + 1))
+        # the position of the current bit in its nibble, 0 is the separator
+        nibble_bit     = Signal(range(5))
+        frame_mask     = Signal(CHANNELS)
+        overwrite_word = Signal(CHANNEL_BITS)
+        overwrite      = Signal()
+
+        comb += [
+            read_port.addr.eq(next_channel),
+            overwrite.eq(in_channel & frame_mask.bit_select(channel, 1)),
+            nrzi_encoder.data_in.eq(Mux(overwrite, overwrite_word[-1], bit)),
+        ]
+
+        with m.If(~decoder.running):
+            sync += [
+                zero_bits       .eq(0),
+                in_frame        .eq(0),
+                in_channel      .eq(0),
+                self.synced_out .eq(0),
+            ]
+
+        with m.Elif(decoder.data_out_en):
+            with m.If(bit):
+                sync += zero_bits.eq(0)
+            with m.Elif(zero_bits < 10):
+                sync += zero_bits.eq(zero_bits + 1)
+
+            # the last bit of the sync pad: the user bits follow
+            with m.If(bit & (zero_bits == 10)):
+                sync += [
+                    in_frame        .eq(1),
+                    in_channel      .eq(0),
+                    next_channel    .eq(0),
+                    bits_left       .eq(USER_BITS),
+                    frame_mask      .eq(self.overwrite_mask_in),
+                    self.synced_out .eq(1),
+                ]
+
+            with m.Elif(in_frame):
+                sync += [
+                    bits_left      .eq(bits_left - 1),
+                    overwrite_word .eq(overwrite_word << 1),
+                    nibble_bit     .eq(Mux(nibble_bit == 4, 0, nibble_bit + 1)),
+                ]
+
+                with m.If(in_channel & (nibble_bit == 0) & ~bit):
+                    # missing nibble separator, wait for the next sync pad
+                    sync += [
+                        in_frame        .eq(0),
+                        in_channel      .eq(0),
+                        self.synced_out .eq(0),
+                    ]
+
+                with m.Elif(bits_left == 1):
+                    with m.If(next_channel == CHANNELS):
+                        # the sync pad follows
+                        sync += [
+                            in_frame   .eq(0),
+                            in_channel .eq(0),
+                        ]
+                    with m.Else():
+                        sync += [
+                            in_channel     .eq(1),
+                            channel        .eq(next_channel),
+                            next_channel   .eq(next_channel + 1),
+                            bits_left      .eq(CHANNEL_BITS),
+                            nibble_bit     .eq(0),
+                            overwrite_word .eq(self.channel_word(read_port.data)),
+                        ]
+
+        if self.tap:
+            self.tap_output(m, decoder, in_frame, in_channel, channel, bits_left, nibble_bit)
+
+        return m
+
+    def tap_output(self, m: Module, decoder: NRZIDecoder, in_frame: Signal, in_channel: Signal, channel: Signal,
+                   bits_left: Signal, nibble_bit: Signal):
+        """shift in the data bits of the frame and output the samples and the user bits"""
+        sync = m.d.sync
+        bit  = decoder.data_out
+
+        shifter = Signal(24)
+        sync += self.output_enable.eq(0)
+
+        with m.If(decoder.data_out_en & in_frame & ~(in_channel & (nibble_bit == 0))):
+            sync += shifter.eq(Cat(bit, shifter[:-1]))
+
+            with m.If((bits_left == 1) & in_channel):
+                sync += [
+                    self.sample_out    .eq(Cat(bit, shifter[:-1])),
+                    self.addr_out      .eq(channel),
+                    self.output_enable .eq(1),
+                ]
+            with m.Elif(bits_left == 1):
+                sync += self.user_data_out.eq(Cat(bit, shifter[:USER_BITS - 1]))
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+""" Ring buffers for block based host access to the ADAT cores.
+    Frames are stored in a dual-port memory, eight consecutive
+    32 bit words per frame, one word per channel:
+    bits 0-23 hold the sample, bits 24-27 the user bits of the frame.
+"""
+
+from amaranth import Elaboratable, Signal, Module, Cat, Memory
+
+def _check_frames(frames: int):
+    if frames < 2 or (frames & (frames - 1)) != 0:
+        raise ValueError(f"ring buffer size must be a power of two >= 2, not {frames}")
+
+class ADATRingBufferWriter(Elaboratable):
+    """write the frames decoded by ADATReceiver into a dual-port ring buffer
+
+    The ring buffer is split into two blocks of frames/2 frames each.
+    While the receiver fills one block, the host can bulk-read the other one.
+
+    Parameters
+    ----------
+    frames: number of ADAT frames the ring buffer holds, must be a power of two
+
+    Attributes
+    ----------
+    addr_in: Signal
+        connect to ``ADATReceiver.addr_out``
+    sample_in: Signal
+        connect to ``ADATReceiver.sample_out``
+    valid_in: Signal
+        connect to ``ADATReceiver.output_enable``
+    user_data_in: Signal
+        connect to ``ADATReceiver.user_data_out``
+    bus_addr_in: Signal
+        word address of the host read port. The word of channel c of
+        frame f is at address f * 8 + c
+    bus_data_out: Signal
+        the word read by the host, valid one cycle after ``bus_addr_in``
+    write_pointer_out: Signal
+        index of the frame which is currently being written
+    frame_counter_out: Signal
+        number of complete frames written since reset, wraps around
+    half_block_out: Signal
+        strobed when the first block of the ring buffer has been filled
+    full_block_out: Signal
+        strobed when the second block of the ring buffer has been filled
+        and the write pointer wraps around
+    irq_out: Signal
+        goes high on ``half_block_out`` or ``full_block_out``
+        and stays high until ``irq_ack_in`` is strobed
+    irq_ack_in: Signal
+        acknowledges the interrupt
+    """
+
+    def __init__(self, frames: int=256):
+        _check_frames(frames)
+        self._frames           = frames
+
+        self.addr_in           = Signal(3)
+        self.sample_in         = Signal(24)
+        self.valid_in          = Signal()
+        self.user_data_in      = Signal(4)
+
+        self.bus_addr_in       = Signal(range(frames * 8))
+        self.bus_data_out      = Signal(32)
+
+        self.write_pointer_out = Signal(range(frames))
+        self.frame_counter_out = Signal(32)
+        self.half_block_out    = Signal()
+        self.full_block_out    = Signal()
+        self.irq_out           = Signal()
+        self.irq_ack_in        = Signal()
+
+        self.mem = Memory(width=32, depth=frames * 8, name="receive_ringbuffer")
+
+    def elaborate(self, platform) -> Module:
+        m = Module()
+        sync = m.d.sync
+        comb = m.d.comb
+
+        write_port = self.mem.write_port()
+        read_port  = self.mem.read_port()
+        m.submodules += [write_port, read_port]
+
+        comb += [
+            write_port.addr   .eq(Cat(self.addr_in, self.write_pointer_out)),
+            write_port.data   .eq(Cat(self.sample_in, self.user_data_in)),
+            write_port.en     .eq(self.valid_in),
+            read_port.addr    .eq(self.bus_addr_in),
+            self.bus_data_out .eq(read_port.data),
+        ]
+
+        sync += [
+            self.half_block_out.eq(0),
+            self.full_block_out.eq(0),
+        ]
+
+        with m.If(self.irq_ack_in):
+            sync += self.irq_out.eq(0)
+
+        # a frame is complete, when the last channel has been written.
+        # Incomplete frames (after loss of sync) will just be overwritten.
+        with m.If(self.valid_in & (self.addr_in == 7)):
+            sync += [
+                self.write_pointer_out.eq(self.write_pointer_out + 1),
+                self.frame_counter_out.eq(self.frame_counter_out + 1),
+            ]
+
+            with m.If(self.write_pointer_out == (self._frames // 2 - 1)):
+                sync += [
+                    self.half_block_out.eq(1),
+                    self.irq_out.eq(1),
+                ]
+
+            with m.If(self.write_pointer_out == (self._frames - 1)):
+                sync += [
+                    self.full_block_out.eq(1),
+                    self.irq_out.eq(1),
+                ]
+
+        return m
+
+class ADATRingBufferReader(Elaboratable):
+    """feed ADATTransmitter with frames from a dual-port ring buffer filled by the host
+
+    The host writes whole frames into the ring buffer and then advances
+    ``write_pointer_in``. The reader pushes the frames into the transmitter
+    as fast as the transmitter accepts them.
+    The frame pointers have one more bit than needed to address a frame,
+    to be able to distinguish a full from an empty ring buffer.
+
+    Parameters
+    ----------
+    frames: number of ADAT frames the ring buffer holds, must be a power of two
+    low_watermark: reset value of ``watermark_in``
+
+    Attributes
+    ----------
+    bus_addr_in: Signal
+        word address of the host write port. The word of channel c of
+        frame f is at address f * 8 + c
+    bus_data_in: Signal
+        the word to be written by the host
+    bus_we_in: Signal
+        write strobe of the host write port
+    write_pointer_in: Signal
+        the host advances this pointer after it has written a frame
+    read_pointer_out: Signal
+        points to the frame which is currently being transmitted
+    fill_level_out: Signal
+        number of frames in the ring buffer, which have not been transmitted yet
+    watermark_in: Signal
+        the low watermark of the ring buffer, in frames
+    low_watermark_out: Signal
+        high, when ``fill_level_out`` is at or below ``watermark_in``
+    irq_out: Signal
+        goes high when the fill level drops to the low watermark
+        and stays high until ``irq_ack_in`` is strobed
+    irq_ack_in: Signal
+        acknowledges the interrupt
+    addr_out: Signal
+        connect to ``ADATTransmitter.addr_in``
+    sample_out: Signal
+        connect to ``ADATTransmitter.sample_in``
+    user_data_out: Signal
+        connect to ``ADATTransmitter.user_data_in``
+    valid_out: Signal
+        connect to ``ADATTransmitter.valid_in``
+    last_out: Signal
+        connect to ``ADATTransmitter.last_in``
+    ready_in: Signal
+        connect to ``ADATTransmitter.ready_out``
+    """
+
+    def __init__(self, frames: int=256, low_watermark: int=None):
+        _check_frames(frames)
+        self._frames           = frames
+        if low_watermark is None:
+            low_watermark = frames // 4
+
+        self.bus_addr_in       = Signal(range(frames * 8))
+        self.bus_data_in       = Signal(32)
+        self.bus_we_in         = Signal()
+
+        self.write_pointer_in  = Signal(range(2 * frames))
+        self.read_pointer_out  = Signal(range(2 * frames))
+        self.fill_level_out    = Signal(range(frames + 1))
+        self.watermark_in      = Signal(range(frames + 1), reset=low_watermark)
+        self.low_watermark_out = Signal()
+        self.irq_out           = Signal()
+        self.irq_ack_in        = Signal()
+
+        self.addr_out          = Signal(3)
+        self.sample_out        = Signal(24)
+        self.user_data_out     = Signal(4)
+        self.valid_out         = Signal()
+        self.last_out          = Signal()
+        self.ready_in          = Signal()
+
+        self.mem = Memory(width=32, depth=frames * 8, name="transmit_ringbuffer")
+
+    def elaborate(self, platform) -> Module:
+        m = Module()
+        sync = m.d.sync
+        comb = m.d.comb
+
+        write_port = self.mem.write_port()
+        read_port  = self.mem.read_port(transparent=False)
+        m.submodules += [write_port, read_port]
+
+        frame_bits = len(self.read_pointer_out) - 1
+
+        comb += [
+            write_port.addr .eq(self.bus_addr_in),
+            write_port.data .eq(self.bus_data_in),
+            write_port.en   .eq(self.bus_we_in),
+
+            self.fill_level_out    .eq((self.write_pointer_in - self.read_pointer_out)[:len(self.read_pointer_out)]),
+            self.low_watermark_out .eq(self.fill_level_out <= self.watermark_in),
+        ]
+
+        # raise the interrupt when we drop to the watermark
+        low_watermark_prev = Signal(reset=1)
+        sync += low_watermark_prev.eq(self.low_watermark_out)
+
+        with m.If(self.irq_ack_in):
+            sync += self.irq_out.eq(0)
+        with m.If(self.low_watermark_out & ~low_watermark_prev):
+            sync += self.irq_out.eq(1)
+
+        #
+        # fetch the words of the current frame from memory.
+        # A word is read one cycle ahead, so that it is already
+        # waiting at the output when the transmitter is ready for it.
+        #
+        fetching      = Signal()
+        fetch         = Signal()
+        fetch_channel = Signal(3)
+        word_valid    = Signal()
+        accepted      = Signal()
+
+        comb += [
+            accepted           .eq(self.valid_out & self.ready_in),
+            # the read port only updates its data when we fetch,
+            # so it keeps the current word while the transmitter is stalled
+            fetch              .eq(fetching & (~word_valid | accepted)),
+            read_port.en       .eq(fetch),
+            read_port.addr     .eq(Cat(fetch_channel, self.read_pointer_out[:frame_bits])),
+
+            self.valid_out     .eq(word_valid),
+            self.sample_out    .eq(read_port.data[:24]),
+            self.user_data_out .eq(read_port.data[24:28]),
+            self.last_out      .eq(word_valid & (self.addr_out == 7)),
+        ]
+
+        with m.If(fetch):
+            sync += [
+                word_valid     .eq(1),
+                self.addr_out  .eq(fetch_channel),
+                fetch_channel  .eq(fetch_channel + 1),
+            ]
+            with m.If(fetch_channel == 7):
+                sync += fetching.eq(0)
+        with m.Elif(accepted):
+            sync += word_valid.eq(0)
+
+        # the whole frame has been transmitted
+        with m.If(accepted & (self.addr_out == 7)):
+            sync += self.read_pointer_out.eq(self.read_pointer_out + 1)
+
+        with m.If(~fetching & ~word_valid & (self.fill_level_out != 0)):
+            sync += fetching.eq(1)
+
+        return m
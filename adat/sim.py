@@ -0,0 +1,1104 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+""" Simulation transactors for the ADAT cores.
+
+    * DUT wrappers, which feed the ADAT input of a core from the ``adat`` domain,
+      so that a stimulus can be driven at the ADAT bit rate
+    * stimulus drivers, which stream from NumPy arrays
+    * monitors, which collect the outputs of a core into preallocated NumPy arrays
+    * vectorized ADAT frame and NRZI coding, to generate stimuli and check results
+    * a clock process with jitter, and a comparison of sent and received frames,
+      for loopback tests of the transmitter and the receiver
+    * streaming checkers, which compare the outputs with the expected stream as they arrive,
+      and stop the simulation at the first mismatch, with a report of the frames or bits
+      around it and a VCD file of the last clock cycles
+    * fault injection into bit streams and line levels
+    * batches of independent DUTs in one simulation, with one stimulus column
+      and one set of results per DUT, because the simulator spends most of its time
+      per clock cycle and per process, and not per signal
+
+    Drivers are generators, to be run with ``yield from`` in a simulator process.
+    Monitors have a ``process`` method to be passed to ``Simulator.add_sync_process``.
+    They are passive, so the simulation ends, when the stimulus processes are done.
+"""
+
+import collections
+
+try:
+    import numpy as np
+except ImportError as e:
+    raise ImportError("adat.sim needs numpy, install it with: pip install adat[sim]") from e
+
+from amaranth     import Elaboratable, Signal, Module, ClockDomain, DomainRenamer, Cat
+from amaranth.sim import Tick, Settle, Passive, Delay
+
+from adat.nrzidecoder import NRZIDecoder
+from adat.receiver    import ADATReceiver
+from adat.transmitter import ADATTransmitter
+from adat.repeater    import ADATRepeater
+from adat.protocol    import CHANNELS, CHANNEL_BITS, SYNC_PAD_BITS, USER_BITS, FRAME_BITS
+
+#
+# ADAT frame and NRZI coding
+#
+def random_frames(frames: int, seed: int=0) -> tuple:
+    """(samples, user_data) of shape (frames, 8) and (frames,) with random content"""
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 1 << 24, size=(frames, CHANNELS)), rng.integers(0, 1 << USER_BITS, size=frames)
+
+def encode_frames(samples, user_data=None) -> np.ndarray:
+    """encode frames of eight 24 bit samples into the ADAT bit stream, before NRZI coding
+
+    Parameters
+    ----------
+    samples: array of shape (frames, 8)
+    user_data: array of shape (frames,) with the user bits of each frame, defaults to 0
+    """
+    samples = np.asarray(samples, dtype=np.int64).reshape(-1, CHANNELS)
+    frames  = len(samples)
+    user_data = np.zeros(frames, dtype=np.int64) if user_data is None else np.asarray(user_data, dtype=np.int64)
+
+    bits = np.zeros((frames, FRAME_BITS), dtype=np.uint8)
+    # sync pad: 1, ten zeros, 1
+    bits[:, 0] = 1
+    bits[:, SYNC_PAD_BITS - 1] = 1
+    # user bits, MSB first
+    bits[:, SYNC_PAD_BITS:SYNC_PAD_BITS + USER_BITS] = (user_data[:, None] >> np.arange(USER_BITS - 1, -1, -1)) & 1
+
+    # every channel has six nibbles, MSB first, each preceded by a 1
+    sample_bits = ((samples[:, :, None] >> np.arange(23, -1, -1)) & 1).reshape(frames, CHANNELS, 6, 4)
+    separators  = np.ones((frames, CHANNELS, 6, 1), dtype=np.int64)
+    channel_bits = np.concatenate([separators, sample_bits], axis=3).reshape(frames, CHANNELS * CHANNEL_BITS)
+    bits[:, SYNC_PAD_BITS + USER_BITS:] = channel_bits
+
+    return bits.reshape(-1)
+
+def decode_frames(bits) -> tuple:
+    """decode an ADAT bit stream, after NRZI decoding, which starts with a sync pad
+
+    Returns
+    -------
+    (samples, user_data) of shape (frames, 8) and (frames,).
+    Incomplete frames at the end are ignored.
+    Raises ValueError, if a sync pad or a nibble separator is missing.
+    """
+    bits   = np.asarray(bits, dtype=np.int64)
+    frames = len(bits) // FRAME_BITS
+    bits   = bits[:frames * FRAME_BITS].reshape(frames, FRAME_BITS)
+
+    expected_sync_pad = np.zeros(SYNC_PAD_BITS, dtype=np.int64)
+    expected_sync_pad[[0, -1]] = 1
+    bad_frames = np.flatnonzero(np.any(bits[:, :SYNC_PAD_BITS] != expected_sync_pad, axis=1))
+    if len(bad_frames):
+        raise ValueError(f"frame {bad_frames[0]} has no valid sync pad")
+
+    user_data = bits[:, SYNC_PAD_BITS:SYNC_PAD_BITS + USER_BITS] @ (1 << np.arange(USER_BITS - 1, -1, -1))
+
+    nibbles = bits[:, SYNC_PAD_BITS + USER_BITS:].reshape(frames, CHANNELS, 6, 5)
+    bad_frames = np.flatnonzero(np.any(nibbles[:, :, :, 0] != 1, axis=(1, 2)))
+    if len(bad_frames):
+        raise ValueError(f"frame {bad_frames[0]} has a missing nibble separator")
+
+    samples = nibbles[:, :, :, 1:].reshape(frames, CHANNELS, 24) @ (1 << np.arange(23, -1, -1))
+    return samples, user_data
+
+def format_frames(samples, channel_mask: int=0xff, output_format: str="sample") -> np.ndarray:
+    """the samples, as an ADATReceiver with this channel mask and output format outputs them:
+       the samples of disabled channels are 0, and packed16 keeps the upper 16 bits"""
+    samples = np.array(samples, dtype=np.int64).reshape(-1, CHANNELS)
+    samples[:, [channel for channel in range(CHANNELS) if not (channel_mask >> channel) & 1]] = 0
+    if output_format == "packed16":
+        samples >>= 8
+    return samples
+
+def find_sync_pads(bits) -> np.ndarray:
+    """the positions of all sync pads in an ADAT bit stream, after NRZI decoding"""
+    bits = np.asarray(bits, dtype=np.uint8)
+    if len(bits) < SYNC_PAD_BITS:
+        return np.zeros(0, dtype=np.int64)
+    expected_sync_pad = np.zeros(SYNC_PAD_BITS, dtype=np.uint8)
+    expected_sync_pad[[0, -1]] = 1
+    windows = np.lib.stride_tricks.sliding_window_view(bits, SYNC_PAD_BITS)
+    return np.flatnonzero(np.all(windows == expected_sync_pad, axis=1))
+
+def line_frames(bits) -> tuple:
+    """decode every complete frame, which starts at a sync pad, of a bit stream after NRZI decoding.
+       Unlike decode_frames, the stream does not need to be aligned or free of errors
+
+    Returns
+    -------
+    (samples, user_data, pads) of shape (frames, 8), (frames,) and (frames,),
+    pads are the positions of the sync pads of the frames in the bit stream.
+    The samples of malformed frames are all -1, so that they count as errored frames.
+    """
+    pads = find_sync_pads(bits)
+    pads = pads[pads + FRAME_BITS <= len(bits)]
+    samples   = np.full((len(pads), CHANNELS), -1, dtype=np.int64)
+    user_data = np.zeros(len(pads), dtype=np.int64)
+    for n, pad in enumerate(pads.tolist()):
+        try:
+            frame_samples, frame_user_data = decode_frames(bits[pad:pad + FRAME_BITS])
+            samples[n], user_data[n] = frame_samples[0], frame_user_data[0]
+        except ValueError:
+            pass
+    return samples, user_data, pads
+
+def encode_nrzi(bits, initial_level: int=1) -> np.ndarray:
+    """NRZI-encode a bit stream. Like ``testdata.encode_nrzi``,
+       the result starts with the initial level, so it is one longer than the input"""
+    levels = np.bitwise_xor.accumulate(np.asarray(bits, dtype=np.uint8)) ^ np.uint8(initial_level)
+    return np.concatenate([np.array([initial_level], dtype=np.uint8), levels])
+
+def decode_nrzi(levels) -> np.ndarray:
+    """NRZI-decode a signal: every level change is a 1"""
+    levels = np.asarray(levels, dtype=np.uint8)
+    return np.diff(levels, prepend=np.uint8(0)).astype(bool).astype(np.uint8)
+
+#
+# fault injection
+#
+def separator_positions(frame: int) -> np.ndarray:
+    """the positions of the nibble separator bits of a frame in the bit stream"""
+    start = frame * FRAME_BITS + SYNC_PAD_BITS + USER_BITS
+    return start + 5 * np.arange(CHANNELS * CHANNEL_BITS // 5)
+
+def flip_bit(bits, position: int) -> np.ndarray:
+    """invert one bit of a bit stream, before NRZI coding"""
+    bits = np.array(bits, dtype=np.uint8)
+    bits[position] ^= 1
+    return bits
+
+def drop_bits(bits, position: int, length: int=1) -> np.ndarray:
+    """remove bits from a bit stream, so that the following bits arrive early"""
+    return np.delete(np.asarray(bits, dtype=np.uint8), np.arange(position, position + length))
+
+def truncate_frame(bits, frame: int, length: int) -> np.ndarray:
+    """cut the given frame after length bits, the next frame follows immediately"""
+    start = frame * FRAME_BITS
+    return drop_bits(bits, start + length, FRAME_BITS - length)
+
+def stick_levels(levels, position: int, length: int, level: int) -> np.ndarray:
+    """hold the line at level, after NRZI coding"""
+    levels = np.array(levels, dtype=np.uint8)
+    levels[position:position + length] = level
+    return levels
+
+def glitch_levels(levels, position: int, length: int=1) -> np.ndarray:
+    """invert the line for a short time, after NRZI coding.
+       To make glitches shorter than a bit, oversample the levels first"""
+    levels = np.array(levels, dtype=np.uint8)
+    levels[position:position + length] ^= 1
+    return levels
+
+#
+# DUT wrappers
+#
+class NRZIDecoderTester(Elaboratable):
+    """NRZIDecoder, with the NRZI input and invalid_frame_in driven from the adat domain,
+       and the outputs registered in the sync domain"""
+    def __init__(self, clk_freq: int, **kwargs):
+        self.nrzi_in             = Signal()
+        self.invalid_frame_in    = Signal()
+        self.data_out            = Signal()
+        self.data_out_en         = Signal()
+        self.recovered_clock_out = Signal()
+        self.decoder             = NRZIDecoder(clk_freq, **kwargs)
+
+    def elaborate(self, platform) -> Module:
+        m = Module()
+        m.submodules.nrzidecoder = decoder = self.decoder
+        m.d.adat += [
+            decoder.nrzi_in.eq(self.nrzi_in),
+            decoder.invalid_frame_in.eq(self.invalid_frame_in)
+        ]
+        m.d.sync += [
+            self.data_out.eq(decoder.data_out),
+            self.data_out_en.eq(decoder.data_out_en),
+            self.recovered_clock_out.eq(decoder.recovered_clock_out)
+        ]
+        return m
+
+class ADATReceiverTester(Elaboratable):
+    """ADATReceiver, with the ADAT input driven from the adat domain,
+       and the outputs registered in the sync domain"""
+    def __init__(self, clk_freq: int, **kwargs):
+        self.adat_in             = Signal()
+        self.addr_out            = Signal(3)
+        self.sample_out          = Signal(24)
+        self.output_enable       = Signal()
+        self.user_data_out       = Signal(4)
+        self.recovered_clock_out = Signal()
+        self.synced_out          = Signal()
+        self.idle_out            = Signal()
+        self.word_out            = Signal(32)
+        self.word_channel_out    = Signal(3)
+        self.word_valid_out      = Signal()
+        self.word_last_out       = Signal()
+        self.receiver            = ADATReceiver(clk_freq, **kwargs)
+        self.frame_counter_out   = Signal.like(self.receiver.frame_counter_out)
+        self.timestamp_out       = Signal.like(self.receiver.timestamp_out)
+        self.channel_mask_in     = self.receiver.channel_mask_in
+
+    def elaborate(self, platform) -> Module:
+        m = Module()
+        m.submodules.receiver = receiver = self.receiver
+
+        m.d.adat += receiver.adat_in.eq(self.adat_in)
+
+        m.d.sync += [
+            self.addr_out.eq(receiver.addr_out),
+            self.sample_out.eq(receiver.sample_out),
+            self.output_enable.eq(receiver.output_enable),
+            self.user_data_out.eq(receiver.user_data_out),
+            self.recovered_clock_out.eq(receiver.recovered_clock_out),
+            self.synced_out.eq(receiver.synced_out),
+            self.idle_out.eq(receiver.idle_out),
+            self.word_out.eq(receiver.word_out),
+            self.word_channel_out.eq(receiver.word_channel_out),
+            self.word_valid_out.eq(receiver.word_valid_out),
+            self.word_last_out.eq(receiver.word_last_out),
+            self.frame_counter_out.eq(receiver.frame_counter_out),
+            self.timestamp_out.eq(receiver.timestamp_out),
+        ]
+        return m
+
+class ADATTransmitterTester(Elaboratable):
+    """ADATTransmitter, with the ADAT output registered in the domain it is generated in,
+       like the flip-flop in front of an optical transmitter would"""
+    def __init__(self, **kwargs):
+        self.transmitter    = ADATTransmitter(**kwargs)
+        self.addr_in        = self.transmitter.addr_in
+        self.sample_in      = self.transmitter.sample_in
+        self.user_data_in   = self.transmitter.user_data_in
+        self.valid_in       = self.transmitter.valid_in
+        self.ready_out      = self.transmitter.ready_out
+        self.last_in        = self.transmitter.last_in
+        self.fifo_level_out = self.transmitter.fifo_level_out
+        self.underflow_out  = self.transmitter.underflow_out
+        self.adat_out       = Signal()
+        self.output_domain  = "adat" if kwargs.get("clk_freq") is None else "sync"
+
+    def elaborate(self, platform) -> Module:
+        m = Module()
+        m.submodules.transmitter = transmitter = self.transmitter
+        m.d[self.output_domain] += self.adat_out.eq(transmitter.adat_out)
+        return m
+
+class ADATRepeaterTester(Elaboratable):
+    """ADATRepeater, with the ADAT input driven from the adat domain.
+       The other signals are the ones of the repeater, its output is in the sync domain"""
+    def __init__(self, clk_freq: int, **kwargs):
+        self.adat_in             = Signal()
+        self.repeater            = ADATRepeater(clk_freq, **kwargs)
+        self.adat_out            = self.repeater.adat_out
+        self.synced_out          = self.repeater.synced_out
+        self.overwrite_mask_in   = self.repeater.overwrite_mask_in
+        self.addr_in             = self.repeater.addr_in
+        self.sample_in           = self.repeater.sample_in
+        self.valid_in            = self.repeater.valid_in
+        self.addr_out            = self.repeater.addr_out
+        self.sample_out          = self.repeater.sample_out
+        self.output_enable       = self.repeater.output_enable
+        self.user_data_out       = self.repeater.user_data_out
+
+    def elaborate(self, platform) -> Module:
+        m = Module()
+        m.submodules.repeater = repeater = self.repeater
+        m.d.adat += repeater.adat_in.eq(self.adat_in)
+        return m
+
+class ADATLoopbackTester(Elaboratable):
+    """ADATTransmitter, whose output is received by an ADATReceiver
+
+    The transmitter inputs are in the ``tx`` domain, the receiver runs in the ``sync`` domain,
+    and the ADAT signal is generated in the ``adat`` domain, so that all three clocks
+    can be driven independently. The transmitter signals are forwarded like in
+    ADATTransmitterTester, the receiver outputs are registered like in ADATReceiverTester.
+
+    Parameters
+    ----------
+    clk_freq: the frequency of the receiver clock
+    fifo_depth: the depth of the transmit FIFO
+    kwargs: passed on to ADATReceiver
+    """
+    def __init__(self, clk_freq: int, fifo_depth: int=9*4, **kwargs):
+        self.transmitter_tester  = ADATTransmitterTester(fifo_depth=fifo_depth)
+        self.receiver_tester     = ADATReceiverTester(clk_freq, **kwargs)
+
+        transmitter = self.transmitter_tester
+        self.addr_in             = transmitter.addr_in
+        self.sample_in           = transmitter.sample_in
+        self.user_data_in        = transmitter.user_data_in
+        self.valid_in            = transmitter.valid_in
+        self.ready_out           = transmitter.ready_out
+        self.last_in             = transmitter.last_in
+        self.fifo_level_out      = transmitter.fifo_level_out
+        self.underflow_out       = transmitter.underflow_out
+
+        receiver = self.receiver_tester
+        self.addr_out            = receiver.addr_out
+        self.sample_out          = receiver.sample_out
+        self.output_enable       = receiver.output_enable
+        self.user_data_out       = receiver.user_data_out
+        self.recovered_clock_out = receiver.recovered_clock_out
+        self.synced_out          = receiver.synced_out
+
+        self.adat                = Signal()
+
+        self.sync                = ClockDomain("sync")
+        self.tx                  = ClockDomain("tx")
+        self.adat_domain         = ClockDomain("adat")
+
+    def elaborate(self, platform) -> Module:
+        m = Module()
+        m.domains += [self.sync, self.tx, self.adat_domain]
+
+        m.submodules.transmitter = DomainRenamer({"sync": "tx"})(self.transmitter_tester)
+        m.submodules.receiver    = self.receiver_tester
+
+        m.d.comb += [
+            self.adat.eq(self.transmitter_tester.adat_out),
+            self.receiver_tester.adat_in.eq(self.adat),
+        ]
+        return m
+
+#
+# batches of independent DUTs
+#
+class _TesterBatch(Elaboratable):
+    """K instances of a tester, with their one bit inputs and outputs
+       packed into signals of K bits, bit k belonging to instance k"""
+    INPUTS  = []
+    OUTPUTS = []
+
+    def __init__(self, testers: list):
+        self.testers = testers
+        for name in self.INPUTS + self.OUTPUTS:
+            setattr(self, name, Signal(len(testers), name=name))
+
+    def __len__(self) -> int:
+        return len(self.testers)
+
+    def elaborate(self, platform) -> Module:
+        m = Module()
+        for k, tester in enumerate(self.testers):
+            m.submodules[f"instance{k}"] = tester
+            m.d.comb += [getattr(tester, name).eq(getattr(self, name)[k]) for name in self.INPUTS]
+            m.d.comb += [getattr(self, name)[k].eq(getattr(tester, name)) for name in self.OUTPUTS]
+        return m
+
+class NRZIDecoderBatch(_TesterBatch):
+    """K independent NRZIDecoderTesters, kwargs are passed on to NRZIDecoder"""
+    INPUTS  = ["nrzi_in", "invalid_frame_in"]
+    OUTPUTS = ["data_out", "data_out_en", "recovered_clock_out"]
+
+    def __init__(self, instances: int, clk_freq: int, **kwargs):
+        super().__init__([NRZIDecoderTester(clk_freq, **kwargs) for _ in range(instances)])
+
+class ADATReceiverBatch(_TesterBatch):
+    """K independent ADATReceiverTesters, kwargs are passed on to ADATReceiver"""
+    INPUTS  = ["adat_in"]
+    OUTPUTS = ["output_enable", "synced_out", "recovered_clock_out"]
+
+    def __init__(self, instances: int, clk_freq: int, **kwargs):
+        super().__init__([ADATReceiverTester(clk_freq, **kwargs) for _ in range(instances)])
+
+#
+# clocks
+#
+def jittered_clock(clk: Signal, period: float, jitter: float=0.0, seed: int=0):
+    """drive clk with the given period, for ``Simulator.add_process``
+
+    Every edge is displaced from its ideal time by a normally distributed time interval error
+    with a standard deviation of jitter seconds, limited to a quarter of the period,
+    so that the jitter does not accumulate.
+    """
+    rng   = np.random.default_rng(seed)
+    limit = period / 4
+    now   = 0.0
+    edge  = 0
+
+    yield Passive()
+    while True:
+        for error in np.clip(rng.normal(0.0, jitter, 4096), -limit, limit).tolist():
+            edge += 1
+            time  = edge * period / 2 + error
+            yield Delay(time - now)
+            now   = time
+            yield clk.eq(edge & 1)
+
+#
+# stimulus drivers
+#
+def drive_levels(signal: Signal, levels, domain: str="adat"):
+    """drive signal with one level of the array per clock cycle of domain"""
+    for level in np.asarray(levels).tolist():
+        yield signal.eq(level)
+        yield Tick(domain)
+
+def pack_columns(columns) -> list:
+    """pack every row of a (cycles, K) array of bits into an integer, column k into bit k"""
+    columns = np.asarray(columns, dtype=np.uint8).reshape(len(columns), -1)
+    rows = np.packbits(columns, axis=1, bitorder="little")
+    return [int.from_bytes(row.tobytes(), "little") for row in rows]
+
+def stack_columns(streams) -> np.ndarray:
+    """stack streams of different lengths into a (cycles, K) array,
+       shorter streams are continued with their last value"""
+    length = max(len(stream) for stream in streams)
+    return np.stack([np.pad(np.asarray(stream, dtype=np.uint8), (0, length - len(stream)), mode="edge")
+                     for stream in streams], axis=1)
+
+def drive_columns(signal: Signal, columns, domain: str="adat"):
+    """drive bit k of signal with column k of a (cycles, K) array, one row per clock cycle of domain"""
+    yield from drive_levels(signal, pack_columns(columns), domain)
+
+def drive_frames(transmitter, samples, user_data=None, domain: str="sync", poll_cycles: int=1):
+    """write frames into an ADATTransmitter (or its tester), waiting for ready_out
+
+    Parameters
+    ----------
+    samples: array of shape (frames, 8)
+    user_data: array of shape (frames,), defaults to 0
+    poll_cycles: while waiting, check ready_out only every that many cycles.
+        This speeds up long simulations, which keep the FIFO full.
+    """
+    samples = np.asarray(samples).reshape(-1, CHANNELS)
+    user_data = np.zeros(len(samples), dtype=np.int64) if user_data is None else np.asarray(user_data)
+
+    for frame, user in zip(samples.tolist(), user_data.tolist()):
+        yield transmitter.user_data_in.eq(user)
+        for channel, sample in enumerate(frame):
+            # ready_out is combinational
+            yield Settle()
+            if not (yield transmitter.ready_out):
+                # or the last sample would be committed again, as soon as ready_out is high
+                yield transmitter.valid_in.eq(0)
+            while not (yield transmitter.ready_out):
+                for _ in range(poll_cycles):
+                    yield Tick(domain)
+                yield Settle()
+            yield transmitter.addr_in.eq(channel)
+            yield transmitter.sample_in.eq(sample)
+            yield transmitter.last_in.eq(channel == CHANNELS - 1)
+            yield transmitter.valid_in.eq(1)
+            yield Tick(domain)
+
+    yield transmitter.valid_in.eq(0)
+    yield transmitter.last_in.eq(0)
+
+#
+# monitors
+#
+class LevelMonitor:
+    """record the value of a signal in every clock cycle of domain.
+       To record several signals with one read per cycle, pass their Cat() and a wide enough dtype"""
+    def __init__(self, signal: Signal, capacity: int, domain: str="adat", dtype=np.uint8):
+        self.signal   = signal
+        self.domain   = domain
+        self.levels   = np.zeros(capacity, dtype=dtype)
+        self.count    = 0
+
+    def process(self):
+        yield Passive()
+        while self.count < len(self.levels):
+            yield Tick(self.domain)
+            self.levels[self.count] = yield self.signal
+            self.count += 1
+
+    @property
+    def result(self) -> np.ndarray:
+        return self.levels[:self.count]
+
+class BitMonitor:
+    """collect the bits of a data/enable pair, like the outputs of NRZIDecoder"""
+    def __init__(self, data: Signal, enable: Signal, capacity: int, domain: str="sync"):
+        self.data     = data
+        self.enable   = enable
+        self.domain   = domain
+        self.bits     = np.zeros(capacity, dtype=np.uint8)
+        self.count    = 0
+        self.overflow = False
+
+    def process(self):
+        yield Passive()
+        while True:
+            yield Tick(self.domain)
+            if (yield self.enable):
+                if self.count == len(self.bits):
+                    self.overflow = True
+                else:
+                    self.bits[self.count] = yield self.data
+                    self.count += 1
+
+    @property
+    def result(self) -> np.ndarray:
+        return self.bits[:self.count]
+
+class SampleMonitor:
+    """collect the frames output by an ADATReceiver (or its tester)"""
+    def __init__(self, receiver, capacity: int, domain: str="sync"):
+        self.receiver  = receiver
+        self.domain    = domain
+        self.samples   = np.zeros((capacity, CHANNELS), dtype=np.int32)
+        self.user_data = np.zeros(capacity, dtype=np.uint8)
+        self.count     = 0
+        self.overflow  = False
+
+    def process(self):
+        receiver = self.receiver
+        yield Passive()
+        while True:
+            yield Tick(self.domain)
+            if not (yield receiver.output_enable):
+                continue
+            if self.count == len(self.samples):
+                self.overflow = True
+                continue
+
+            channel = yield receiver.addr_out
+            self.samples[self.count, channel] = yield receiver.sample_out
+            if channel == CHANNELS - 1:
+                self.user_data[self.count] = yield receiver.user_data_out
+                self.count += 1
+
+    @property
+    def result(self) -> tuple:
+        """(samples, user_data) of all complete frames"""
+        return self.samples[:self.count], self.user_data[:self.count]
+
+class WordMonitor:
+    """collect the frames output by an ADATReceiver (or its tester) with a channel mask,
+       in any output format, and unpack them into samples like SampleMonitor.
+       The samples of disabled channels are 0, like in ``format_frames``"""
+    def __init__(self, receiver, capacity: int, channel_mask: int=0xff, output_format: str="sample",
+                 domain: str="sync"):
+        self.receiver      = receiver
+        self.domain        = domain
+        self.channels      = [channel for channel in range(CHANNELS) if (channel_mask >> channel) & 1]
+        self.output_format = output_format
+        self.samples       = np.zeros((capacity, CHANNELS), dtype=np.int32)
+        self.user_data     = np.zeros(capacity, dtype=np.uint8)
+        # output beats of each frame, on the sample or on the word output
+        self.beats         = np.zeros(capacity, dtype=np.int64)
+        self.count         = 0
+        self.overflow      = False
+
+    def process(self):
+        receiver = self.receiver
+        if self.output_format == "sample":
+            valid, data, channel_out = receiver.output_enable, receiver.sample_out, receiver.addr_out
+        else:
+            valid, data, channel_out = receiver.word_valid_out, receiver.word_out, receiver.word_channel_out
+
+        yield Passive()
+        while True:
+            yield Tick(self.domain)
+            if not (yield valid):
+                continue
+            if self.count == len(self.samples):
+                self.overflow = True
+                continue
+
+            self.beats[self.count] += 1
+            word    = yield data
+            channel = yield channel_out
+            if self.output_format == "sample":
+                self.samples[self.count, channel] = word
+                last = channel == self.channels[-1]
+            elif self.output_format == "left_justified":
+                self.samples[self.count, channel] = word >> 8
+                last = yield receiver.word_last_out
+            else:
+                self.samples[self.count, channel] = word & 0xffff
+                # the upper half is the next enabled channel, if there is one
+                following = self.channels.index(channel) + 1
+                if following < len(self.channels):
+                    self.samples[self.count, self.channels[following]] = word >> 16
+                last = yield receiver.word_last_out
+
+            if last:
+                self.user_data[self.count] = yield receiver.user_data_out
+                self.count += 1
+
+    @property
+    def result(self) -> tuple:
+        """(samples, user_data) of all complete frames"""
+        return self.samples[:self.count], self.user_data[:self.count]
+
+class SyncMonitor:
+    """record the clock cycles, in which a synced signal, like ``synced_out``, changes
+
+    Changes in the first settle_cycles cycles are ignored,
+    because a receiver may lock briefly, before it gets a valid signal.
+    The domain does not need to be the domain of the signal,
+    a slower clock makes the simulation faster.
+    """
+    def __init__(self, synced: Signal, domain: str="sync", settle_cycles: int=0):
+        self.synced        = synced
+        self.domain        = domain
+        self.settle_cycles = settle_cycles
+        self.locked        = []
+        self.lost          = []
+        self.cycle         = 0
+
+    def process(self):
+        yield Passive()
+        synced = 0
+        while True:
+            yield Tick(self.domain)
+            self.cycle += 1
+            now_synced = yield self.synced
+            if self.cycle > self.settle_cycles:
+                if now_synced and not synced:
+                    self.locked.append(self.cycle)
+                elif synced and not now_synced:
+                    self.lost.append(self.cycle)
+            synced = now_synced
+
+    @property
+    def resyncs(self) -> int:
+        """how often the lock was lost and reacquired"""
+        return max(len(self.locked) - 1, 0)
+
+class BatchBitMonitor:
+    """BitMonitor for all instances of an NRZIDecoderBatch"""
+    def __init__(self, batch: NRZIDecoderBatch, capacity: int, domain: str="sync"):
+        self.batch    = batch
+        self.domain   = domain
+        self.bits     = np.zeros((len(batch), capacity), dtype=np.uint8)
+        self.counts   = np.zeros(len(batch), dtype=np.int64)
+        self.overflow = np.zeros(len(batch), dtype=bool)
+
+    def process(self):
+        batch    = self.batch
+        capacity = self.bits.shape[1]
+        yield Passive()
+        while True:
+            yield Tick(self.domain)
+            enables = yield batch.data_out_en
+            if not enables:
+                continue
+            data = yield batch.data_out
+            for k in range(len(batch)):
+                if not (enables >> k) & 1:
+                    continue
+                if self.counts[k] == capacity:
+                    self.overflow[k] = True
+                else:
+                    self.bits[k, self.counts[k]] = (data >> k) & 1
+                    self.counts[k] += 1
+
+    def result(self, k: int) -> np.ndarray:
+        """the bits of instance k"""
+        return self.bits[k, :self.counts[k]]
+
+class BatchSampleMonitor:
+    """SampleMonitor for all instances of an ADATReceiverBatch"""
+    def __init__(self, batch: ADATReceiverBatch, capacity: int, domain: str="sync"):
+        self.batch     = batch
+        self.domain    = domain
+        self.samples   = np.zeros((len(batch), capacity, CHANNELS), dtype=np.int32)
+        self.user_data = np.zeros((len(batch), capacity), dtype=np.uint8)
+        self.counts    = np.zeros(len(batch), dtype=np.int64)
+        self.overflow  = np.zeros(len(batch), dtype=bool)
+
+    def process(self):
+        batch    = self.batch
+        capacity = self.samples.shape[1]
+        yield Passive()
+        while True:
+            yield Tick(self.domain)
+            # only one read per cycle, when no instance outputs anything
+            enables = yield batch.output_enable
+            if not enables:
+                continue
+            for k, receiver in enumerate(batch.testers):
+                if not (enables >> k) & 1:
+                    continue
+                if self.counts[k] == capacity:
+                    self.overflow[k] = True
+                    continue
+                channel = yield receiver.addr_out
+                self.samples[k, self.counts[k], channel] = yield receiver.sample_out
+                if channel == CHANNELS - 1:
+                    self.user_data[k, self.counts[k]] = yield receiver.user_data_out
+                    self.counts[k] += 1
+
+    def result(self, k: int) -> tuple:
+        """(samples, user_data) of all complete frames of instance k"""
+        return self.samples[k, :self.counts[k]], self.user_data[k, :self.counts[k]]
+
+class BatchSyncMonitor:
+    """SyncMonitor for every bit of a packed signal, like ``ADATReceiverBatch.synced_out``"""
+    def __init__(self, synced: Signal, domain: str="sync", settle_cycles: int=0):
+        self.synced        = synced
+        self.domain        = domain
+        self.settle_cycles = settle_cycles
+        self.locked        = [[] for _ in range(len(synced))]
+        self.lost          = [[] for _ in range(len(synced))]
+        self.cycle         = 0
+
+    def process(self):
+        yield Passive()
+        synced = 0
+        while True:
+            yield Tick(self.domain)
+            self.cycle += 1
+            now_synced = yield self.synced
+            changed = now_synced ^ synced
+            if changed and self.cycle > self.settle_cycles:
+                for k in range(len(self.synced)):
+                    if (changed >> k) & 1:
+                        (self.locked if (now_synced >> k) & 1 else self.lost)[k].append(self.cycle)
+            synced = now_synced
+
+    def resyncs(self, k: int) -> int:
+        """how often instance k lost the lock and reacquired it"""
+        return max(len(self.locked[k]) - 1, 0)
+
+#
+# checking
+#
+def compare_frames(sent_samples, sent_user_data, received_samples, received_user_data) -> dict:
+    """match received frames against the sent frames, which need to be unique, like random frames
+
+    Received frames before the first sent frame, like the empty frames a transmitter sends
+    before it has data, are skipped, and so are frames after the last sent frame,
+    like the frames it repeats when it runs out of data. A received frame,
+    which is not one of the sent frames, is compared bit by bit to the frame
+    following the last matched one.
+
+    Returns
+    -------
+    a dict with the number of ``received`` frames, frames ``lost`` between received frames,
+    ``repeated`` frames, ``errored_frames``, ``sample_errors``, ``bit_errors``,
+    the number of ``bits`` compared, the index of the ``first`` frame received,
+    and the number of frames ``not_received`` after the last received frame
+    """
+    sent_samples       = np.asarray(sent_samples, dtype=np.int32).reshape(-1, CHANNELS)
+    sent_user_data     = np.asarray(sent_user_data, dtype=np.int64)
+    received_samples   = np.asarray(received_samples, dtype=np.int32).reshape(-1, CHANNELS)
+    received_user_data = np.asarray(received_user_data, dtype=np.int64)
+
+    def keys(samples):
+        return np.ascontiguousarray(samples).view(np.dtype((np.void, 4 * CHANNELS))).ravel().tolist()
+    index_of = {key: index for index, key in enumerate(keys(sent_samples))}
+    indices  = np.array([index_of.get(key, -1) for key in keys(received_samples)], dtype=np.int64)
+
+    result = dict(received=0, lost=0, repeated=0, errored_frames=0, sample_errors=0,
+                  bit_errors=0, bits=0, first=-1, not_received=len(sent_samples))
+    matched = np.flatnonzero(indices >= 0)
+    if len(matched) == 0:
+        return result
+
+    start   = matched[0]
+    indices = indices[start:]
+    # unmatched frames take the place of the frame following the last matched one
+    last  = int(indices[0]) - 1
+    count = 0
+    for index in indices.tolist():
+        if last == len(sent_samples) - 1:
+            break
+        if index < 0:
+            index = last + 1
+            indices[count] = index
+            result["errored_frames"] += 1
+        elif index <= last:
+            result["repeated"] += 1
+        else:
+            result["lost"] += index - last - 1
+        last   = max(last, index)
+        count += 1
+
+    indices          = indices[:count]
+    expected_samples = sent_samples[indices]
+    received         = received_samples[start:start + count]
+    sample_bit_errors = np.unpackbits((expected_samples ^ received).view(np.uint8)).reshape(len(received), -1)
+    user_bit_errors   = np.unpackbits((sent_user_data[indices] ^ received_user_data[start:start + count]).astype(np.uint8))
+
+    result.update(
+        received      = len(received),
+        sample_errors = int(np.count_nonzero(expected_samples != received)),
+        bit_errors    = int(sample_bit_errors.sum() + user_bit_errors.sum()),
+        bits          = len(received) * (CHANNELS * 24 + USER_BITS),
+        first         = int(indices[0]),
+        not_received  = len(sent_samples) - 1 - last,
+    )
+    return result
+
+#
+# streaming checks
+#
+class CheckFailure(AssertionError):
+    """raised by a streaming checker at the first mismatch, which stops the simulation"""
+
+class TraceWindow:
+    """keep the values of some signals in the last clock cycles of domain,
+       so that a checker can write them into a small VCD file, when a check fails.
+       The signals are read with one Cat() per cycle
+
+    Parameters
+    ----------
+    signals: the signals to trace
+    cycles: how many clock cycles to keep
+    period: the clock period of domain in seconds, for the time axis of the VCD file
+    """
+    def __init__(self, signals: list, cycles: int=4096, period: float=1e-8, domain: str="sync"):
+        self.signals = signals
+        self.period  = period
+        self.domain  = domain
+        self.values  = collections.deque(maxlen=cycles)
+        self.cycle   = 0
+        self._packed = Cat(*signals)
+
+    def process(self):
+        yield Passive()
+        while True:
+            yield Tick(self.domain)
+            self.values.append((yield self._packed))
+            self.cycle += 1
+
+    def write_vcd(self, vcd_file: str):
+        """write the values in the window, the time axis counts from the start of the simulation"""
+        codes  = [chr(33 + index) for index in range(len(self.signals))]
+        widths = [len(signal) for signal in self.signals]
+        period = round(self.period * 1e12)
+        first  = self.cycle - len(self.values)
+
+        with open(vcd_file, "w") as f:
+            f.write("$timescale 1 ps $end\n$scope module trace $end\n")
+            for code, width, signal in zip(codes, widths, self.signals):
+                f.write(f"$var wire {width} {code} {signal.name} $end\n")
+            f.write("$upscope $end\n$enddefinitions $end\n")
+
+            previous = None
+            for cycle, packed in enumerate(self.values, first):
+                changes, shift = [], 0
+                for code, width in zip(codes, widths):
+                    value  = (packed >> shift) & ((1 << width) - 1)
+                    shift += width
+                    if previous is None or value != (previous >> (shift - width)) & ((1 << width) - 1):
+                        changes.append(f"{value}{code}" if width == 1 else f"b{value:b} {code}")
+                if changes:
+                    f.write(f"#{cycle * period}\n" + "\n".join(changes) + "\n")
+                previous = packed
+
+class _StreamChecker:
+    """the failure report of the streaming checkers"""
+    def __init__(self, trace: TraceWindow=None, vcd_file: str="failure.vcd"):
+        self.trace    = trace
+        self.vcd_file = vcd_file
+
+    def fail(self, message: str, context: list):
+        lines = [message] + [f"  {line}" for line in context]
+        if self.trace is not None:
+            self.trace.write_vcd(self.vcd_file)
+            lines.append(f"the last {len(self.trace.values)} cycles, up to cycle {self.trace.cycle}, "
+                         f"are in {self.vcd_file}")
+        raise CheckFailure("\n".join(lines))
+
+def format_frame(samples, user_data: int) -> str:
+    return " ".join(f"{int(sample) & 0xffffff:06x}" for sample in samples) + f"  user {int(user_data):x}"
+
+class FrameChecker(_StreamChecker):
+    """compare the frames output by an ADATReceiver (or its tester) with the expected frames as they arrive.
+       Only the frames around the current one are kept, so the memory does not grow with the length of the run
+
+    Parameters
+    ----------
+    expected: iterable of (samples, user_data) for every frame, can be a generator
+    context_frames: how many frames before and after a mismatch are reported
+    trace: a TraceWindow, which is written to vcd_file, when a check fails
+    """
+    def __init__(self, receiver, expected, context_frames: int=2, trace: TraceWindow=None,
+                 vcd_file: str="failure.vcd", domain: str="sync"):
+        super().__init__(trace, vcd_file)
+        self.receiver       = receiver
+        self.domain         = domain
+        self.context_frames = context_frames
+        self.expected       = iter(expected)
+        self.upcoming       = collections.deque()
+        self.history        = collections.deque(maxlen=context_frames)
+        self.count          = 0
+
+    def _peek(self):
+        """fill the frames to be checked next, and the ones after them for the report"""
+        while len(self.upcoming) <= self.context_frames:
+            frame = next(self.expected, None)
+            if frame is None:
+                break
+            samples, user_data = frame
+            self.upcoming.append((tuple(int(sample) for sample in samples), int(user_data)))
+
+    def _context(self) -> list:
+        return [f"frame {self.count - len(self.history) + index}: {format_frame(*frame)}"
+                for index, frame in enumerate(self.history)]
+
+    def check(self, samples: tuple, user_data: int):
+        self._peek()
+        received = format_frame(samples, user_data)
+        if not self.upcoming:
+            self.fail(f"frame {self.count} was not expected: {received}", self._context())
+
+        expected = self.upcoming.popleft()
+        if (samples, user_data) != expected:
+            self.fail(f"frame {self.count} differs\n  received: {received}\n  expected: {format_frame(*expected)}",
+                      ["previous frames:"] + self._context() +
+                      ["next expected frames:"] + [format_frame(*frame) for frame in self.upcoming])
+        self.history.append(expected)
+        self.count += 1
+
+    def process(self):
+        receiver = self.receiver
+        samples  = [0] * CHANNELS
+        yield Passive()
+        while True:
+            yield Tick(self.domain)
+            if not (yield receiver.output_enable):
+                continue
+            channel = yield receiver.addr_out
+            samples[channel] = yield receiver.sample_out
+            if channel == CHANNELS - 1:
+                self.check(tuple(samples), (yield receiver.user_data_out))
+
+    def finish(self):
+        """call after the simulation: all expected frames need to have been received"""
+        self._peek()
+        if self.upcoming:
+            self.fail(f"only {self.count} frames received, expected next: {format_frame(*self.upcoming[0])}",
+                      ["last frames:"] + self._context())
+
+class Gap:
+    """a run of min_bits to max_bits bits in the expected stream of a BitChecker,
+       which all have the given value, or any value, if value is None.
+       The length of the run is found with the expected bits, which follow it"""
+    def __init__(self, min_bits: int, max_bits: int=None, value: int=None):
+        self.min_bits = min_bits
+        self.max_bits = min_bits if max_bits is None else max_bits
+        self.value    = value
+
+    def __repr__(self) -> str:
+        value = "any bits" if self.value is None else f"bits of {self.value}"
+        return f"{self.min_bits} to {self.max_bits} {value}"
+
+class BitChecker(_StreamChecker):
+    """compare the bits of a data/enable pair, like the outputs of NRZIDecoder, with the expected stream
+       as they arrive. Bits after the end of the expected stream are ignored.
+       The memory is bounded by the longest Gap plus the segment after it.
+       A bit of the wrong value within the shortest run of a Gap fails at once
+
+    Parameters
+    ----------
+    expected: iterable of segments, which are sequences of bits or Gaps
+    context_bits: how many bits before a mismatch are reported
+    trace: a TraceWindow, which is written to vcd_file, when a check fails
+    """
+    def __init__(self, data: Signal, enable: Signal, expected, context_bits: int=48, trace: TraceWindow=None,
+                 vcd_file: str="failure.vcd", domain: str="sync"):
+        super().__init__(trace, vcd_file)
+        self.data     = data
+        self.enable   = enable
+        self.domain   = domain
+        self.segments = iter(expected)
+        self.received = collections.deque(maxlen=context_bits)
+        self.count    = 0
+        # the current gap, the bits received during it, and the fixed bits after it
+        self.gap      = None
+        self.pending  = []
+        self.fixed    = None
+        self.position = 0
+        # the bit index of the first pending bit, and the first pending bit, which ends the run
+        self.gap_start = 0
+        self.run_end   = None
+        self._next_segment()
+
+    def _next_segment(self):
+        self.position = 0
+        self.fixed    = None
+        segment = next(self.segments, None)
+        if isinstance(segment, Gap):
+            self.gap = segment
+            segment  = next(self.segments, None)
+            if isinstance(segment, Gap):
+                raise ValueError("two Gaps in a row can not be told apart")
+        if segment is not None:
+            self.fixed = np.asarray(segment, dtype=np.uint8)
+
+    def _context(self, expected) -> list:
+        received = "".join(str(bit) for bit in self.received)
+        return [f"the last {len(self.received)} bits received: {received}",
+                f"expected from the current position: {''.join(str(bit) for bit in expected)}"]
+
+    def _resolve_gap(self):
+        """find the shortest run, which is followed by the fixed bits, and check the bits after it"""
+        gap, pending, start = self.gap, self.pending, self.gap_start
+        following = [] if self.fixed is None else self.fixed.tolist()
+        for length in range(gap.min_bits, min(gap.max_bits, len(pending)) + 1):
+            run_ok = gap.value is None or all(bit == gap.value for bit in pending[:length])
+            if run_ok and pending[length:length + len(following)] == following[:len(pending) - length]:
+                break
+        else:
+            self.fail(f"bit {start}: no run of {gap} is followed by the expected bits",
+                      self._context(following[:self.received.maxlen]))
+
+        self.gap, self.pending, self.run_end = None, [], None
+        for index, bit in enumerate(pending[length:], start + length):
+            self._check_fixed(bit, index)
+
+    def _check_gap(self, bit: int, index: int):
+        gap = self.gap
+        if not self.pending:
+            self.gap_start = index
+        self.pending.append(bit)
+        if gap.value is not None and bit != gap.value and self.run_end is None:
+            self.run_end = len(self.pending) - 1
+            if self.run_end < gap.min_bits:
+                self.fail(f"bit {index}: received {bit}, expected {gap.value}, "
+                          f"at bit {self.run_end} of a run of {gap}",
+                          self._context([gap.value] * (gap.min_bits - self.run_end)))
+
+        # the run can not be longer than the bits of its value received so far
+        longest = gap.max_bits if self.run_end is None else min(gap.max_bits, self.run_end)
+        if len(self.pending) >= longest + (0 if self.fixed is None else len(self.fixed)):
+            self._resolve_gap()
+
+    def _check_fixed(self, bit: int, index: int):
+        if self.gap is not None:
+            self._check_gap(bit, index)
+            return
+        if self.fixed is None:
+            return
+
+        expected = self.fixed[self.position]
+        if bit != expected:
+            self.fail(f"bit {index}: received {bit}, expected {expected}, "
+                      f"at bit {self.position} of a {len(self.fixed)} bit segment",
+                      self._context(self.fixed[self.position:self.position + self.received.maxlen].tolist()))
+        self.position += 1
+        if self.position == len(self.fixed):
+            self._next_segment()
+
+    def check(self, bit: int):
+        self.received.append(bit)
+        self._check_fixed(bit, self.count)
+        self.count += 1
+
+    def process(self):
+        yield Passive()
+        while True:
+            yield Tick(self.domain)
+            if (yield self.enable):
+                self.check((yield self.data))
+
+    def finish(self):
+        """call after the simulation: all of the expected stream needs to have been received"""
+        if self.gap is not None:
+            self._resolve_gap()
+        if self.gap is not None or self.fixed is not None:
+            expected = [] if self.fixed is None else self.fixed[self.position:self.position + self.received.maxlen].tolist()
+            self.fail(f"the stream ended after {self.count} bits, before the end of the expected stream",
+                      self._context(expected))
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+"""serialize received ADAT samples into TDM8 or I2S"""
+from amaranth import Elaboratable, Signal, Module, Cat, Const, Mux, Memory
+
+from adat.protocol import CHANNELS, CHANNEL_BITS, SYNC_PAD_BITS, USER_BITS, FRAME_BITS
+
+class ADATTDMBridge(Elaboratable):
+    """output the samples of an ADATReceiver as TDM8 or as four I2S lines,
+       clocked by the bit timing the receiver recovered
+
+    The serial frame has the same period as the ADAT frame, so "tdm8" has one serial bit
+    per ADAT bit, and "i2s" one per four ADAT bits. Every slot is 32 bits long
+    and holds the 24 bit sample MSB first, followed by zeros. Like in I2S,
+    the MSB follows one bit clock after ws_out changes. In "tdm8", ws_out is a one bit
+    frame sync pulse in front of slot 0, which holds channel 0. In "i2s",
+    ws_out is the word select, line l carries channel 2l left (ws_out low)
+    and channel 2l + 1 right (ws_out high).
+
+    The serial frame starts as early after the arrival of channel 0 as the slot order allows,
+    so that every sample has arrived before its slot starts. The samples are buffered
+    from their arrival until their slot in a memory of one frame, or of two frames,
+    if the slot order needs a sample after the same channel of the next frame
+    has arrived, like the right channels of "i2s". See ``latency_bits``.
+    The frame timing is taken over again from every channel 0, which arrives.
+
+    bclk_out falls, when the data changes, and rises in the middle of the data bit.
+    In "tdm8" it follows ``ADATReceiver.recovered_clock_out``, in "i2s" it is divided
+    from the bit strobes. While the receiver is not synchronized, the data is zero.
+    All channels need to be enabled in ``ADATReceiver.channel_mask_in``.
+
+    Parameters
+    ----------
+    mode: "tdm8" or "i2s"
+
+    Attributes
+    ----------
+    addr_in, sample_in, valid_in, synced_in, bit_strobe_in, recovered_clock_in: Signal
+        connect to the receiver, see ``connect_receiver``
+    bclk_out: Signal
+        the serial bit clock
+    ws_out: Signal
+        the frame sync pulse in "tdm8", the word select in "i2s"
+    data_out: Signal
+        one bit per serial data line
+    """
+    MODES     = ("tdm8", "i2s")
+    SLOT_BITS = 32
+
+    def __init__(self, mode: str="tdm8"):
+        if mode not in self.MODES:
+            raise ValueError(f"mode needs to be one of {', '.join(self.MODES)}, not '{mode}'")
+        self.mode = mode
+
+        if mode == "tdm8":
+            self.lines, self.slots, self.ticks_per_bit = 1, CHANNELS, 1
+        else:
+            self.lines, self.slots, self.ticks_per_bit = CHANNELS // 2, 2, FRAME_BITS // (2 * self.SLOT_BITS)
+
+        self.start_bits    = max(self.arrival_bits(channel) + 1 - self.slot_start_bits(channel)
+                                 for channel in range(CHANNELS))
+        # the next sample of a channel arrives FRAME_BITS later
+        self.buffer_frames = 1 if all(self.start_bits + self.slot_start_bits(channel)
+                                      <= self.arrival_bits(channel) + FRAME_BITS for channel in range(CHANNELS)) else 2
+
+        self.addr_in            = Signal(3)
+        self.sample_in          = Signal(24)
+        self.valid_in           = Signal()
+        self.synced_in          = Signal()
+        self.bit_strobe_in      = Signal()
+        self.recovered_clock_in = Signal()
+
+        self.bclk_out           = Signal()
+        self.ws_out             = Signal()
+        self.data_out           = Signal(self.lines)
+
+        self.mem = Memory(width=24, depth=self.buffer_frames * CHANNELS, name="tdm_samples")
+
+    def arrival_bits(self, channel: int) -> int:
+        """the ADAT bit strobe after which the channel arrives, counted from the arrival of channel 0"""
+        return CHANNEL_BITS * channel
+
+    def slot_start_bits(self, channel: int) -> int:
+        """the start of the slot of channel, in ADAT bits from the start of the serial frame"""
+        slot = channel if self.mode == "tdm8" else channel % self.slots
+        return slot * self.SLOT_BITS * self.ticks_per_bit
+
+    def latency_bits(self, channel: int) -> int:
+        """the ADAT bits from the start of channel on the ADAT input to the start of its MSB
+           on the serial output, without the delay of the receiver, which outputs a sample
+           about two bits after its end"""
+        first_bit   = SYNC_PAD_BITS + USER_BITS + CHANNEL_BITS * channel
+        channel0_in = SYNC_PAD_BITS + USER_BITS + CHANNEL_BITS
+        msb_out     = channel0_in + self.start_bits + self.slot_start_bits(channel) + self.ticks_per_bit
+        return msb_out - first_bit
+
+    def connect_receiver(self, receiver) -> list:
+        """the statements, which connect the outputs of an ADATReceiver"""
+        return [
+            self.addr_in            .eq(receiver.addr_out),
+            self.sample_in          .eq(receiver.sample_out),
+            self.valid_in           .eq(receiver.output_enable),
+            self.synced_in          .eq(receiver.synced_out),
+            self.bit_strobe_in      .eq(receiver.bit_strobe_out),
+            self.recovered_clock_in .eq(receiver.recovered_clock_out),
+        ]
+
+    def elaborate(self, platform) -> Module:
+        m = Module()
+        sync = m.d.sync
+        comb = m.d.comb
+
+        tick_bits  = (self.ticks_per_bit - 1).bit_length()
+        frame_bits = self.slots * self.SLOT_BITS
+
+        write_port = self.mem.write_port()
+        read_ports = [self.mem.read_port(domain="comb") for _ in range(self.lines)]
+        m.submodules.write_port = write_port
+        for line, read_port in enumerate(read_ports):
+            m.submodules[f"read_port_{line}"] = read_port
+
+        # the position in the serial frame, in ADAT bits
+        phase       = Signal(range(FRAME_BITS))
+        next_phase  = Signal(range(FRAME_BITS))
+        tick        = Signal()
+        serial_bit  = Signal(range(frame_bits))
+        slot_start  = Signal()
+        slot        = Signal(range(self.slots))
+        channel0    = Signal()
+        # a channel 0 has arrived since the receiver synchronized
+        active      = Signal()
+
+        comb += [
+            next_phase .eq(phase + 1),
+            tick       .eq(self.bit_strobe_in & (next_phase[:tick_bits] == 0)),
+            serial_bit .eq(next_phase[tick_bits:]),
+            slot_start .eq(serial_bit[:5] == 0),
+            slot       .eq(serial_bit[5:]),
+            channel0   .eq(self.valid_in & (self.addr_in == 0)),
+        ]
+
+        with m.If(channel0):
+            # serial bit 0 is start_bits ADAT bits later
+            sync += [
+                phase  .eq(-self.start_bits % FRAME_BITS),
+                active .eq(1),
+            ]
+        with m.Elif(self.bit_strobe_in):
+            sync += phase.eq(next_phase)
+        with m.If(~self.synced_in):
+            sync += active.eq(0)
+
+        # the frame, which is written, and the one, which is output
+        write_frame = Signal()
+        next_frame  = Signal()
+        read_frame  = Signal()
+
+        comb += [
+            write_port.addr .eq(Cat(self.addr_in, write_frame)[:len(write_port.addr)]),
+            write_port.data .eq(self.sample_in),
+            write_port.en   .eq(self.valid_in),
+        ]
+        if self.buffer_frames == 2:
+            with m.If(self.valid_in & (self.addr_in == CHANNELS - 1)):
+                sync += write_frame.eq(~write_frame)
+            with m.If(channel0):
+                sync += next_frame.eq(write_frame)
+            with m.If(tick & (serial_bit == 0)):
+                sync += read_frame.eq(next_frame)
+
+        # slot 0 is loaded, while read_frame changes
+        frame = Signal()
+        comb += frame.eq(Mux(serial_bit == 0, next_frame, read_frame))
+
+        # the serializers, with one bit of delay after the slot start, like I2S
+        shifters = [Signal(self.SLOT_BITS, name=f"shifter_{line}") for line in range(self.lines)]
+        for line, (shifter, read_port) in enumerate(zip(shifters, read_ports)):
+            channel = Signal(3, name=f"channel_{line}")
+            comb += [
+                channel        .eq(slot if self.mode == "tdm8" else self.slots * line + slot),
+                read_port.addr .eq(Cat(channel, frame)[:len(read_port.addr)]),
+            ]
+
+            with m.If(tick):
+                sync += self.data_out[line].eq(shifter[-1])
+                with m.If(slot_start):
+                    sync += shifter.eq(Cat(Const(0, self.SLOT_BITS - 24), Mux(active & self.synced_in, read_port.data, 0)))
+                with m.Else():
+                    sync += shifter.eq(shifter << 1)
+
+        with m.If(tick):
+            if self.mode == "tdm8":
+                sync += self.ws_out.eq(serial_bit == 0)
+            else:
+                sync += self.ws_out.eq(slot)
+
+        if self.ticks_per_bit == 1:
+            # data and clock are registered alike
+            sync += self.bclk_out.eq(self.recovered_clock_in)
+        else:
+            with m.If(self.bit_strobe_in):
+                sync += self.bclk_out.eq(next_phase[:tick_bits] >= self.ticks_per_bit // 2)
+
+        return m
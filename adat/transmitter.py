@@ -5,21 +5,45 @@
 #
 """ ADAT transmitter.
     Inputs are in the sync clock domain,
-    ADAT output is in the ADAT clock domain
+    ADAT output is in the ADAT clock domain,
+    or in the sync clock domain when the internal bit clock generator is used
 """
 
-from amaranth          import Elaboratable, Signal, Module, Cat, Const, Array, Memory
-from amaranth.lib.fifo import AsyncFIFO
+from amaranth          import Elaboratable, Signal, Module, Cat, Const, Array, Memory, DomainRenamer, EnableInserter, signed
+from amaranth.lib.fifo import AsyncFIFO, SyncFIFOBuffered
+from amaranth.lib.cdc  import PulseSynchronizer
 
 from amlib.utils import NRZIEncoder
 
+from adat.bitclock import ADATBitClockGenerator
+from adat.protocol import FIFO_WORDS_PER_FRAME, transmit_fifo_depth
+
 
 class ADATTransmitter(Elaboratable):
     """transmit ADAT from a multiplexed stream of eight audio channels
 
     Parameters
     ----------
-    fifo_depth: capacity of the FIFO containing the ADAT frames to be transmitted
+    fifo_depth: capacity of the FIFO containing the ADAT frames to be transmitted.
+        Without clk_freq, the FIFO is asynchronous, and its depth is rounded up to a power of two.
+        With clk_freq, the FIFO has an output register, which holds one more word
+    latency_frames: if given, fifo_depth is calculated by ``transmit_fifo_depth``
+        for this latency target and jitter_frames, and fifo_target_level defaults to it.
+        The latency is set by how many frames the producer writes ahead.
+        Only a producer, which keeps the FIFO full, sees the whole depth as latency,
+        including the rounding of the asynchronous FIFO
+    jitter_frames: how many frames the producer may be early or late, see ``transmit_fifo_depth``
+    clk_freq: if given, the ADAT bit rate is generated from the sync clock
+        by an internal bit clock generator, and no adat clock domain is needed.
+        The output then has a jitter of one sync clock period.
+    samplerate: the sample rate to generate with the internal bit clock generator
+    fifo_target_level: the FIFO level the FIFO level servo outputs are relative to,
+        defaults to half the FIFO depth
+    servo_shift: the FIFO level is smoothed over 2**servo_shift sync clock cycles
+    serializer: "mux" selects the bit to be transmitted from the current word
+        with a 30:1 multiplexer. "shift" encodes the next word one word ahead
+        into a staging register and shifts it out of a shift register,
+        which needs a few more flip-flops, but closes timing at higher adat clock rates
 
     Attributes
     ----------
@@ -46,15 +70,44 @@ class ADATTransmitter(Elaboratable):
         needs to be strobed when the last sample has been committed into the currently
         assembled ADAT frame. This will commit the user bits to the current ADAT frame
     fifo_level_out: Signal
-        outputs the number of entries in the transmit FIFO
+        outputs the number of entries in the transmit FIFO,
+        including the word in the output register of the synchronous FIFO
     underflow_out: Signal
         this underflow indicator will be strobed, when a new ADAT frame needs to be
         transmitted but the transmit FIFO is empty. In this case, the last
-        ADAT frame will be transmitted again.
+        ADAT frame will be transmitted again. It is strobed, too, when the serializer
+        runs out of words in the middle of a frame, because the sync clock is too slow
+        to write them, and it sends zeros instead. This is passed from the adat domain,
+        so with a sync clock slower than the ADAT bit clock, two of these
+        close to each other may show up as one or none
+    fifo_level_error_out: Signal
+        smoothed deviation of the FIFO level from ``fifo_target_level``.
+        When it is negative, the ADAT clock runs faster than the samples are produced,
+        and the producer should insert a sample, or the ADAT clock should be slowed down.
+        When it is positive, the opposite applies.
+    fifo_level_trend_out: Signal
+        change of the smoothed FIFO level over the last 2**servo_shift sync clock cycles
+    bit_clock_trim_in: Signal
+        only with the internal bit clock generator: trims its bit rate,
+        see ``ADATBitClockGenerator.trim_in``
     """
 
-    def __init__(self, fifo_depth=9*4):
-        self._fifo_depth    = fifo_depth
+    def __init__(self, fifo_depth=9*4, clk_freq=None, samplerate=48000, fifo_target_level=None, servo_shift=12,
+                 serializer="mux", latency_frames=None, jitter_frames=1):
+        if serializer not in ("mux", "shift"):
+            raise ValueError(f"serializer needs to be 'mux' or 'shift', not '{serializer}'")
+
+        if latency_frames is not None:
+            fifo_depth = transmit_fifo_depth(latency_frames, jitter_frames)
+            if fifo_target_level is None:
+                fifo_target_level = latency_frames * FIFO_WORDS_PER_FRAME
+
+        self._fifo_depth        = fifo_depth
+        self._clk_freq          = clk_freq
+        self._samplerate        = samplerate
+        self._fifo_target_level = fifo_depth // 2 if fifo_target_level is None else fifo_target_level
+        self._servo_shift       = servo_shift
+        self._serializer        = serializer
         self.adat_out       = Signal()
         self.addr_in        = Signal(3)
         self.sample_in      = Signal(24)
@@ -62,9 +115,25 @@ class ADATTransmitter(Elaboratable):
         self.valid_in       = Signal()
         self.ready_out      = Signal()
         self.last_in        = Signal()
-        self.fifo_level_out = Signal(range(fifo_depth+1))
+        # AsyncFIFO rounds its depth up to a power of two,
+        # so the FIFO level can go up to more than fifo_depth
+        if clk_freq is None:
+            self.transmit_fifo = AsyncFIFO(width=25, depth=fifo_depth, w_domain="sync", r_domain="adat")
+        else:
+            # the read port of SyncFIFOBuffered is registered, so that its memory fits into block RAM.
+            # Its output register holds one more word on top of the fifo_depth words of the memory,
+            # and is counted in the FIFO level like them
+            self.transmit_fifo = SyncFIFOBuffered(width=25, depth=fifo_depth + 1)
+        self.fifo_level_out = Signal(range(self.transmit_fifo.depth + 1))
         self.underflow_out  = Signal()
 
+        self.fifo_level_error_out = Signal(signed(len(self.fifo_level_out) + 1))
+        self.fifo_level_trend_out = Signal(signed(len(self.fifo_level_out) + 1))
+
+        if clk_freq is not None:
+            self.bit_clock         = ADATBitClockGenerator(clk_freq, samplerate)
+            self.bit_clock_trim_in = self.bit_clock.trim_in
+
         self.mem = Memory(width=24, depth=8, name="sample_buffer")
 
     @staticmethod
@@ -85,19 +154,22 @@ class ADATTransmitter(Elaboratable):
 
         # the highest bit in the FIFO marks a frame border
         frame_border_flag = 24
-        m.submodules.transmit_fifo = transmit_fifo = AsyncFIFO(width=25, depth=self._fifo_depth, w_domain="sync", r_domain="adat")
+        m.submodules.transmit_fifo = transmit_fifo = self.transmit_fifo
+        if self._clk_freq is None:
+            bit_enable = Const(1)
+        else:
+            # everything runs in the sync domain, the adat domain
+            # will be clock enabled by the bit clock generator
+            m.submodules.bit_clock = self.bit_clock
+            bit_enable = self.bit_clock.bit_enable_out
 
         # needed for output processing
         m.submodules.nrzi_encoder = nrzi_encoder = NRZIEncoder()
 
-        transmitted_frame      = Signal(30)
-        transmit_counter       = Signal(5)
-
         comb += [
             self.ready_out       .eq(transmit_fifo.w_rdy),
             self.fifo_level_out  .eq(transmit_fifo.w_level),
             self.adat_out        .eq(nrzi_encoder.nrzi_out),
-            nrzi_encoder.data_in .eq(transmitted_frame.bit_select(transmit_counter, 1)),
             self.underflow_out   .eq(0)
         ]
 
@@ -149,6 +221,31 @@ class ADATTransmitter(Elaboratable):
                     with m.If(channel_counter == 7):
                         m.next = "DATA"
 
+        #
+        # FIFO level servo: smooth the FIFO level with an exponential moving average,
+        # so that the frame sized bursts on the write side are filtered out
+        #
+        level_accumulator = Signal(len(self.fifo_level_out) + self._servo_shift)
+        smoothed_level    = Signal.like(self.fifo_level_out)
+        previous_level    = Signal.like(self.fifo_level_out)
+        window_counter    = Signal(self._servo_shift)
+
+        comb += [
+            smoothed_level            .eq(level_accumulator >> self._servo_shift),
+            self.fifo_level_error_out .eq(smoothed_level - self._fifo_target_level),
+        ]
+
+        sync += [
+            level_accumulator.eq(level_accumulator + transmit_fifo.w_level - smoothed_level),
+            window_counter.eq(window_counter + 1),
+        ]
+
+        with m.If(window_counter == 0):
+            sync += [
+                self.fifo_level_trend_out .eq(smoothed_level - previous_level),
+                previous_level            .eq(smoothed_level),
+            ]
+
         #
         # Read the FIFO and send data in the adat domain
         #
@@ -156,31 +253,146 @@ class ADATTransmitter(Elaboratable):
         # 1 bit before the sync pad and one bit before the user data nibble
         filler_bits = [Const(1, 1) for _ in range(7)]
 
-        adat += transmit_counter.eq(transmit_counter - 1)
+        # generate the adat data for one channel 0b1dddd1dddd1dddd1dddd1dddd1dddd where d is the PCM audio data
+        channel_word  = Signal(30)
+        # generate the adat sync_pad along with the user_bits 0b100000000001uuuu where u is user_data
+        sync_pad_word = Signal(16)
+        comb += [
+            channel_word  .eq(Cat(zip(list(self.chunks(transmit_fifo.r_data[:25], 4)), filler_bits))),
+            sync_pad_word .eq((1 << 15) | (1 << 4) | transmit_fifo.r_data[:5]),
+        ]
+
         comb += transmit_fifo.r_en.eq(0)
 
+        # strobed, when the serializer takes a word, or finds the FIFO empty
+        fed     = Signal()
+        starved = Signal()
+        if self._serializer == "mux":
+            self.mux_serializer(m, transmit_fifo, bit_enable, nrzi_encoder, channel_word, sync_pad_word, fed, starved)
+        else:
+            self.shift_serializer(m, transmit_fifo, bit_enable, nrzi_encoder, channel_word, sync_pad_word, fed, starved)
+
+        # only the first empty word of a run counts, and not the ones before the first word after reset
+        started  = Signal()
+        dry      = Signal()
+        underrun = Signal()
+        with m.If(fed):
+            adat += [
+                started .eq(1),
+                dry     .eq(0),
+            ]
+        with m.If(starved):
+            adat += dry.eq(1)
+        comb += underrun.eq(starved & started & ~dry)
+
+        if self._clk_freq is None:
+            m.submodules.underrun_cdc = underrun_cdc = PulseSynchronizer(i_domain="adat", o_domain="sync")
+            comb += underrun_cdc.i.eq(underrun)
+            underrun = underrun_cdc.o
+        with m.If(underrun):
+            comb += self.underflow_out.eq(1)
+
+        if self._clk_freq is not None:
+            return DomainRenamer({"adat": "sync"})(EnableInserter({"adat": bit_enable})(m))
+
+        return m
+
+    def mux_serializer(self, m: Module, transmit_fifo, bit_enable, nrzi_encoder: NRZIEncoder,
+                       channel_word: Signal, sync_pad_word: Signal, fed: Signal, starved: Signal):
+        """transmit each bit of the current word through a multiplexer,
+           and read the next word from the FIFO when the current one is done"""
+        adat = m.d.adat
+        comb = m.d.comb
+
+        frame_border_flag = 24
+        transmitted_frame = Signal(30)
+        transmit_counter  = Signal(5)
+
+        comb += nrzi_encoder.data_in.eq(transmitted_frame.bit_select(transmit_counter, 1))
+
+        adat += transmit_counter.eq(transmit_counter - 1)
+
         with m.If(transmit_counter == 0):
             with m.If(transmit_fifo.r_rdy):
-                comb += transmit_fifo.r_en.eq(1)
+                comb += [
+                    transmit_fifo.r_en .eq(bit_enable),
+                    fed                .eq(bit_enable),
+                ]
 
                 with m.If(transmit_fifo.r_data[frame_border_flag] == 0):
                     adat += [
                         transmit_counter.eq(29),
-                        # generate the adat data for one channel 0b1dddd1dddd1dddd1dddd1dddd1dddd where d is the PCM audio data
-                        transmitted_frame.eq(Cat(zip(list(self.chunks(transmit_fifo.r_data[:25], 4)), filler_bits)))
+                        transmitted_frame.eq(channel_word)
                     ]
                 with m.Else():
                     adat += [
                         transmit_counter.eq(15),
-                        # generate the adat sync_pad along with the user_bits 0b100000000001uuuu where u is user_data
-                        transmitted_frame.eq((1 << 15) | (1 << 4) | transmit_fifo.r_data[:5])
+                        transmitted_frame.eq(sync_pad_word)
                     ]
 
             with m.Else():
                 # this should not happen: panic / stop transmitting.
+                comb += starved.eq(bit_enable)
                 adat += [
                     transmitted_frame.eq(0x00),
                     transmit_counter.eq(4)
                 ]
 
-        return m
+    def shift_serializer(self, m: Module, transmit_fifo, bit_enable, nrzi_encoder: NRZIEncoder,
+                         channel_word: Signal, sync_pad_word: Signal, fed: Signal, starved: Signal):
+        """shift out the current word MSB first, while the next word
+           is read from the FIFO and encoded into a staging register.
+           No decision in the output path depends on more than a few bits"""
+        adat = m.d.adat
+        comb = m.d.comb
+
+        frame_border_flag = 24
+        shift_register    = Signal(30)
+        transmit_counter  = Signal(5)
+        # strobed in the cycle, in which the last bit of the current word is transmitted
+        load              = Signal(reset=1)
+
+        staged_word       = Signal(30)
+        staged_counter    = Signal(5)
+        staged_valid      = Signal()
+
+        comb += nrzi_encoder.data_in.eq(shift_register[-1])
+
+        adat += [
+            shift_register   .eq(shift_register << 1),
+            transmit_counter .eq(transmit_counter - 1),
+            load             .eq(transmit_counter == 1),
+        ]
+
+        with m.If(load):
+            with m.If(staged_valid):
+                comb += fed.eq(bit_enable)
+                adat += [
+                    shift_register   .eq(staged_word),
+                    transmit_counter .eq(staged_counter),
+                    staged_valid     .eq(0),
+                ]
+            with m.Else():
+                # this should not happen: panic / stop transmitting.
+                comb += starved.eq(bit_enable)
+                adat += [
+                    shift_register   .eq(0x00),
+                    transmit_counter .eq(4),
+                ]
+
+        # refill the staging register as soon as its word has been loaded
+        with m.If(transmit_fifo.r_rdy & (~staged_valid | load)):
+            comb += transmit_fifo.r_en.eq(bit_enable)
+            adat += staged_valid.eq(1)
+
+            with m.If(transmit_fifo.r_data[frame_border_flag] == 0):
+                adat += [
+                    staged_counter .eq(29),
+                    staged_word    .eq(channel_word)
+                ]
+            with m.Else():
+                adat += [
+                    staged_counter .eq(15),
+                    # the sync pad is shorter than a channel, align it to the MSB
+                    staged_word    .eq(sync_pad_word << 14)
+                ]
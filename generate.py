@@ -3,31 +3,202 @@
 # Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
 # SPDX-License-Identifier: CERN-OHL-W-2.0
 #
+""" Generate Verilog or RTLIL for every variant of the ADAT cores.
+
+    The variants are given by a configuration matrix, which maps
+    each core to the lists of values of its constructor parameters,
+    for example::
+
+        {
+            "receiver":    {"clk_freq": [100e6, 200e6], "pipelined": [false, true]},
+            "transmitter": {"fifo_depth": [36, 64]}
+        }
+
+    Every combination of the parameter values of a core is one variant.
+    The variants are built in parallel worker processes. Each output is cached
+    under a hash of the core, its parameters, the output format and the source code
+    of the cores and of this script, so that unchanged variants are skipped on rebuild.
+"""
+import os
 import sys
-from amaranth.cli import main
-from adat import *
+import json
+import hashlib
+import argparse
+import itertools
+import importlib.metadata
+from concurrent.futures import ProcessPoolExecutor
+
+from amaranth.back import rtlil, verilog
+
+from adat.nrzidecoder import NRZIDecoder
+from adat.receiver    import ADATReceiver
+from adat.transmitter import ADATTransmitter
+from adat.repeater    import ADATRepeater
+from adat.aligner     import ADATFrameAligner
+from adat.tdm         import ADATTDMBridge
+
+def nrzidecoder_ports(d: NRZIDecoder) -> list:
+    return [d.nrzi_in, d.invalid_frame_in, d.data_out, d.data_out_en,
+            d.recovered_clock_out, d.running, d.idle_out]
+
+def receiver_ports(r: ADATReceiver) -> list:
+    ports = [r.adat_in, r.addr_out, r.sample_out, r.output_enable,
+             r.user_data_out, r.recovered_clock_out, r.synced_out, r.channel_mask_in, r.idle_out,
+             r.bit_strobe_out]
+    if r.output_format != "sample":
+        ports += [r.word_out, r.word_channel_out, r.word_valid_out, r.word_last_out]
+    if r.timestamps:
+        ports += [r.frame_counter_out, r.timestamp_out]
+    return ports
+
+def transmitter_ports(t: ADATTransmitter) -> list:
+    ports = [t.addr_in, t.sample_in, t.user_data_in, t.valid_in,
+             t.ready_out, t.last_in, t.adat_out, t.underflow_out, t.fifo_level_out,
+             t.fifo_level_error_out, t.fifo_level_trend_out]
+    if hasattr(t, "bit_clock"):
+        ports.append(t.bit_clock_trim_in)
+    return ports
+
+def repeater_ports(r: ADATRepeater) -> list:
+    ports = [r.adat_in, r.adat_out, r.synced_out, r.recovered_clock_out,
+             r.overwrite_mask_in, r.addr_in, r.sample_in, r.valid_in]
+    if r.tap:
+        ports += [r.addr_out, r.sample_out, r.output_enable, r.user_data_out]
+    return ports
+
+def aligner_ports(a: ADATFrameAligner) -> list:
+    return a.addr_in + a.sample_in + a.valid_in + a.user_data_in + a.timestamp_in + \
+           [a.port_out, a.addr_out, a.sample_out, a.user_data_out, a.timestamp_out, a.valid_out,
+            a.ready_in, a.last_out, a.skew_out, a.frame_counter_out] + a.slips_out + a.level_out
+
+def tdm_ports(t: ADATTDMBridge) -> list:
+    return [t.addr_in, t.sample_in, t.valid_in, t.synced_in, t.bit_strobe_in, t.recovered_clock_in,
+            t.bclk_out, t.ws_out, t.data_out]
+
+# core name: (module name, class, ports)
+CORES = {
+    "nrzidecoder": ("nrzi_decoder",     NRZIDecoder,     nrzidecoder_ports),
+    "receiver":    ("adat_receiver",    ADATReceiver,    receiver_ports),
+    "transmitter": ("adat_transmitter", ADATTransmitter, transmitter_ports),
+    "repeater":    ("adat_repeater",    ADATRepeater,    repeater_ports),
+    "aligner":     ("adat_aligner",     ADATFrameAligner, aligner_ports),
+    "tdm":         ("adat_tdm_bridge",  ADATTDMBridge,   tdm_ports),
+}
+
+DEFAULT_MATRIX = {
+    "nrzidecoder": {"clk_freq": [50e6, 100e6, 200e6]},
+    "receiver":    {"clk_freq": [50e6, 100e6, 200e6], "pipelined": [False, True]},
+    "transmitter": {"fifo_depth": [36, 72], "serializer": ["mux", "shift"]},
+    "repeater":    {"clk_freq": [50e6, 100e6], "tap": [False, True]},
+    "aligner":     {"ports": [2, 4, 8], "clk_freq": [100e6]},
+    "tdm":         {"mode": ["tdm8", "i2s"]},
+}
+
+EXTENSIONS = {
+    "verilog": "v",
+    "rtlil":   "il",
+}
+
+def variants(matrix: dict) -> list:
+    """expand the configuration matrix into a list of (core, parameters)"""
+    result = []
+    for core, parameters in matrix.items():
+        if core not in CORES:
+            raise ValueError(f"unknown core '{core}', available cores: {', '.join(CORES)}")
+        names = sorted(parameters)
+        for values in itertools.product(*(parameters[name] for name in names)):
+            result.append((core, dict(zip(names, values))))
+    return result
+
+def format_value(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+def variant_name(core: str, parameters: dict) -> str:
+    """the file name of a variant, without extension"""
+    module_name = CORES[core][0]
+    return "-".join([module_name] + [f"{name}={format_value(value)}" for name, value in sorted(parameters.items())])
+
+def source_hash() -> str:
+    """hash the source code of the cores, of this script with its module names and port lists,
+       and the versions of the tools generating them"""
+    sha = hashlib.sha256()
+    package_dir = os.path.dirname(sys.modules[NRZIDecoder.__module__].__file__)
+    paths = [os.path.join(package_dir, filename) for filename in sorted(os.listdir(package_dir))
+            if filename.endswith(".py")]
+    for path in paths + [os.path.abspath(__file__)]:
+        with open(path, "rb") as f:
+            sha.update(os.path.basename(path).encode() + b"\0" + f.read())
+    for distribution in ["amaranth", "amlib"]:
+        try:
+            version = importlib.metadata.version(distribution)
+        except importlib.metadata.PackageNotFoundError:
+            version = "unknown"
+        sha.update(f"{distribution}={version}\0".encode())
+    return sha.hexdigest()
+
+def cache_key(core: str, parameters: dict, output_format: str, sources: str) -> str:
+    description = json.dumps([core, parameters, output_format, sources], sort_keys=True)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+def build_variant(job: tuple) -> tuple:
+    """elaborate and convert one variant, returns (output file, built)
+       where built is False, when the cached output was up to date"""
+    core, parameters, output_format, output_dir, sources, force = job
+    module_name, cls, ports = CORES[core]
+
+    output_file = os.path.join(output_dir, f"{variant_name(core, parameters)}.{EXTENSIONS[output_format]}")
+    key_file    = output_file + ".sha256"
+    key         = cache_key(core, parameters, output_format, sources)
+
+    if not force and os.path.exists(output_file) and os.path.exists(key_file):
+        with open(key_file) as f:
+            if f.read().strip() == key:
+                return output_file, False
+
+    elaboratable = cls(**parameters)
+    backend = verilog if output_format == "verilog" else rtlil
+    output = backend.convert(elaboratable, name=module_name, ports=ports(elaboratable))
+
+    with open(output_file, "w") as f:
+        f.write(output)
+    # write the key last, so that an interrupted build is not mistaken for a cached one
+    with open(key_file, "w") as f:
+        f.write(key)
+
+    return output_file, True
+
+def main(argv: list=None):
+    parser = argparse.ArgumentParser(description="generate Verilog or RTLIL for all variants of the ADAT cores")
+    parser.add_argument("cores", nargs="*", help=f"only build these cores, out of: {', '.join(CORES)}")
+    parser.add_argument("-c", "--config", help="JSON file with the configuration matrix, "
+                                               "defaults to the built in matrix")
+    parser.add_argument("-f", "--format", choices=EXTENSIONS, default="verilog", help="output format")
+    parser.add_argument("-o", "--output-dir", default="build", help="output directory")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--force", action="store_true", help="rebuild all variants, ignoring the cache")
+    args = parser.parse_args(argv)
+
+    matrix = DEFAULT_MATRIX
+    if args.config:
+        with open(args.config) as f:
+            matrix = json.load(f)
+
+    if args.cores:
+        unknown = set(args.cores) - set(matrix)
+        if unknown:
+            parser.error(f"no variants of {', '.join(sorted(unknown))} in the configuration matrix")
+        matrix = {core: matrix[core] for core in args.cores}
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    sources = source_hash()
+    jobs = [(core, parameters, args.format, args.output_dir, sources, args.force)
+            for core, parameters in variants(matrix)]
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        for output_file, built in executor.map(build_variant, jobs):
+            print(f"{'built ' if built else 'cached'} {output_file}")
 
 if __name__ == "__main__":
-    modulename = sys.argv[1]
-    sys.argv[1] = "generate"
-
-    if modulename == "nrzidecoder":
-        module = NRZIDecoder(100e6)
-        main(module, name="nrzi_decoder", ports=[module.nrzi_in, module.data_out])
-    elif modulename == "receiver":
-        r = ADATReceiver(100e6)
-        main(r, name="adat_receiver", ports=[
-            r.clk, r.reset_in,
-            r.adat_in, r.addr_out,
-            r.sample_out, r.output_enable, r.user_data_out])
-    elif modulename == "transmitter":
-        t = ADATTransmitter()
-        main(t, name="adat_transmitter", ports=[
-            t.addr_in,
-            t.sample_in,
-            t.user_data_in,
-            t.valid_in,
-            t.ready_out,
-            t.last_in,
-            t.adat_out,
-        ])
\ No newline at end of file
+    main()
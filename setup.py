@@ -22,6 +22,10 @@ setup(
         "amaranth>=0.2,<0.5",
         "importlib_metadata; python_version<'3.8'",
     ],
+    extras_require={
+        # for the simulation transactors in adat.sim
+        "sim": ["numpy"],
+    },
     packages=find_packages(),
     project_urls={
         "Source Code": "https://github.com/hansfbaier/adat-core",
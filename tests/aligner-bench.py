@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+""" capture several ADAT inputs with a common word clock, but different phases,
+    through ADATReceivers and ADATFrameAligner. One input starts late and another one
+    drops out for a few frames. Every aligned frame has to consist of the frames,
+    which were sent in the same word clock period, and the bench reports
+    the skew and the slips of every port.
+"""
+import sys
+import argparse
+sys.path.append('.')
+
+import numpy as np
+from amaranth     import Elaboratable, Signal, Module
+from amaranth.sim import Simulator, Tick, Passive
+
+from adat.protocol import adat_freq, CHANNELS, FRAME_BITS
+from adat.receiver import ADATReceiver
+from adat.aligner  import ADATFrameAligner
+from adat.sim      import random_frames, encode_frames, encode_nrzi, stick_levels, stack_columns, drive_columns
+
+class AlignedCapture(Elaboratable):
+    """one ADATReceiver per port, feeding ADATFrameAligner. Bit k of adat_in is the input of port k,
+       driven from the adat domain. kwargs are passed on to ADATFrameAligner"""
+    def __init__(self, ports: int, clk_freq: float, **kwargs):
+        self.adat_in   = Signal(ports)
+        self.receivers = [ADATReceiver(clk_freq, timestamps=True) for _ in range(ports)]
+        self.aligner   = ADATFrameAligner(ports, clk_freq, **kwargs)
+
+    def elaborate(self, platform) -> Module:
+        m = Module()
+        m.submodules.aligner = aligner = self.aligner
+        for port, receiver in enumerate(self.receivers):
+            m.submodules[f"receiver{port}"] = receiver
+            m.d.adat += receiver.adat_in.eq(self.adat_in[port])
+            m.d.comb += aligner.connect_receiver(port, receiver)
+        return m
+
+def run_aligner(offsets: list, late_frames: int=3, dropout_frames: int=2, frames: int=24,
+                samplerate: int=48000, clk_freq: float=50e6, slots: int=4, seed: int=0) -> dict:
+    """send frames on len(offsets) ports, port p delayed by offsets[p] bits.
+       The second port starts late_frames frames later, the last port drops out
+       for dropout_frames frames in the middle. Returns the aligned frames and the statistics"""
+    ports = len(offsets)
+    samples = [random_frames(frames, seed + port) for port in range(ports)]
+
+    streams = []
+    for port, (port_samples, user_data) in enumerate(samples):
+        # one more frame, so that the receiver outputs the last channel of the last frame
+        bits   = encode_frames(np.vstack([port_samples, np.zeros((1, CHANNELS), dtype=int)]), np.append(user_data, 0))
+        levels = np.concatenate([np.ones(offsets[port], dtype=np.uint8), encode_nrzi(bits)])
+        if port == 1 and late_frames:
+            levels[:offsets[port] + late_frames * FRAME_BITS] = 1
+        if port == ports - 1 and dropout_frames:
+            # after the first bit of the sync pad, which the receiver needs to output the last channel
+            dropout = offsets[port] + frames // 2 * FRAME_BITS + 1
+            levels  = stick_levels(levels, dropout, dropout_frames * FRAME_BITS, levels[dropout])
+        streams.append(levels)
+    columns = stack_columns(streams)
+
+    dut = AlignedCapture(ports, clk_freq, max_samplerate=samplerate, frames=slots)
+    aligner = dut.aligner
+    sim = Simulator(dut)
+    sim.add_clock(1.0/clk_freq, domain="sync")
+    sim.add_clock(1.0/adat_freq(samplerate), domain="adat")
+
+    aligned = [[]]
+    skews   = []
+    slips   = []
+
+    def adat_process():
+        yield from drive_columns(dut.adat_in, columns)
+        # time for the last aligned frame to come out
+        for _ in range(FRAME_BITS):
+            yield Tick("adat")
+        for port in range(ports):
+            slips.append((yield aligner.slips_out[port]))
+
+    def output_process():
+        yield Passive()
+        while True:
+            yield Tick("sync")
+            if not (yield aligner.valid_out):
+                continue
+            port    = yield aligner.port_out
+            channel = yield aligner.addr_out
+            if port == 0 and channel == 0:
+                skews.append((yield aligner.skew_out))
+            aligned[-1].append((port, channel, (yield aligner.sample_out)))
+            if (yield aligner.last_out):
+                aligned.append([])
+
+    sim.add_sync_process(adat_process, domain="adat")
+    sim.add_sync_process(output_process, domain="sync")
+    sim.run()
+
+    # identify each port's frame in every aligned frame, except for the empty frame sent last
+    sent_frames = []
+    for words in aligned[:-1]:
+        if all(sample == 0 for _, _, sample in words):
+            continue
+        frame_samples = np.zeros((ports, CHANNELS), dtype=np.int64)
+        for port, channel, sample in words:
+            frame_samples[port, channel] = sample
+        indices = []
+        for port in range(ports):
+            match = np.flatnonzero(np.all(samples[port][0] == frame_samples[port], axis=1))
+            indices.append(int(match[0]) if len(match) else -1)
+        sent_frames.append(indices)
+
+    return dict(
+        ports        = ports,
+        offsets      = offsets,
+        sent_frames  = np.array(sent_frames, dtype=np.int64).reshape(-1, ports),
+        skews        = np.array(skews, dtype=np.int64),
+        slips        = slips,
+        cycles_per_bit = clk_freq / adat_freq(samplerate),
+        lost_frames  = late_frames + dropout_frames,
+        frames       = frames,
+    )
+
+def check_result(result: dict):
+    sent_frames = result["sent_frames"]
+    assert np.all(sent_frames >= 0), "aligned frames with unknown samples"
+    assert np.all(sent_frames == sent_frames[:, :1]), \
+        f"frames of different periods aligned: {sent_frames[np.any(sent_frames != sent_frames[:, :1], axis=1)]}"
+    assert np.all(np.diff(sent_frames[:, 0]) > 0), "aligned frames out of order"
+    # the receivers need up to two frames to lock after the start, and one to relock after the dropout.
+    # Meanwhile the other ports keep their most recent frames, so no more periods are lost
+    assert len(sent_frames) >= result["frames"] - result["lost_frames"] - 3, f"only {len(sent_frames)} aligned frames"
+
+    offsets = result["offsets"]
+    skew_bits = result["skews"] / result["cycles_per_bit"]
+    assert np.all(np.abs(skew_bits - (max(offsets) - min(offsets))) <= 1), f"skews of {skew_bits} bits"
+
+def print_result(result: dict):
+    skew_bits = result["skews"] / result["cycles_per_bit"]
+    print(f"{str(result['offsets']):>20}  {len(result['sent_frames']):7}  "
+          f"{skew_bits.min():6.2f} {skew_bits.max():6.2f}  {' '.join(str(slips) for slips in result['slips'])}", flush=True)
+
+def test_aligner(offset_sets: list, **kwargs):
+    print(f"{'offsets in bits':>20}  {'aligned':>7}  {'skew in bits':>13}  slips per port")
+    for offsets in offset_sets:
+        result = run_aligner(offsets, **kwargs)
+        print_result(result)
+        check_result(result)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="align the frames of several ADAT inputs with a common word clock")
+    parser.add_argument("-p", "--ports", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("-s", "--samplerate", type=int, default=48000)
+    parser.add_argument("--clk-freq", type=float, default=50e6)
+    parser.add_argument("-n", "--frames", type=int, default=24)
+    parser.add_argument("--slots", type=int, default=4)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    # up to a third of a frame apart, the aligner tolerates half a frame
+    offset_sets = [[0] * ports for ports in args.ports] + \
+                  [rng.integers(0, FRAME_BITS // 3, ports).tolist() for ports in args.ports]
+    test_aligner(offset_sets, frames=args.frames, samplerate=args.samplerate,
+                 clk_freq=args.clk_freq, slots=args.slots)
+    print("Success!")
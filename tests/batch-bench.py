@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+""" measure how many receiver scenarios per second one simulation covers,
+    when it simulates a batch of K independent receivers
+"""
+import sys
+import time
+import argparse
+sys.path.append('.')
+
+import numpy as np
+from amaranth.sim import Simulator
+
+from adat.protocol import adat_freq
+from adat.sim      import ADATReceiverBatch, random_frames, encode_frames, encode_nrzi, \
+                          stack_columns, drive_columns, BatchSampleMonitor, compare_frames
+
+def run_batch(instances: int, frames: int=8, samplerate: int=48000, clk_freq: float=100e6, seed: int=0) -> float:
+    """simulate a batch of receivers, each receiving its own random frames,
+       check all of them and return the wall clock time"""
+    scenarios = [random_frames(frames, seed + k) for k in range(instances)]
+    # one more frame each, so that the receivers output the last channel of the last frame
+    streams = [encode_nrzi(encode_frames(np.vstack([samples, np.zeros((1, 8), dtype=int)]), np.append(user_data, 0)))
+               for samples, user_data in scenarios]
+
+    dut = ADATReceiverBatch(instances, clk_freq)
+    sim = Simulator(dut)
+    sim.add_clock(1.0/clk_freq, domain="sync")
+    sim.add_clock(1.0/adat_freq(samplerate), domain="adat")
+
+    columns = stack_columns(streams)
+    monitor = BatchSampleMonitor(dut, frames)
+
+    def adat_process():
+        yield from drive_columns(dut.adat_in, columns)
+
+    sim.add_sync_process(adat_process, domain="adat")
+    sim.add_sync_process(monitor.process, domain="sync")
+
+    start = time.perf_counter()
+    sim.run()
+    wall_time = time.perf_counter() - start
+
+    for k, (samples, user_data) in enumerate(scenarios):
+        result = compare_frames(samples, user_data, *monitor.result(k))
+        # the receiver needs one frame to synchronize
+        assert result["received"] == frames - 1, f"instance {k}: received {result['received']} frames"
+        assert result["bit_errors"] == 0,        f"instance {k}: {result['bit_errors']} bit errors"
+    return wall_time
+
+def test_batch_sizes(batch_sizes: list, frames: int=8):
+    print(f"{'K':>4}  {'wall s':>7}  {'scenarios/s':>11}  {'speedup':>7}")
+    single = None
+    for instances in batch_sizes:
+        rate = instances / run_batch(instances, frames)
+        if instances == 1:
+            single = rate
+        speedup = f"{rate / single:7.2f}" if single else "      -"
+        print(f"{instances:4}  {instances / rate:7.2f}  {rate:11.3f}  {speedup}", flush=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="scenarios per second as a function of the batch size")
+    parser.add_argument("-k", "--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("-n", "--frames", type=int, default=8, help="frames per scenario")
+    args = parser.parse_args()
+    test_batch_sizes(args.batch_sizes, args.frames)
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+""" place and route the cores with a local yosys and nextpnr
+    and report the achieved Fmax of each of their clocks
+"""
+import sys
+sys.path.append('.')
+
+from adat.transmitter import ADATTransmitter
+from adat.receiver    import ADATReceiver
+from generate         import receiver_ports, transmitter_ports
+from synthesis        import place_and_route, print_fmax
+
+def transmitter_fmax(family: str="ice40"):
+    """compare the Fmax of the transmitter serializers"""
+    for serializer in ["mux", "shift"]:
+        transmitter = ADATTransmitter(serializer=serializer)
+        print_fmax(f"transmitter, {serializer} serializer",
+                   place_and_route(transmitter, transmitter_ports(transmitter), family))
+
+def receiver_fmax(family: str="ice40", clk_freq: float=200e6):
+    """compare the Fmax of the receiver with and without pipelining"""
+    for pipelined in [False, True]:
+        receiver = ADATReceiver(clk_freq, pipelined=pipelined)
+        print_fmax(f"receiver, {'pipelined' if pipelined else 'not pipelined'}",
+                   place_and_route(receiver, receiver_ports(receiver), family, target_freq=int(clk_freq // 1e6)))
+
+if __name__ == "__main__":
+    family = sys.argv[1] if len(sys.argv) > 1 else "ice40"
+    transmitter_fmax(family)
+    receiver_fmax(family)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+""" fault injection fuzzer for the receiver.
+    Every scenario is a short stream of random frames with one fault at a random position,
+    which is chosen by the seed of the scenario alone, so that every scenario can be replayed.
+    Reports the distribution of the frames lost per fault and of the lock reacquisition time.
+    Scenarios, which lose more frames than the fault hits, plus a margin,
+    or do not recover at all, are saved for replay.
+"""
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+sys.path.append('.')
+
+import numpy as np
+from amaranth.sim import Simulator
+
+from adat.protocol import adat_freq, FRAME_BITS, SYNC_PAD_BITS
+from adat.sim      import ADATReceiverBatch, random_frames, encode_frames, encode_nrzi, \
+                          separator_positions, flip_bit, drop_bits, truncate_frame, stick_levels, glitch_levels, \
+                          stack_columns, drive_columns, BatchSampleMonitor, BatchSyncMonitor, compare_frames
+
+# the line is sampled that many times per bit, so that glitches can be shorter than a bit
+OVERSAMPLING   = 4
+# frames before the faulty frame, the receiver needs one to lock
+WARMUP_FRAMES  = 3
+# frames after the faulty frame, the receiver needs to be back to normal by the end of them
+RECOVERY_FRAMES = 8
+
+FAULTS = ["bit_flip", "dropped_separator", "truncated_frame", "stuck_line", "glitch"]
+
+def make_scenario(seed: int, faults: list) -> dict:
+    """choose the fault and its position from the seed"""
+    rng   = np.random.default_rng(seed)
+    fault = faults[rng.integers(len(faults))]
+    frame = WARMUP_FRAMES
+    # frames_hit: how many frames the fault corrupts
+    scenario = dict(seed=seed, fault=fault, frame=frame, frames_hit=1)
+
+    if fault == "bit_flip":
+        scenario["position"] = frame * FRAME_BITS + int(rng.integers(FRAME_BITS))
+    elif fault == "dropped_separator":
+        scenario["position"] = int(rng.choice(separator_positions(frame)))
+    elif fault == "truncated_frame":
+        scenario["length"] = int(rng.integers(SYNC_PAD_BITS, FRAME_BITS))
+    elif fault == "stuck_line":
+        # in line samples: from a bit up to two frames
+        scenario["position"] = (frame * FRAME_BITS + int(rng.integers(FRAME_BITS))) * OVERSAMPLING
+        scenario["length"]   = int(rng.integers(OVERSAMPLING, 2 * FRAME_BITS * OVERSAMPLING))
+        scenario["level"]    = int(rng.integers(2))
+        frame_samples = FRAME_BITS * OVERSAMPLING
+        scenario["frames_hit"] = (scenario["position"] + scenario["length"] - 1) // frame_samples \
+                                 - scenario["position"] // frame_samples + 1
+    elif fault == "glitch":
+        # in line samples: shorter than a bit
+        scenario["position"] = (frame * FRAME_BITS + int(rng.integers(FRAME_BITS))) * OVERSAMPLING + int(rng.integers(OVERSAMPLING))
+        scenario["length"]   = int(rng.integers(1, OVERSAMPLING))
+    return scenario
+
+def scenario_levels(scenario: dict, samples, user_data) -> np.ndarray:
+    """the oversampled line levels of the frames with the fault of the scenario"""
+    # one more frame, so that the receiver outputs the last channel of the last frame
+    bits = encode_frames(np.vstack([samples, np.zeros((1, samples.shape[1]), dtype=int)]), np.append(user_data, 0))
+
+    fault = scenario["fault"]
+    if fault == "bit_flip":
+        bits = flip_bit(bits, scenario["position"])
+    elif fault == "dropped_separator":
+        bits = drop_bits(bits, scenario["position"])
+    elif fault == "truncated_frame":
+        bits = truncate_frame(bits, scenario["frame"], scenario["length"])
+
+    levels = np.repeat(encode_nrzi(bits), OVERSAMPLING)
+
+    if fault == "stuck_line":
+        levels = stick_levels(levels, scenario["position"], scenario["length"], scenario["level"])
+    elif fault == "glitch":
+        levels = glitch_levels(levels, scenario["position"], scenario["length"])
+    return levels
+
+def run_batch(job: tuple) -> list:
+    """simulate a batch of scenarios with one receiver each in one simulation,
+       returns the scenarios with the frames lost and the lock reacquisition time in bits"""
+    scenarios, config = job
+    frames = WARMUP_FRAMES + 1 + RECOVERY_FRAMES
+    frame_data = [random_frames(frames, scenario["seed"]) for scenario in scenarios]
+
+    clk_freq = config["clk_freq"]
+    dut = ADATReceiverBatch(len(scenarios), clk_freq, pipelined=config["pipelined"])
+    sim = Simulator(dut)
+    sim.add_clock(1.0/clk_freq, domain="sync")
+    sim.add_clock(1.0/(adat_freq(config["samplerate"]) * OVERSAMPLING), domain="adat")
+
+    # dropped bits and truncated frames make some streams shorter, they idle at their last level
+    columns = stack_columns([scenario_levels(scenario, samples, user_data)
+                             for scenario, (samples, user_data) in zip(scenarios, frame_data)])
+    sample_monitor = BatchSampleMonitor(dut, frames)
+    # ignore the lock before the faulty frame
+    sync_monitor   = BatchSyncMonitor(dut.synced_out, domain="adat",
+                                      settle_cycles=WARMUP_FRAMES * FRAME_BITS * OVERSAMPLING)
+
+    def adat_process():
+        yield from drive_columns(dut.adat_in, columns)
+
+    sim.add_sync_process(adat_process, domain="adat")
+    sim.add_sync_process(sample_monitor.process, domain="sync")
+    sim.add_sync_process(sync_monitor.process, domain="adat")
+    sim.run()
+
+    results = []
+    for k, (scenario, (samples, user_data)) in enumerate(zip(scenarios, frame_data)):
+        frames_result = compare_frames(samples, user_data, *sample_monitor.result(k))
+        frames_lost   = int(frames_result["lost"] + frames_result["errored_frames"] + frames_result["not_received"])
+
+        reacquisition = 0
+        lost = sync_monitor.lost[k]
+        if lost:
+            locked = [cycle for cycle in sync_monitor.locked[k] if cycle > lost[0]]
+            reacquisition = (locked[0] - lost[0]) / OVERSAMPLING if locked else None
+
+        recovered = reacquisition is not None and frames_result["not_received"] == 0 and frames_result["first"] >= 0
+        results.append(dict(scenario, frames_lost=frames_lost, reacquisition=reacquisition,
+                            failed=not recovered or frames_lost > scenario["frames_hit"] + config["max_extra_lost"]))
+    return results
+
+def run_scenarios(scenarios: list, config: dict, jobs: int=None, batch: int=8) -> list:
+    batches = [scenarios[start:start + batch] for start in range(0, len(scenarios), batch)]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return [result for results in executor.map(run_batch, [(scenarios, config) for scenarios in batches])
+                       for result in results]
+
+def print_distributions(results: list):
+    for fault in FAULTS:
+        of_fault = [result for result in results if result["fault"] == fault]
+        if not of_fault:
+            continue
+        lost      = np.array([result["frames_lost"] for result in of_fault])
+        histogram = ", ".join(f"{n}: {count}" for n, count in zip(*np.unique(lost, return_counts=True)))
+        print(f"{fault}: {len(of_fault)} scenarios")
+        print(f"    frames lost per fault: {histogram}")
+
+        times = np.array([result["reacquisition"] for result in of_fault if result["reacquisition"]])
+        never = sum(result["reacquisition"] is None for result in of_fault)
+        if len(times):
+            p50, p90 = np.percentile(times, [50, 90])
+            print(f"    lock lost in {len(times) + never} scenarios, reacquired after "
+                  f"median {p50:.0f}, 90% {p90:.0f}, max {times.max():.0f} bits")
+        if never:
+            print(f"    lock not reacquired in {never} scenarios")
+
+def main():
+    parser = argparse.ArgumentParser(description="fuzz the ADAT receiver with randomly placed faults")
+    parser.add_argument("-n", "--scenarios", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first scenario")
+    parser.add_argument("--faults", nargs="+", choices=FAULTS, default=FAULTS)
+    parser.add_argument("-s", "--samplerate", type=int, default=48000)
+    parser.add_argument("--clk-freq", type=float, default=100e6)
+    parser.add_argument("--pipelined", action="store_true")
+    parser.add_argument("--max-extra-lost", type=int, default=2,
+                        help="scenarios losing more frames than the fault hits, plus this, fail")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("-k", "--batch", type=int, default=8, help="scenarios simulated together in one simulation")
+    parser.add_argument("--failures", default="fuzz-failures.json", help="file to save the failing scenarios to")
+    parser.add_argument("--replay", help="run the scenarios saved in this file again")
+    args = parser.parse_args()
+
+    if args.replay:
+        with open(args.replay) as f:
+            saved = json.load(f)
+        config    = saved["config"]
+        scenarios = saved["scenarios"]
+    else:
+        config    = dict(samplerate=args.samplerate, clk_freq=args.clk_freq,
+                         pipelined=args.pipelined, max_extra_lost=args.max_extra_lost)
+        scenarios = [make_scenario(seed, args.faults) for seed in range(args.seed, args.seed + args.scenarios)]
+
+    results = run_scenarios(scenarios, config, args.jobs, args.batch)
+    print_distributions(results)
+
+    failures = [result for result in results if result["failed"]]
+    for failure in failures:
+        print(f"failed: {failure}")
+    print(f"{len(results) - len(failures)} of {len(results)} scenarios recovered")
+
+    if failures and not args.replay:
+        with open(args.failures, "w") as f:
+            json.dump(dict(config=config, scenarios=failures), f, indent=4)
+        print(f"saved the failing scenarios to {args.failures}, replay them with --replay {args.failures}")
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+""" count the bit toggles of all signals of the receiver, as a proxy for its dynamic power,
+    with a dark input, a noisy input and a valid ADAT signal. The toggles are counted
+    in a VCD file of the simulation. A dark input must not toggle anything,
+    after the decoder has found out, that there is no signal.
+"""
+import os
+import sys
+import argparse
+import tempfile
+import collections
+sys.path.append('.')
+
+import numpy as np
+from amaranth.sim import Simulator, Tick
+
+from adat.protocol import adat_freq, FRAME_BITS
+from adat.receiver import ADATReceiver
+from adat.sim      import random_frames, encode_frames, encode_nrzi
+
+def count_toggles(vcd_file: str, skip_cycles: int=0, period: int=None) -> collections.Counter:
+    """the number of bit toggles of every signal in the VCD file, by hierarchical name,
+       after skip_cycles clock periods of period VCD time units"""
+    names, values, toggles = {}, {}, collections.Counter()
+    scope, start, counting = [], 0 if period is None else skip_cycles * period, False
+
+    def change(code: str, value: str):
+        previous = values.get(code)
+        values[code] = value
+        if counting and previous is not None and code in names:
+            width = max(len(value), len(previous))
+            toggles[names[code]] += sum(a != b for a, b in zip(previous.zfill(width), value.zfill(width)))
+
+    with open(vcd_file) as f:
+        for line in f:
+            parts = line.split()
+            if not parts:
+                continue
+            if parts[0] == "$scope":
+                scope.append(parts[2])
+            elif parts[0] == "$upscope":
+                scope.pop()
+            elif parts[0] == "$var":
+                # aliases of the same signal only count once
+                names.setdefault(parts[3], ".".join(scope[1:] + [parts[4]]))
+            elif parts[0][0] == "#":
+                counting = int(parts[0][1:]) > start
+            elif parts[0][0] == "b":
+                change(parts[1], parts[0][1:])
+            elif parts[0][0] in "01xz":
+                change(parts[0][1:], parts[0][0])
+    return toggles
+
+def line_levels(kind: str, cycles: int, cycles_per_bit: float, seed: int=0) -> np.ndarray:
+    """the input levels at every clock cycle: "dark", a valid "signal",
+       or "noise<bits>", with edges every <bits> ADAT bits on average"""
+    if kind == "dark":
+        return np.zeros(cycles, dtype=np.uint8)
+    if kind.startswith("noise"):
+        rng = np.random.default_rng(seed)
+        edges = rng.random(cycles) < 1.0 / (float(kind[5:]) * cycles_per_bit)
+        return (np.cumsum(edges) & 1).astype(np.uint8)
+
+    frames  = int(cycles / cycles_per_bit / FRAME_BITS) + 1
+    samples, user_data = random_frames(frames, seed)
+    levels  = encode_nrzi(encode_frames(samples, user_data))
+    return levels[(np.arange(cycles) / cycles_per_bit).astype(int)]
+
+def run_idle(kind: str, cycles: int=20000, samplerate: int=48000, clk_freq: float=100e6,
+             settle_cycles: int=2000, **kwargs) -> dict:
+    """simulate the receiver with the given input and count the toggles after settle_cycles.
+       kwargs are passed on to ADATReceiver"""
+    cycles_per_bit = clk_freq / adat_freq(samplerate)
+    levels = line_levels(kind, cycles, cycles_per_bit)
+
+    dut = ADATReceiver(clk_freq, **kwargs)
+    sim = Simulator(dut)
+    sim.add_clock(1.0/clk_freq)
+    idle = np.zeros(cycles, dtype=np.uint8)
+
+    def process():
+        for cycle, level in enumerate(levels.tolist()):
+            yield dut.adat_in.eq(level)
+            yield Tick()
+            idle[cycle] = yield dut.idle_out
+    sim.add_sync_process(process)
+
+    with tempfile.TemporaryDirectory() as directory:
+        vcd_file = os.path.join(directory, "idle.vcd")
+        with sim.write_vcd(vcd_file):
+            sim.run()
+        # the VCD time unit is 1 ps
+        toggles = count_toggles(vcd_file, settle_cycles, round(1e12 / clk_freq))
+
+    # the clock and the input are not part of the receiver
+    for name in list(toggles):
+        if name.split(".")[-1] in ("clk", "rst", "adat_in"):
+            del toggles[name]
+
+    measured = cycles - settle_cycles
+    return dict(
+        kind      = kind,
+        toggles   = toggles,
+        rate      = sum(toggles.values()) * 1000 / measured,
+        idle      = float(idle[settle_cycles:].mean()),
+    )
+
+def print_result(result: dict, top: int=3):
+    busiest = ", ".join(f"{name} {count}" for name, count in result["toggles"].most_common(top))
+    print(f"{result['kind']:>8}  {result['rate']:10.1f}  {result['idle'] * 100:5.1f}%  {busiest}", flush=True)
+
+def test_idle(kinds: list, **kwargs) -> dict:
+    print(f"{'input':>8}  {'toggles/1k':>10}  {'idle':>6}  busiest signals")
+    results = {}
+    for kind in kinds:
+        results[kind] = result = run_idle(kind, **kwargs)
+        print_result(result)
+
+    if "dark" in results:
+        # except for the time base of the timestamps, which runs all the time
+        toggles = {name: count for name, count in results["dark"]["toggles"].items() if "cycle_counter" not in name}
+        assert not any(toggles.values()), f"toggles with a dark input: {toggles}"
+        assert results["dark"]["idle"] == 1, "idle_out is not high with a dark input"
+    if "signal" in results:
+        assert results["signal"]["idle"] == 0, "idle_out is high with a valid signal"
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="toggle counts of the receiver with and without an input signal")
+    parser.add_argument("-i", "--inputs", nargs="+", default=["dark", "noise0.5", "noise12", "signal"],
+                        help="dark, signal or noise<bits>, with an edge every <bits> ADAT bits on average")
+    parser.add_argument("-n", "--cycles", type=int, default=20000)
+    parser.add_argument("-s", "--samplerate", type=int, default=48000)
+    parser.add_argument("--clk-freq", type=float, default=100e6)
+    parser.add_argument("--pipelined", action="store_true")
+    parser.add_argument("--timestamps", action="store_true")
+    args = parser.parse_args()
+
+    test_idle(args.inputs, cycles=args.cycles, samplerate=args.samplerate, clk_freq=args.clk_freq,
+              pipelined=args.pipelined, timestamps=args.timestamps)
+    print("Success!")
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+""" measure the start-up time of short python processes importing the adat package,
+    with and without loading the cores
+"""
+import sys
+import time
+import statistics
+import subprocess
+
+STATEMENTS = {
+    "interpreter only":          "pass",
+    "adat_freq only":            "import adat; adat.adat_freq(48000)",
+    # this is what importing the package used to do
+    "all cores":                 "import adat; adat.ADATReceiver; adat.ADATTransmitter; adat.ADATRingBufferWriter",
+}
+
+def startup_time(statement: str, runs: int) -> float:
+    """median wall clock time of a python process executing statement, in ms"""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+def test_import_time(runs: int=20):
+    results = {name: startup_time(statement, runs) for name, statement in STATEMENTS.items()}
+    for name, ms in results.items():
+        print(f"{name:20}: {ms:7.1f} ms")
+
+    saved = results["all cores"] - results["adat_freq only"]
+    print(f"lazy loading saves {saved:.1f} ms per process, "
+          f"when only adat_freq is needed")
+
+if __name__ == "__main__":
+    test_import_time()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+""" measure the latency of the transmitter from sample input to the first bit of the sample on the line,
+    in adat clock cycles, for latency targets and producer jitter given in frames.
+    The producer writes latency_frames frames ahead, then one frame per frame period,
+    each early or late by up to the jitter. Every frame has to go out exactly once,
+    and in order, so that the sizing of the FIFO is checked, too.
+"""
+import sys
+import argparse
+sys.path.append('.')
+
+from math import ceil
+
+import numpy as np
+from amaranth.sim import Simulator, Tick
+
+from adat.protocol import adat_freq, transmit_fifo_depth, FRAME_BITS, SYNC_PAD_BITS, USER_BITS
+from adat.sim      import ADATTransmitterTester, random_frames, drive_frames, LevelMonitor, \
+                          decode_nrzi, line_frames, compare_frames
+
+def run_latency(latency_frames: int=2, jitter_frames: int=1, producer_jitter: float=None, samplerate: int=48000,
+                clk_freq: float=50e6, frames: int=32, seed: int=0, **kwargs) -> dict:
+    """run the transmitter, configured for latency_frames and jitter_frames,
+       and return the latency of every frame in adat clock cycles
+
+    Parameters
+    ----------
+    producer_jitter: how many frames the producer is early or late at most,
+        defaults to jitter_frames. The actual offset of each frame is uniformly distributed
+    kwargs: passed on to ADATTransmitter
+    """
+    producer_jitter = jitter_frames if producer_jitter is None else producer_jitter
+    samples, user_data = random_frames(frames, seed)
+    rng = np.random.default_rng(seed)
+
+    dut = ADATTransmitterTester(latency_frames=latency_frames, jitter_frames=jitter_frames, **kwargs)
+    sim = Simulator(dut)
+    sim.add_clock(1.0/clk_freq, domain="sync")
+    sim.add_clock(1.0/adat_freq(samplerate), domain="adat")
+
+    # enough for the frames written ahead to go out, too
+    adat_cycles = (frames + latency_frames + ceil(producer_jitter) + 3) * FRAME_BITS
+    # the count of this monitor is the adat clock cycle, in which the producer starts to write a frame
+    line = LevelMonitor(dut.adat_out, adat_cycles)
+
+    # in adat clock cycles: the first latency_frames frames are written right away
+    offsets = rng.uniform(-producer_jitter, producer_jitter, frames) * FRAME_BITS
+    due     = (np.arange(frames) - latency_frames) * FRAME_BITS + offsets
+    written = np.zeros(frames, dtype=np.int64)
+
+    def producer():
+        for frame in range(frames):
+            while line.count < due[frame]:
+                yield Tick("sync")
+            written[frame] = line.count
+            yield from drive_frames(dut, samples[frame:frame + 1], user_data[frame:frame + 1])
+        while line.count < adat_cycles:
+            yield Tick("sync")
+
+    sim.add_sync_process(producer, domain="sync")
+    sim.add_sync_process(line.process, domain="adat")
+    sim.run()
+
+    line_samples, line_user_data, pads = line_frames(decode_nrzi(line.result))
+    result = compare_frames(samples, user_data, line_samples, line_user_data)
+
+    # to the first bit of channel 0 of every frame, which went out,
+    # except for the frames written ahead, which do not wait for as many frames
+    latencies = []
+    for frame in range(latency_frames, frames):
+        sent = np.flatnonzero(np.all(line_samples == samples[frame], axis=1))
+        if len(sent):
+            latencies.append(pads[sent[0]] + SYNC_PAD_BITS + USER_BITS - written[frame])
+    latencies = np.array(latencies)
+
+    result.update(
+        latency_frames  = latency_frames,
+        jitter_frames   = jitter_frames,
+        producer_jitter = producer_jitter,
+        fifo_depth      = dut.transmitter.transmit_fifo.depth,
+        latency_min     = int(latencies.min()),
+        latency_mean    = float(latencies.mean()),
+        latency_max     = int(latencies.max()),
+        latency_time    = float(latencies.max()) / adat_freq(samplerate),
+    )
+    return result
+
+def check_result(result: dict):
+    assert result["first"] == 0,          f"the first frame was not sent, but frame {result['first']}"
+    assert result["not_received"] == 0,   f"{result['not_received']} frames were not sent"
+    assert result["lost"] == 0,           f"{result['lost']} frames lost"
+    assert result["repeated"] == 0,       f"{result['repeated']} frames repeated, the FIFO underflowed"
+    assert result["errored_frames"] == 0, f"{result['errored_frames']} errored frames"
+
+def print_result(result: dict):
+    print(f"{result['latency_frames']:7}  {result['jitter_frames']:6}  {result['producer_jitter']:8.2f}  "
+          f"{result['fifo_depth']:5}  {result['latency_min']:5} {result['latency_mean']:7.1f} {result['latency_max']:5}  "
+          f"{result['latency_max'] / FRAME_BITS:6.2f}  {result['latency_time'] * 1e6:7.1f}  "
+          f"{result['lost'] + result['repeated'] + result['errored_frames']:6}", flush=True)
+
+def test_latency(latencies: list, jitters: list, **kwargs):
+    """run all combinations of latency target and jitter tolerance, which are valid"""
+    print(f"{'latency':>7}  {'jitter':>6}  {'producer':>8}  {'depth':>5}  {'adat clocks min/mean/max':>24}  "
+          f"{'frames':>6}  {'max us':>7}  {'errors':>6}")
+    failures = []
+    for latency_frames in latencies:
+        for jitter_frames in jitters:
+            try:
+                transmit_fifo_depth(latency_frames, jitter_frames)
+            except ValueError:
+                continue
+            result = run_latency(latency_frames, jitter_frames, **kwargs)
+            print_result(result)
+            try:
+                check_result(result)
+            except AssertionError as e:
+                failures.append(f"latency {latency_frames}, jitter {jitter_frames}: {e}")
+
+    for failure in failures:
+        print(f"failed: {failure}")
+    assert not failures, f"{len(failures)} configurations failed"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="sample input to ADAT output latency of the transmitter")
+    parser.add_argument("-l", "--latency-frames", type=int, nargs="+", default=[1, 2, 3, 4])
+    parser.add_argument("-j", "--jitter-frames", type=int, nargs="+", default=[0, 1, 2])
+    parser.add_argument("--producer-jitter", type=float,
+                        help="how many frames the producer is early or late, defaults to the jitter tolerance")
+    parser.add_argument("-s", "--samplerate", type=int, default=48000)
+    parser.add_argument("--clk-freq", type=float, default=50e6)
+    parser.add_argument("-n", "--frames", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--serializer", choices=["mux", "shift"], default="mux")
+    args = parser.parse_args()
+
+    test_latency(args.latency_frames, args.jitter_frames, producer_jitter=args.producer_jitter,
+                 samplerate=args.samplerate, clk_freq=args.clk_freq, frames=args.frames, seed=args.seed,
+                 serializer=args.serializer)
+    print("Success!")
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+""" soak test: the transmitter sends random frames to the receiver.
+    The transmitter, the receiver and the ADAT bit clock have independent clocks,
+    the ADAT bit clock can be offset by some ppm and have jitter.
+    Reports the simulation speed, the error rates, the lost frames and the resyncs.
+"""
+import sys
+import time
+import argparse
+sys.path.append('.')
+
+from math import ceil
+
+from amaranth.sim import Simulator, Tick
+
+from adat.protocol import adat_freq, CHANNELS, FRAME_BITS
+from adat.sim      import ADATLoopbackTester, random_frames, drive_frames, jittered_clock, \
+                          SampleMonitor, SyncMonitor, compare_frames
+
+def run_loopback(frames: int=200, samplerate: int=48000, clk_freq: float=100e6, tx_clk_freq: float=50e6,
+                 ppm: float=0.0, jitter: float=0.0, fifo_depth: int=9*4, seed: int=0,
+                 progress: int=0, **kwargs) -> dict:
+    """simulate the transmission of frames random frames, and return the result of compare_frames,
+       extended by the simulated time, the wall clock time and the number of resyncs
+
+    Parameters
+    ----------
+    ppm: offset of the ADAT bit clock from its nominal frequency
+    jitter: standard deviation of the ADAT bit clock edges in seconds
+    progress: print the progress every that many frames
+    kwargs: passed on to ADATReceiver
+    """
+    samples, user_data = random_frames(frames, seed)
+    dut = ADATLoopbackTester(clk_freq, fifo_depth, **kwargs)
+
+    adat_period = 1.0 / (adat_freq(samplerate) * (1 + ppm * 1e-6))
+    sim = Simulator(dut)
+    sim.add_clock(1.0/clk_freq,    domain="sync")
+    sim.add_clock(1.0/tx_clk_freq, domain="tx")
+    if jitter:
+        def adat_clock():
+            yield from jittered_clock(dut.adat_domain.clk, adat_period, jitter, seed)
+        sim.add_process(adat_clock)
+    else:
+        sim.add_clock(adat_period, domain="adat")
+
+    sample_monitor = SampleMonitor(dut, frames)
+    # sampling the lock once per ADAT bit is precise enough, and much faster
+    sync_monitor   = SyncMonitor(dut.synced_out, domain="adat", settle_cycles=FRAME_BITS)
+
+    # the FIFO is kept full, so it does not matter, when exactly it gets space
+    poll_cycles  = ceil(FRAME_BITS * adat_period * tx_clk_freq / 16)
+    # enough time for the frames in the FIFO to go through the receiver
+    drain_cycles = ceil((fifo_depth // CHANNELS + 4) * FRAME_BITS * adat_period * tx_clk_freq)
+
+    def stimulus():
+        chunk = progress or frames
+        for start in range(0, frames, chunk):
+            yield from drive_frames(dut, samples[start:start + chunk], user_data[start:start + chunk],
+                                    domain="tx", poll_cycles=poll_cycles)
+            if progress:
+                print(f"{start + len(samples[start:start + chunk])} frames sent, "
+                      f"{sample_monitor.count} received, {sync_monitor.resyncs} resyncs")
+        for _ in range(drain_cycles):
+            yield Tick("tx")
+
+    sim.add_sync_process(stimulus, domain="tx")
+    sim.add_sync_process(sample_monitor.process, domain="sync")
+    sim.add_sync_process(sync_monitor.process, domain="sync")
+
+    start = time.perf_counter()
+    sim.run()
+    wall_time = time.perf_counter() - start
+
+    result = compare_frames(samples, user_data, *sample_monitor.result)
+    result.update(
+        frames         = frames,
+        simulated_time = sync_monitor.cycle * adat_period,
+        wall_time      = wall_time,
+        resyncs        = sync_monitor.resyncs,
+        lock_lost      = len(sync_monitor.lost),
+        overflow       = sample_monitor.overflow,
+    )
+    return result
+
+def print_result(result: dict):
+    bits    = max(result["bits"], 1)
+    samples = max(result["received"] * CHANNELS, 1)
+    print(f"frames sent:          {result['frames']}")
+    print(f"frames received:      {result['received']} (first: {result['first']}, "
+          f"not received at the end: {result['not_received']})")
+    print(f"frames lost:          {result['lost']}")
+    print(f"frames repeated:      {result['repeated']}")
+    print(f"errored frames:       {result['errored_frames']}")
+    print(f"bit error rate:       {result['bit_errors'] / bits:.3e} ({result['bit_errors']} of {result['bits']} bits)")
+    print(f"sample error rate:    {result['sample_errors'] / samples:.3e} ({result['sample_errors']} samples)")
+    print(f"resyncs:              {result['resyncs']} (lock lost {result['lock_lost']} times)")
+    print(f"simulated:            {result['simulated_time'] * 1000:.2f} ms in {result['wall_time']:.1f} s, "
+          f"{result['frames'] / result['wall_time']:.1f} frames/s")
+
+def check_result(result: dict):
+    assert result["received"] > 0,       "no frames received"
+    assert result["lost"] == 0,           f"{result['lost']} frames lost"
+    assert result["errored_frames"] == 0, f"{result['errored_frames']} errored frames"
+    assert result["resyncs"] == 0,        f"{result['resyncs']} resyncs"
+
+def test_loopback(**kwargs):
+    result = run_loopback(**kwargs)
+    print_result(result)
+    check_result(result)
+
+def main():
+    parser = argparse.ArgumentParser(description="soak test the ADAT transmitter and receiver in loopback")
+    parser.add_argument("-n", "--frames", type=int, default=200, help="number of frames to transmit")
+    parser.add_argument("-s", "--samplerate", type=int, default=48000)
+    parser.add_argument("--clk-freq", type=float, default=100e6, help="receiver clock frequency")
+    parser.add_argument("--tx-clk-freq", type=float, default=50e6, help="transmitter clock frequency")
+    parser.add_argument("--ppm", type=float, default=100.0, help="offset of the ADAT bit clock in ppm")
+    parser.add_argument("--jitter", type=float, default=1e-9, help="RMS jitter of the ADAT bit clock in seconds")
+    parser.add_argument("--fifo-depth", type=int, default=9*4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pipelined", action="store_true", help="use the pipelined receiver")
+    parser.add_argument("--progress", type=int, default=0, help="print the progress every that many frames")
+    args = parser.parse_args()
+
+    test_loopback(frames=args.frames, samplerate=args.samplerate, clk_freq=args.clk_freq,
+                  tx_clk_freq=args.tx_clk_freq, ppm=args.ppm, jitter=args.jitter,
+                  fifo_depth=args.fifo_depth, seed=args.seed, progress=args.progress,
+                  pipelined=args.pipelined)
+
+if __name__ == "__main__":
+    main()
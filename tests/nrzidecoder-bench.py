@@ -1,47 +1,23 @@
 #!/usr/bin/env python3
 import sys
+import argparse
 from amaranth.hdl.cd import ClockDomain
 sys.path.append('.')
 from amaranth.sim import Simulator, Tick
-from amaranth import Elaboratable, Signal, Module
 
 from adat.nrzidecoder import NRZIDecoder
+from adat.sim         import NRZIDecoderTester, BitChecker, Gap, TraceWindow
 from testdata    import one_empty_adat_frame, \
                         sixteen_frames_with_channel_num_msb_and_sample_num, \
-                        encode_nrzi, validate_output
-
-# This class simplifies testing since the nrzidecoder does not use the adat
-# domain. Therefore we simulate the input from the adat domain with this wrapper class.
-class NRZIDecoderTester(Elaboratable):
-    def __init__(self, clk_freq: int):
-        self.nrzi_in = Signal()
-        self.invalid_frame_in = Signal()
-        self.data_out = Signal()
-        self.data_out_en = Signal()
-        self.recovered_clock_out = Signal()
-        self.clk_freq = clk_freq
-
-    def elaborate(self, platform) -> Module:
-        m = Module()
-        m.submodules.nrzidecoder = nrzidecoder = NRZIDecoder(self.clk_freq)
-        m.d.adat += [
-            nrzidecoder.nrzi_in.eq(self.nrzi_in),
-            nrzidecoder.invalid_frame_in.eq(self.invalid_frame_in)
-        ]
-        m.d.sync += [
-            self.data_out.eq(nrzidecoder.data_out),
-            self.data_out_en.eq(nrzidecoder.data_out_en),
-            self.recovered_clock_out.eq(nrzidecoder.recovered_clock_out)
-        ]
-        return m
-
-def test_with_samplerate(samplerate: int=48000):
-    """run adat signal simulation with the given samplerate"""
+                        encode_nrzi
+
+def test_with_samplerate(samplerate: int=48000, clk_freq: float=100e6, pipelined: bool=False, vcd: bool=False):
+    """run adat signal simulation with the given samplerate.
+       With vcd, the whole run is written to a VCD file, otherwise only a window around a failure"""
     # 24 bit plus the 6 nibble separator bits for eight channel
     # then 1 separator, 10 sync bits (zero), 1 separator and 4 user bits
 
-    clk_freq = 100e6
-    dut = NRZIDecoderTester(clk_freq)
+    dut = NRZIDecoderTester(clk_freq, pipelined=pipelined)
     adat_freq = NRZIDecoder.adat_freq(samplerate)
     clockratio = clk_freq / adat_freq
 
@@ -64,8 +40,6 @@ def test_with_samplerate(samplerate: int=48000):
 
     testdata_nrzi = encode_nrzi(testdata)
 
-    no_cycles = len(testdata_nrzi)
-
     # Send the adat stream
     def adat_process():
         bitcount :int = 0
@@ -82,65 +56,58 @@ def test_with_samplerate(samplerate: int=48000):
             yield dut.nrzi_in.eq(bit)
             yield Tick("adat")
             bitcount += 1
+        # let the decoder output the last bits
+        for _ in range(4):
+            yield Tick("adat")
 
-    # Process the adat stream and validate output
-    def sync_process():
-        # Obtain the output data
-        out_data = []
-        for _ in range(int(clockratio) * no_cycles):
-            yield Tick("sync")
-            if (yield dut.data_out_en == 1):
-                bit = yield dut.data_out
-                yield out_data.append(bit)
-
-        #
-        # Validate output
-        #
-
+    #
+    # the expected output, checked bit by bit as it arrives
+    #
+    expected = [
         # omit a 1 at the end of the sync pad
-        out_data = out_data[1:]
-
+        Gap(1),
         # Whenever the state machine switches from SYNC to DECODE we need to omit the first 11 sync bits
-        validate_output(out_data[:256 - 12], one_empty_adat_frame()[12:256])
-        out_data = out_data[256-12:]
-
-        validate_output(out_data[:256], sixteen_adat_frames[:256])
-        out_data = out_data[256:]
-
-        # now the adat stream was interrupted, it continues to output zeroes, until it enters the SYNC state
-        validate_output(out_data[:10], interrupted_adat_stream[:10])
-        out_data = out_data[10:]
-
-        # followed by 2 well formed adat frames
-
-        # omit the first 11 sync bits
-        validate_output(out_data[:256 - 12], sixteen_adat_frames[256 + 12:2 * 256])
-        out_data = out_data[256 - 12:]
-
-        validate_output(out_data[:256], sixteen_adat_frames[2 * 256:3 * 256])
-        out_data = out_data[256:]
-
+        one_empty_adat_frame()[12:256],
+        sixteen_adat_frames[:256],
+        # now the adat stream was interrupted, it continues to output zeroes, until it enters the SYNC state.
+        # The dead signal timeout is counted in clock cycles, so the number of zeroes depends on the clock ratio
+        Gap(9, 16, value=0),
+        # followed by 2 well formed adat frames, omit the first 11 sync bits
+        sixteen_adat_frames[256 + 12:2 * 256],
+        sixteen_adat_frames[2 * 256:3 * 256],
         # followed by one invalid frame - the state machine SYNCs again
-
-        # followed by 13 well-formed frames
-
-        # omit the first 11 sync bits
-        validate_output(out_data[:256 - 12], sixteen_adat_frames[3 * 256 + 12:4 * 256])
-        out_data = out_data[256-12:]
-
-        for i in range(4, 16):
-            validate_output(out_data[:256], sixteen_adat_frames[i * 256:(i + 1) * 256])
-            out_data = out_data[256:]
-
-        print("Success!")
-
-
-    sim.add_sync_process(sync_process, domain="sync")
+        # followed by 13 well-formed frames, omit the first 11 sync bits
+        sixteen_adat_frames[3 * 256 + 12:4 * 256],
+        sixteen_adat_frames[4 * 256:16 * 256],
+    ]
+
+    clk_suffix = "" if clk_freq == 100e6 else f"-{int(clk_freq // 1e6)}MHz"
+    if pipelined:
+        clk_suffix += "-pipelined"
+    trace   = TraceWindow([dut.nrzi_in, dut.invalid_frame_in, dut.data_out, dut.data_out_en, dut.recovered_clock_out],
+                          cycles=int(2 * 256 * clockratio), period=1.0/clk_freq)
+    checker = BitChecker(dut.data_out, dut.data_out_en, expected, trace=trace,
+                         vcd_file=f"nrzi-decoder-bench-{samplerate}{clk_suffix}-failure.vcd")
+
+    sim.add_sync_process(trace.process, domain="sync")
+    sim.add_sync_process(checker.process, domain="sync")
     sim.add_sync_process(adat_process, domain="adat")
-    with sim.write_vcd(f'nrzi-decoder-bench-{str(samplerate)}.vcd'):
+    if vcd:
+        # the gtkw files refer to the VCDs of the unpipelined 100MHz runs
+        with sim.write_vcd(f'nrzi-decoder-bench-{str(samplerate)}{clk_suffix}.vcd'):
+            sim.run()
+    else:
         sim.run()
+    checker.finish()
+    print("Success!")
 
 
 if __name__ == "__main__":
-    test_with_samplerate(48000)
-    test_with_samplerate(44100)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vcd", action="store_true", help="write the whole run of every configuration to a VCD file")
+    args = parser.parse_args()
+
+    for pipelined in [False, True]:
+        for clk_freq in [50e6, 100e6, 200e6, 300e6]:
+            test_with_samplerate(48000, clk_freq, pipelined, args.vcd)
+            test_with_samplerate(44100, clk_freq, pipelined, args.vcd)
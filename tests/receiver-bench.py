@@ -4,54 +4,24 @@
 # SPDX-License-Identifier: CERN-OHL-W-2.0
 #
 import sys
+import argparse
 sys.path.append(".")
 
 from amaranth.sim import Simulator, Tick
 
-from adat.receiver    import ADATReceiver
 from adat.nrzidecoder import NRZIDecoder
+from adat.sim         import ADATReceiverTester, FrameChecker, TraceWindow
 from testdata         import one_empty_adat_frame, \
                         sixteen_frames_with_channel_num_msb_and_sample_num, \
-                        encode_nrzi, print_frame
-from amaranth import Elaboratable, Signal, Module
+                        encode_nrzi
 
-# This class simplifies testing since the receiver does not use the adat domain.
-# Therefore we simulate the input from the adat domain with this wrapper class.
-class ADATReceiverTester(Elaboratable):
-    def __init__(self, clk_freq: int):
-        self.adat_in = Signal()
-        self.addr_out = Signal(3)
-        self.sample_out = Signal(24)
-        self.output_enable = Signal()
-        self.user_data_out = Signal(4)
-        self.recovered_clock_out = Signal()
-        self.synced_out = Signal()
-        self.clk_freq = clk_freq
-
-    def elaborate(self, platform) -> Module:
-        m = Module()
-        m.submodules.receiver = receiver = ADATReceiver(self.clk_freq)
-
-        m.d.adat += receiver.adat_in.eq(self.adat_in)
-
-        m.d.sync += [
-            self.addr_out.eq(receiver.addr_out),
-            self.sample_out.eq(receiver.sample_out),
-            self.output_enable.eq(receiver.output_enable),
-            self.user_data_out.eq(receiver.user_data_out),
-            self.recovered_clock_out.eq(receiver.recovered_clock_out),
-            self.synced_out.eq(receiver.synced_out)
-        ]
-        return m
-
-
-def test_with_samplerate(samplerate: int=48000):
-    """run adat signal simulation with the given samplerate"""
+def test_with_samplerate(samplerate: int=48000, clk_freq: float=100e6, pipelined: bool=False, vcd: bool=False):
+    """run adat signal simulation with the given samplerate.
+       With vcd, the whole run is written to a VCD file, otherwise only a window around a failure"""
     # 24 bit plus the 6 nibble separator bits for eight channel
     # then 1 separator, 10 sync bits (zero), 1 separator and 4 user bits
 
-    clk_freq = 100e6
-    dut = ADATReceiverTester(clk_freq)
+    dut = ADATReceiverTester(clk_freq, pipelined=pipelined)
     adat_freq = NRZIDecoder.adat_freq(samplerate)
     clockratio = clk_freq / adat_freq
 
@@ -73,61 +43,52 @@ def test_with_samplerate(samplerate: int=48000):
     print(f"ADAT clock freq: {adat_freq}")
     print(f"FPGA/ADAT freq: {clockratio}")
 
-    no_cycles = len(testdata_nrzi) + 500
-
     # Send the adat stream
     def adat_process():
         for bit in testdata_nrzi:  # [224:512 * 2]:
             yield dut.adat_in.eq(bit)
             yield Tick("adat")
+        # let the receiver output the last frame
+        for _ in range(500):
+            yield Tick("adat")
 
-    # Process the adat stream and validate output
-    def sync_process():
-        # Obtain the output data
-        out_data = [[0 for x in range(9)] for y in range(16)] #store userdata in the 9th column
-        sample = 0
-        for _ in range(int(clockratio) * no_cycles):
-            yield Tick("sync")
-            if (yield dut.output_enable == 1):
-                channel = yield dut.addr_out
-
-                out_data[sample][channel] = yield dut.sample_out
-
-                if (channel == 7):
-                    out_data[sample][8] = yield dut.user_data_out
-                    sample += 1
-
-        #print(out_data)
-
-
-        #
-        # The receiver needs 2 sync pads before it starts outputting data:
-        #   * The first sync pad is needed for the nrzidecoder to sync
-        #   * The second sync pad is needed for the receiver to sync
-        #   Therefore each time after the connection was lost the first frame will be lost while syncing.
-        # In our testdata we loose the initial one_empty_adat_frame and the second sample (#1, count starts with 0)
-        #
-
-        sampleno = 0
-        for i in range(16):
-            if (sampleno == 1): #skip the first frame while the receiver syncs after an interruption
-                sampleno += 1
-            elif (sampleno == 16): #ensure the data ended as expected
-                assert out_data[i] == [0, 0, 0, 0, 0, 0, 0, 0, 0], "Sample {} was: {}".format(sampleno, print_frame(out_data[sampleno]))
-            else:
-                assert out_data[i] == [((0 << 20) | sampleno), ((1 << 20) | sampleno), ((2 << 20) | sampleno),
-                                       ((3 << 20) | sampleno), ((4 << 20) | sampleno), ((5 << 20) | sampleno),
-                                       ((6 << 20) | sampleno), ((7 << 20) | sampleno), 0b0101]\
-                    , "Sample #{} was: {}".format(sampleno, print_frame(out_data[sampleno]))
-            sampleno += 1
-
-        print("Success!")
-
-    sim.add_sync_process(sync_process, domain="sync")
+    #
+    # The receiver needs 2 sync pads before it starts outputting data:
+    #   * The first sync pad is needed for the nrzidecoder to sync
+    #   * The second sync pad is needed for the receiver to sync
+    #   Therefore each time after the connection was lost the first frame will be lost while syncing.
+    # In our testdata we loose the initial one_empty_adat_frame and the second sample (#1, count starts with 0)
+    #
+    expected = (([(channel << 20) | sampleno for channel in range(8)], 0b0101)
+                for sampleno in range(16) if sampleno != 1)
+
+    # check every frame as it arrives, and stop at the first mismatch
+    clk_suffix = "" if clk_freq == 100e6 else f"-{int(clk_freq // 1e6)}MHz"
+    if pipelined:
+        clk_suffix += "-pipelined"
+    trace   = TraceWindow([dut.adat_in, dut.synced_out, dut.output_enable, dut.addr_out, dut.sample_out],
+                          cycles=int(4 * 256 * clockratio), period=1.0/clk_freq)
+    checker = FrameChecker(dut, expected, trace=trace,
+                           vcd_file=f"receiver-smoke-test-{samplerate}{clk_suffix}-failure.vcd")
+
+    sim.add_sync_process(trace.process, domain="sync")
+    sim.add_sync_process(checker.process, domain="sync")
     sim.add_sync_process(adat_process, domain="adat")
-    with sim.write_vcd(f'receiver-smoke-test-{str(samplerate)}.vcd'):
+    if vcd:
+        # the gtkw files refer to the VCDs of the unpipelined 100MHz runs
+        with sim.write_vcd(f'receiver-smoke-test-{str(samplerate)}{clk_suffix}.vcd'):
+            sim.run()
+    else:
         sim.run()
+    checker.finish()
+    print("Success!")
 
 if __name__ == "__main__":
-    test_with_samplerate(48000)
-    test_with_samplerate(44100)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vcd", action="store_true", help="write the whole run of every configuration to a VCD file")
+    args = parser.parse_args()
+
+    for pipelined in [False, True]:
+        for clk_freq in [50e6, 100e6, 200e6, 300e6]:
+            test_with_samplerate(48000, clk_freq, pipelined, args.vcd)
+            test_with_samplerate(44100, clk_freq, pipelined, args.vcd)
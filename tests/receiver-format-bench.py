@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+""" check the channel mask and the output formats of the receiver,
+    and report the output beats per frame and the bandwidth the consumer needs.
+    Also checks, that a mask changed in the middle of a frame takes effect with the next frame.
+"""
+import sys
+import argparse
+sys.path.append('.')
+
+import numpy as np
+from amaranth.sim import Simulator, Tick, Delay
+
+from adat.protocol import adat_freq, CHANNELS
+from adat.receiver import ADATReceiver
+from adat.sim      import ADATReceiverTester, random_frames, encode_frames, encode_nrzi, drive_levels, \
+                          format_frames, WordMonitor, compare_frames
+
+def beats_per_frame(channel_mask: int, output_format: str) -> int:
+    channels = bin(channel_mask).count("1")
+    return (channels + 1) // 2 if output_format == "packed16" else channels
+
+def setup(frames: int, samplerate: int, clk_freq: float, seed: int, **kwargs) -> tuple:
+    samples, user_data = random_frames(frames, seed)
+    # one more frame, so that the receiver outputs the last channel of the last frame
+    levels = encode_nrzi(encode_frames(np.vstack([samples, np.zeros((1, CHANNELS), dtype=int)]), np.append(user_data, 0)))
+
+    dut = ADATReceiverTester(clk_freq, **kwargs)
+    sim = Simulator(dut)
+    sim.add_clock(1.0/clk_freq, domain="sync")
+    sim.add_clock(1.0/adat_freq(samplerate), domain="adat")
+
+    def adat_process():
+        yield from drive_levels(dut.adat_in, levels)
+    sim.add_sync_process(adat_process, domain="adat")
+    return dut, sim, samples, user_data
+
+def test_format(channel_mask: int, output_format: str, frames: int=8, samplerate: int=48000,
+                clk_freq: float=100e6, seed: int=0, pipelined: bool=False) -> int:
+    """receive random frames with the given mask and format, check them and return the beats per frame"""
+    dut, sim, samples, user_data = setup(frames, samplerate, clk_freq, seed,
+                                         output_format=output_format, pipelined=pipelined)
+    monitor = WordMonitor(dut, frames, channel_mask, output_format)
+
+    def mask_process():
+        yield dut.channel_mask_in.eq(channel_mask)
+    sim.add_process(mask_process)
+    sim.add_sync_process(monitor.process, domain="sync")
+    sim.run()
+
+    result = compare_frames(format_frames(samples, channel_mask, output_format), user_data, *monitor.result)
+    name = f"mask {channel_mask:#04x}, {output_format}"
+    # the receiver needs one frame to synchronize
+    assert result["received"] == frames - 1, f"{name}: received {result['received']} frames"
+    assert result["bit_errors"] == 0,        f"{name}: {result['bit_errors']} bit errors"
+    # the first frame can have beats from before the receiver was synchronized
+    beats = monitor.beats[1:monitor.count]
+    assert np.all(beats == beats_per_frame(channel_mask, output_format)), f"{name}: {beats} beats per frame"
+    return int(beats[0])
+
+def test_mask_change(samplerate: int=48000, clk_freq: float=100e6, output_format: str="packed16"):
+    """change the mask in the middle of every frame, every frame needs to be output with one of the masks"""
+    frames = 8
+    masks  = [0xff, 0x15]
+    dut, sim, _, _ = setup(frames, samplerate, clk_freq, 0, output_format=output_format)
+    channels = [[]]
+
+    def mask_process():
+        # in the middle of the frames
+        yield Delay(0.5 / samplerate)
+        for frame in range(frames):
+            yield dut.channel_mask_in.eq(masks[frame % 2])
+            yield Delay(1.0 / samplerate)
+    sim.add_process(mask_process)
+
+    def word_process():
+        while True:
+            yield Tick("sync")
+            if (yield dut.word_valid_out):
+                channels[-1].append((yield dut.word_channel_out))
+                if (yield dut.word_last_out):
+                    channels.append([])
+    sim.add_sync_process(word_process, domain="sync")
+    sim.run_until(frames / samplerate)
+
+    # the channel of each word, of the lower half in packed words
+    step     = 2 if output_format == "packed16" else 1
+    expected = [[channel for channel in range(CHANNELS) if (mask >> channel) & 1][::step] for mask in masks]
+    frames_out = channels[:-1]
+    assert len(frames_out) >= frames - 2, f"only {len(frames_out)} frames output"
+    for frame in frames_out:
+        assert frame in expected, f"frame output with channels {frame}"
+    assert all(expected_frame in frames_out for expected_frame in expected), "not all masks were used"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="channel mask and output formats of the receiver")
+    parser.add_argument("-m", "--masks", type=lambda mask: int(mask, 0), nargs="+", default=[0xff, 0x0f, 0x03, 0x15, 0x80])
+    parser.add_argument("-f", "--formats", nargs="+", choices=ADATReceiver.OUTPUT_FORMATS, default=ADATReceiver.OUTPUT_FORMATS)
+    parser.add_argument("-s", "--samplerate", type=int, default=48000)
+    parser.add_argument("--clk-freq", type=float, default=100e6)
+    parser.add_argument("--pipelined", action="store_true")
+    args = parser.parse_args()
+
+    word_bits = {"sample": 24, "left_justified": 32, "packed16": 32}
+    print(f"{'mask':>4}  {'format':>14}  {'beats/frame':>11}  {'Mbit/s':>6}")
+    for output_format in args.formats:
+        for channel_mask in args.masks:
+            beats = test_format(channel_mask, output_format, samplerate=args.samplerate,
+                                clk_freq=args.clk_freq, pipelined=args.pipelined)
+            print(f"{channel_mask:#04x}  {output_format:>14}  {beats:11}  "
+                  f"{beats * word_bits[output_format] * args.samplerate / 1e6:6.2f}", flush=True)
+
+    for output_format in args.formats:
+        if output_format != "sample":
+            test_mask_change(args.samplerate, args.clk_freq, output_format)
+    print("Success!")
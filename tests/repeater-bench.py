@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+""" check the repeater with overwritten channels and its tap,
+    and compare its latency with receiving the frames with ADATReceiver
+    and sending them again with ADATTransmitter
+"""
+import sys
+import argparse
+sys.path.append('.')
+
+import numpy as np
+from amaranth     import Elaboratable, Signal, Module
+from amaranth.sim import Simulator, Tick
+
+from adat.protocol    import adat_freq, CHANNELS, FRAME_BITS
+from adat.receiver    import ADATReceiver
+from adat.transmitter import ADATTransmitter
+from adat.sim         import ADATRepeaterTester, random_frames, encode_frames, encode_nrzi, decode_nrzi, \
+                             drive_levels, line_frames, LevelMonitor, SampleMonitor, compare_frames
+
+class ReceiveTransmitPath(Elaboratable):
+    """ADATReceiver feeding ADATTransmitter directly, like user logic in between would.
+       The ADAT input and output are in the adat domain"""
+    def __init__(self, clk_freq: float, **kwargs):
+        self.adat_in     = Signal()
+        self.adat_out    = Signal()
+        self.receiver    = ADATReceiver(clk_freq)
+        self.transmitter = ADATTransmitter(**kwargs)
+
+    def elaborate(self, platform) -> Module:
+        m = Module()
+        m.submodules.receiver    = receiver    = self.receiver
+        m.submodules.transmitter = transmitter = self.transmitter
+
+        m.d.adat += [
+            receiver.adat_in .eq(self.adat_in),
+            self.adat_out    .eq(transmitter.adat_out),
+        ]
+        m.d.comb += [
+            transmitter.addr_in      .eq(receiver.addr_out),
+            transmitter.sample_in    .eq(receiver.sample_out),
+            transmitter.user_data_in .eq(receiver.user_data_out),
+            transmitter.valid_in     .eq(receiver.output_enable),
+            transmitter.last_in      .eq(receiver.addr_out == CHANNELS - 1),
+        ]
+        return m
+
+def line_levels(samples, user_data) -> np.ndarray:
+    # one more frame, so that the last frame is followed by a sync pad
+    return encode_nrzi(encode_frames(np.vstack([samples, np.zeros((1, CHANNELS), dtype=int)]), np.append(user_data, 0)))
+
+def sync_pad_ends(levels, cycles_per_bit: float) -> np.ndarray:
+    """the positions of the edges at the end of the sync pads, which are 11 bits after the previous edge.
+       Apart from the sync pad, there are at most 5 bits between edges"""
+    edges = np.flatnonzero(np.diff(np.asarray(levels, dtype=np.int8))) + 1
+    return edges[1:][np.diff(edges) > 8 * cycles_per_bit]
+
+def resample_bits(levels, cycles_per_bit: float) -> np.ndarray:
+    """NRZI decode a signal recorded at a higher clock rate, in the middle of the bits after its first edge"""
+    levels = np.asarray(levels)
+    first  = np.flatnonzero(np.diff(levels))[0] + 1
+    middle = (first + (np.arange(int((len(levels) - first) / cycles_per_bit)) + 0.5) * cycles_per_bit).astype(int)
+    return decode_nrzi(np.concatenate([levels[first - 1:first], levels[middle]]))[1:]
+
+def run_repeater(frames: int=16, samplerate: int=48000, clk_freq: float=100e6, overwrite_mask: int=0x24,
+                 pipelined: bool=False, seed: int=0) -> dict:
+    """repeat random frames, with the channels in overwrite_mask overwritten,
+       check the output and the tap, and return the latency in sync clock cycles"""
+    samples, user_data = random_frames(frames, seed)
+    overwrite_samples  = random_frames(1, seed + 1)[0][0]
+    levels = line_levels(samples, user_data)
+
+    dut = ADATRepeaterTester(clk_freq, tap=True, pipelined=pipelined)
+    sim = Simulator(dut)
+    sim.add_clock(1.0/clk_freq, domain="sync")
+    sim.add_clock(1.0/adat_freq(samplerate), domain="adat")
+
+    cycles_per_bit = clk_freq / adat_freq(samplerate)
+    cycles   = int(len(levels) * cycles_per_bit)
+    # the input of the repeater itself, behind the register of the tester
+    line_in  = LevelMonitor(dut.repeater.adat_in, cycles, domain="sync")
+    line_out = LevelMonitor(dut.adat_out, cycles, domain="sync")
+    tap      = SampleMonitor(dut, frames)
+
+    def overwrite_process():
+        yield dut.overwrite_mask_in.eq(overwrite_mask)
+        for channel, sample in enumerate(overwrite_samples.tolist()):
+            yield dut.addr_in.eq(channel)
+            yield dut.sample_in.eq(sample)
+            yield dut.valid_in.eq(1)
+            yield Tick("sync")
+        yield dut.valid_in.eq(0)
+
+    def adat_process():
+        yield from drive_levels(dut.adat_in, levels)
+
+    sim.add_sync_process(overwrite_process, domain="sync")
+    sim.add_sync_process(adat_process, domain="adat")
+    for monitor in [line_in, line_out, tap]:
+        sim.add_sync_process(monitor.process, domain="sync")
+    sim.run()
+
+    expected = samples.copy()
+    for channel in range(CHANNELS):
+        if (overwrite_mask >> channel) & 1:
+            expected[:, channel] = overwrite_samples[channel]
+    out_samples, out_user_data, _ = line_frames(resample_bits(line_out.result, cycles_per_bit))
+    result     = compare_frames(expected, user_data, out_samples, out_user_data)
+    tap_result = compare_frames(samples, user_data, *tap.result)
+
+    # the decoder locks to the sync pad of the first frame
+    for name, checked in [("output", result), ("tap", tap_result)]:
+        assert checked["received"] == frames - 1, f"{name}: received {checked['received']} frames"
+        assert checked["bit_errors"] == 0,        f"{name}: {checked['bit_errors']} bit errors"
+
+    pads_in  = sync_pad_ends(line_in.result, cycles_per_bit)
+    pads_out = sync_pad_ends(line_out.result, cycles_per_bit)
+    latency  = np.array([pad - pads_in[pads_in <= pad].max() for pad in pads_out])
+    return dict(latency_min=int(latency.min()), latency_max=int(latency.max()), cycles_per_bit=cycles_per_bit)
+
+def run_receive_transmit(frames: int=16, samplerate: int=48000, clk_freq: float=100e6, seed: int=0, **kwargs) -> dict:
+    """send random frames through ADATReceiver and ADATTransmitter, and return the latency in ADAT bits"""
+    samples, user_data = random_frames(frames, seed)
+    # time for the frames in the transmit FIFO to come out
+    levels = np.concatenate([line_levels(samples, user_data), np.zeros(4 * FRAME_BITS, dtype=np.uint8)])
+
+    dut = ReceiveTransmitPath(clk_freq, **kwargs)
+    sim = Simulator(dut)
+    sim.add_clock(1.0/clk_freq, domain="sync")
+    sim.add_clock(1.0/adat_freq(samplerate), domain="adat")
+
+    line_out = LevelMonitor(dut.adat_out, len(levels))
+
+    def adat_process():
+        yield from drive_levels(dut.adat_in, levels)
+
+    sim.add_sync_process(adat_process, domain="adat")
+    sim.add_sync_process(line_out.process, domain="adat")
+    sim.run()
+
+    out_samples, out_user_data, pads = line_frames(decode_nrzi(line_out.result))
+    result = compare_frames(samples, user_data, out_samples, out_user_data)
+    assert result["received"] >= frames - 2, f"received {result['received']} frames"
+    assert result["bit_errors"] == 0,        f"{result['bit_errors']} bit errors"
+
+    # the sync pad of frame n starts at bit n * FRAME_BITS on the input
+    latency = []
+    for frame in range(frames):
+        sent = np.flatnonzero(np.all(out_samples == samples[frame], axis=1))
+        if len(sent):
+            latency.append(pads[sent[0]] - frame * FRAME_BITS)
+    return dict(latency_min=int(min(latency)), latency_max=int(max(latency)))
+
+def test_latency(samplerate: int=48000, clk_freq: float=100e6, pipelined: bool=False):
+    bit_time = 1e6 / adat_freq(samplerate)
+    print(f"{'path':>30}  {'bits min/max':>13}  {'us min/max':>13}")
+
+    def print_latency(name: str, bits_min: float, bits_max: float):
+        print(f"{name:>30}  {bits_min:6.2f} {bits_max:6.2f}  {bits_min * bit_time:6.2f} {bits_max * bit_time:6.2f}")
+
+    repeater = run_repeater(samplerate=samplerate, clk_freq=clk_freq, pipelined=pipelined)
+    print_latency("repeater", repeater["latency_min"] / repeater["cycles_per_bit"],
+                  repeater["latency_max"] / repeater["cycles_per_bit"])
+
+    path = run_receive_transmit(samplerate=samplerate, clk_freq=clk_freq)
+    print_latency("receiver, transmitter", path["latency_min"], path["latency_max"])
+    assert repeater["latency_max"] / repeater["cycles_per_bit"] < path["latency_min"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="repeater function and latency")
+    parser.add_argument("-s", "--samplerate", type=int, nargs="+", default=[48000, 44100])
+    parser.add_argument("--clk-freq", type=float, nargs="+", default=[50e6, 100e6])
+    parser.add_argument("--pipelined", action="store_true")
+    args = parser.parse_args()
+
+    for samplerate in args.samplerate:
+        for clk_freq in args.clk_freq:
+            print(f"{samplerate} Hz, {clk_freq / 1e6:.0f} MHz")
+            test_latency(samplerate, clk_freq, args.pipelined)
+    print("Success!")
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+""" synthesize every core in representative configurations with a local yosys,
+    and compare the resource usage against a recorded baseline.
+    Fails, when any resource of any core grows by more than the threshold,
+    when there is no baseline, or when yosys is not found, unless --skip-without-yosys is given.
+    The baseline is only (re)recorded with --update.
+"""
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+sys.path.append('.')
+
+from generate  import CORES, variants, variant_name
+from synthesis import synthesize, print_resources, yosys_binary
+
+RESOURCE_MATRIX = {
+    "nrzidecoder": {"clk_freq": [50e6, 100e6, 200e6]},
+    "receiver":    {"clk_freq": [50e6, 100e6, 200e6]},
+    "transmitter": {"fifo_depth": [36, 72], "clk_freq": [None, 50e6]},
+    "repeater":    {"clk_freq": [100e6], "tap": [False, True]},
+}
+
+def measure_variant(job: tuple) -> tuple:
+    core, parameters, family = job
+    _, cls, ports = CORES[core]
+    elaboratable = cls(**parameters)
+    return variant_name(core, parameters), synthesize(elaboratable, ports(elaboratable), family)
+
+def measure(matrix: dict, family: str="ice40", jobs: int=None) -> dict:
+    """synthesize all variants of the matrix and return their resource usage by variant name"""
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return dict(executor.map(measure_variant, [(core, parameters, family) for core, parameters in variants(matrix)]))
+
+def regressions(measured: dict, baseline: dict, threshold: float) -> list:
+    """list all resources, which grew by more than threshold compared to the baseline"""
+    result = []
+    for name, resources in measured.items():
+        if name not in baseline:
+            continue
+        for resource, count in resources.items():
+            allowed = baseline[name].get(resource, 0) * (1 + threshold)
+            if count > allowed:
+                result.append(f"{name}: {resource} grew from {baseline[name].get(resource, 0)} to {count}")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="check the resource usage of the ADAT cores against a baseline")
+    parser.add_argument("--family", choices=["ice40", "ecp5"], default="ice40")
+    parser.add_argument("--baseline", help="baseline JSON file, defaults to tests/resource-baseline-<family>.json")
+    parser.add_argument("--threshold", type=float, default=0.05, help="allowed relative growth of each resource")
+    parser.add_argument("--update", action="store_true", help="record a new baseline")
+    parser.add_argument("--skip-without-yosys", action="store_true",
+                        help="pass instead of failing, when yosys is not found")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    args = parser.parse_args()
+
+    if yosys_binary() is None:
+        print("yosys not found, resource usage not measured")
+        if args.skip_without_yosys:
+            return
+        sys.exit(1)
+
+    baseline_file = args.baseline or os.path.join(os.path.dirname(__file__), f"resource-baseline-{args.family}.json")
+    if not args.update and not os.path.exists(baseline_file):
+        print(f"baseline {baseline_file} not found, run with --update to record it")
+        sys.exit(1)
+
+    measured = measure(RESOURCE_MATRIX, args.family, args.jobs)
+    for name, resources in measured.items():
+        print_resources(name, resources)
+
+    if args.update:
+        with open(baseline_file, "w") as f:
+            json.dump(measured, f, indent=4, sort_keys=True)
+        print(f"recorded baseline {baseline_file}")
+        return
+
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+
+    for name in sorted(set(measured) - set(baseline)):
+        print(f"{name}: not in the baseline, run with --update to record it")
+
+    failures = regressions(measured, baseline, args.threshold)
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
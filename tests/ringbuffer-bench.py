@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+import sys
+sys.path.append('.')
+
+from amaranth.sim import Simulator, Tick
+from amaranth import Elaboratable, Module
+
+from adat.ringbuffer  import ADATRingBufferWriter, ADATRingBufferReader
+from adat.transmitter import ADATTransmitter
+from adat.nrzidecoder import NRZIDecoder
+from testdata         import decode_nrzi, adat_decode, print_assert_failure
+
+# connects the ring buffer reader to the transmitter
+class RingBufferTransmitter(Elaboratable):
+    def __init__(self, frames: int):
+        self.reader      = ADATRingBufferReader(frames=frames, low_watermark=1)
+        self.transmitter = ADATTransmitter()
+
+    def elaborate(self, platform) -> Module:
+        m = Module()
+        m.submodules.reader      = reader      = self.reader
+        m.submodules.transmitter = transmitter = self.transmitter
+
+        m.d.comb += [
+            transmitter.addr_in      .eq(reader.addr_out),
+            transmitter.sample_in    .eq(reader.sample_out),
+            transmitter.user_data_in .eq(reader.user_data_out),
+            transmitter.valid_in     .eq(reader.valid_out),
+            transmitter.last_in      .eq(reader.last_out),
+            reader.ready_in          .eq(transmitter.ready_out),
+        ]
+        return m
+
+def test_writer():
+    """feed the writer with the strobes the receiver would produce and read back the blocks"""
+    clk_freq = 100e6
+    frames = 8
+    dut = ADATRingBufferWriter(frames=frames)
+
+    sim = Simulator(dut)
+    sim.add_clock(1.0/clk_freq, domain="sync")
+
+    def sample(frame: int, channel: int) -> int:
+        return (channel << 20) | frame
+
+    def user_data(frame: int) -> int:
+        return frame & 0xf
+
+    irqs = []
+
+    def tick(frame: int):
+        yield Tick("sync")
+        if (yield dut.half_block_out):
+            irqs.append(("half", frame))
+        if (yield dut.full_block_out):
+            irqs.append(("full", frame))
+
+    def write_frame(frame: int):
+        yield dut.user_data_in.eq(user_data(frame))
+        for channel in range(8):
+            yield dut.addr_in.eq(channel)
+            yield dut.sample_in.eq(sample(frame, channel))
+            yield dut.valid_in.eq(1)
+            yield from tick(frame)
+            # the receiver leaves a few cycles between the samples
+            yield dut.valid_in.eq(0)
+            yield from tick(frame)
+
+    def read_block(first_frame: int, block: int):
+        for f in range(frames // 2):
+            frame = block * (frames // 2) + f
+            for channel in range(8):
+                yield dut.bus_addr_in.eq(frame * 8 + channel)
+                yield Tick("sync")
+                yield Tick("sync")
+                word = yield dut.bus_data_out
+                expected = (user_data(first_frame + f) << 24) | sample(first_frame + f, channel)
+                assert word == expected, f"frame {frame} channel {channel}: {hex(word)} != {hex(expected)}"
+
+    def sync_process():
+        yield Tick("sync")
+        # incomplete frame, as after a loss of sync: will be overwritten
+        yield dut.addr_in.eq(0)
+        yield dut.sample_in.eq(0xbad)
+        yield dut.valid_in.eq(1)
+        yield Tick("sync")
+        yield dut.valid_in.eq(0)
+
+        for frame in range(3 * frames // 2):
+            yield from write_frame(frame)
+
+            if (yield dut.irq_out):
+                yield dut.irq_ack_in.eq(1)
+                yield Tick("sync")
+                yield dut.irq_ack_in.eq(0)
+                yield Tick("sync")
+                assert (yield dut.irq_out) == 0
+
+                # bulk read the block that has just been filled
+                if irqs[-1][0] == "half":
+                    yield from read_block(frame - frames // 2 + 1, 0)
+                else:
+                    yield from read_block(frame - frames // 2 + 1, 1)
+
+        assert irqs == [("half", 3), ("full", 7), ("half", 11)], irqs
+        assert (yield dut.frame_counter_out) == 3 * frames // 2
+        assert (yield dut.write_pointer_out) == (3 * frames // 2) % frames
+        print("Success!")
+
+    sim.add_sync_process(sync_process, domain="sync")
+    with sim.write_vcd('ringbuffer-writer-bench.vcd'):
+        sim.run()
+
+def test_reader(samplerate: int=48000):
+    """let the host refill the ring buffer on the watermark interrupt and decode the transmitted frames"""
+    clk_freq = 50e6
+    frames = 4
+    no_frames = 10
+    dut = RingBufferTransmitter(frames)
+    reader = dut.reader
+    adat_freq = NRZIDecoder.adat_freq(samplerate)
+
+    sim = Simulator(dut)
+    sim.add_clock(1.0/clk_freq, domain="sync")
+    sim.add_clock(1.0/adat_freq, domain="adat")
+
+    def sample(frame: int, channel: int) -> int:
+        return (channel << 20) | frame
+
+    def write_frame(frame: int):
+        for channel in range(8):
+            yield reader.bus_addr_in.eq((frame % frames) * 8 + channel)
+            yield reader.bus_data_in.eq(((frame & 0xf) << 24) | sample(frame, channel))
+            yield reader.bus_we_in.eq(1)
+            yield Tick("sync")
+        yield reader.bus_we_in.eq(0)
+        yield reader.write_pointer_in.eq((frame + 1) % (2 * frames))
+
+    def sync_process():
+        written = 0
+        for _ in range(frames):
+            yield from write_frame(written)
+            written += 1
+
+        while written < no_frames:
+            yield Tick("sync")
+            if (yield reader.irq_out):
+                yield reader.irq_ack_in.eq(1)
+                yield Tick("sync")
+                yield reader.irq_ack_in.eq(0)
+                # refill until full
+                while (yield reader.fill_level_out) < frames and written < no_frames:
+                    yield from write_frame(written)
+                    written += 1
+                    yield Tick("sync")
+
+    def adat_process():
+        nrzi = []
+        for _ in range((no_frames + 2) * 256):
+            yield Tick("adat")
+            nrzi.append((yield dut.transmitter.adat_out))
+
+        # skip initial zeros
+        nrzi = nrzi[nrzi.index(1):]
+        decoded = adat_decode(decode_nrzi(nrzi))
+        # the first frame is the empty frame which was sent while the FIFO filled
+        frames_sent = [frame for frame in decoded if frame[1:] != [0] * 8]
+        for frame in range(no_frames):
+            expected = [frame & 0xf] + [sample(frame, channel) for channel in range(8)]
+            assert frames_sent[frame] == expected, print_assert_failure(frames_sent[frame], expected)
+        print("Success!")
+
+    sim.add_sync_process(sync_process, domain="sync")
+    sim.add_sync_process(adat_process, domain="adat")
+    with sim.write_vcd(f'ringbuffer-reader-bench-{str(samplerate)}.vcd'):
+        sim.run()
+
+if __name__ == "__main__":
+    test_writer()
+    test_reader(48000)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+""" run the receiver and the transmitter with the transactors of adat.sim,
+    and check that the streaming checkers stop the simulation at a corrupted frame or bit
+"""
+import os
+import sys
+import tempfile
+sys.path.append('.')
+
+import numpy as np
+from amaranth     import Signal
+from amaranth.sim import Simulator, Tick
+
+from adat.protocol import adat_freq, FRAME_BITS, SYNC_PAD_BITS
+from adat.sim      import NRZIDecoderTester, ADATReceiverTester, ADATTransmitterTester, random_frames, \
+                          encode_frames, decode_frames, find_sync_pads, encode_nrzi, decode_nrzi, flip_bit, \
+                          drive_levels, drive_frames, LevelMonitor, SampleMonitor, \
+                          CheckFailure, TraceWindow, FrameChecker, BitChecker, Gap
+
+def test_receiver(samplerate: int=48000, clk_freq: float=100e6, frames: int=16):
+    samples, user_data = random_frames(frames)
+    dut = ADATReceiverTester(clk_freq)
+
+    sim = Simulator(dut)
+    sim.add_clock(1.0/clk_freq, domain="sync")
+    sim.add_clock(1.0/adat_freq(samplerate), domain="adat")
+
+    # one more frame, so that the receiver outputs the last channel of the last frame
+    levels  = encode_nrzi(encode_frames(np.vstack([samples, np.zeros((1, 8), dtype=int)]),
+                                        np.append(user_data, 0)))
+    monitor = SampleMonitor(dut, frames)
+
+    def adat_process():
+        yield from drive_levels(dut.adat_in, levels)
+
+    sim.add_sync_process(adat_process, domain="adat")
+    sim.add_sync_process(monitor.process, domain="sync")
+    sim.run()
+
+    received_samples, received_user_data = monitor.result
+    # the receiver needs one frame to synchronize
+    assert len(received_samples) == frames - 1, f"received {len(received_samples)} frames"
+    assert np.array_equal(received_samples,   samples[1:]),   "received samples differ"
+    assert np.array_equal(received_user_data, user_data[1:]), "received user data differs"
+    print(f"receiver: {len(received_samples)} frames received correctly")
+
+def test_transmitter(samplerate: int=48000, clk_freq: float=50e6, frames: int=16):
+    samples, user_data = random_frames(frames, seed=1)
+    dut = ADATTransmitterTester()
+
+    sim = Simulator(dut)
+    sim.add_clock(1.0/clk_freq, domain="sync")
+    sim.add_clock(1.0/adat_freq(samplerate), domain="adat")
+
+    # the FIFO holds a few frames, the first frames are repeated empty frames
+    adat_cycles = (frames + 8) * FRAME_BITS
+    monitor = LevelMonitor(dut.adat_out, adat_cycles)
+
+    def stimulus():
+        yield from drive_frames(dut, samples, user_data)
+        while monitor.count < adat_cycles:
+            yield Tick("sync")
+
+    sim.add_sync_process(stimulus, domain="sync")
+    sim.add_sync_process(monitor.process, domain="adat")
+    sim.run()
+
+    bits = decode_nrzi(monitor.result)
+    # skip the zeros transmitted before the first frame
+    start = find_sync_pads(bits)[0]
+    transmitted_samples, transmitted_user_data = decode_frames(bits[start:])
+
+    first = next(n for n in range(len(transmitted_samples)) if np.array_equal(transmitted_samples[n], samples[0]))
+    assert np.array_equal(transmitted_samples[first:first + frames],   samples),   "transmitted samples differ"
+    assert np.array_equal(transmitted_user_data[first:first + frames], user_data), "transmitted user data differs"
+    print(f"transmitter: {frames} frames transmitted correctly")
+
+def run_until_failure(sim: Simulator, checker, vcd_file: str) -> str:
+    """the simulation has to stop with a CheckFailure, which wrote vcd_file. Returns its message"""
+    try:
+        sim.run()
+        checker.finish()
+    except CheckFailure as failure:
+        with open(vcd_file) as f:
+            assert "$enddefinitions" in f.read(), f"no trace in {vcd_file}"
+        return str(failure)
+    raise AssertionError("the checker did not fail")
+
+def test_frame_checker_failure(samplerate: int=48000, clk_freq: float=100e6, frames: int=16, corrupted: int=5):
+    """expect one frame with a wrong sample, the checker has to stop the simulation at that frame"""
+    samples, user_data = random_frames(frames)
+    dut = ADATReceiverTester(clk_freq)
+
+    sim = Simulator(dut)
+    sim.add_clock(1.0/clk_freq, domain="sync")
+    sim.add_clock(1.0/adat_freq(samplerate), domain="adat")
+
+    levels   = encode_nrzi(encode_frames(np.vstack([samples, np.zeros((1, 8), dtype=int)]),
+                                         np.append(user_data, 0)))
+    expected = samples.copy()
+    expected[corrupted, 3] ^= 0x10
+
+    with tempfile.TemporaryDirectory() as workdir:
+        vcd_file = os.path.join(workdir, "failure.vcd")
+        trace    = TraceWindow([dut.adat_in, dut.output_enable, dut.addr_out, dut.sample_out], period=1.0/clk_freq)
+        # the receiver needs one frame to synchronize
+        checker  = FrameChecker(dut, zip(expected[1:], user_data[1:]), trace=trace, vcd_file=vcd_file)
+
+        def adat_process():
+            yield from drive_levels(dut.adat_in, levels)
+
+        sim.add_sync_process(adat_process, domain="adat")
+        sim.add_sync_process(trace.process, domain="sync")
+        sim.add_sync_process(checker.process, domain="sync")
+        message = run_until_failure(sim, checker, vcd_file)
+
+    assert message.startswith(f"frame {corrupted - 1} differs"), message
+    assert checker.count == corrupted - 1, f"the simulation went on until frame {checker.count}"
+    print(f"frame checker: stopped at corrupted frame {corrupted - 1}")
+
+def test_bit_checker_failure(samplerate: int=48000, clk_freq: float=100e6, frames: int=8, corrupted: int=3):
+    """flip a sample bit of the input stream, the checker has to stop the simulation at that bit"""
+    samples, user_data = random_frames(frames)
+    bits = encode_frames(samples, user_data)
+    # the first bit of channel 0 of the corrupted frame, not a nibble separator
+    position = corrupted * FRAME_BITS + SYNC_PAD_BITS + 5
+    dut = NRZIDecoderTester(clk_freq)
+
+    sim = Simulator(dut)
+    sim.add_clock(1.0/clk_freq, domain="sync")
+    sim.add_clock(1.0/adat_freq(samplerate), domain="adat")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        vcd_file = os.path.join(workdir, "failure.vcd")
+        trace    = TraceWindow([dut.nrzi_in, dut.data_out, dut.data_out_en], period=1.0/clk_freq)
+        # the decoder starts to output with the separator bit after the zeros of the first sync pad
+        checker  = BitChecker(dut.data_out, dut.data_out_en, [bits[11:].tolist()],
+                              trace=trace, vcd_file=vcd_file)
+
+        def adat_process():
+            yield from drive_levels(dut.nrzi_in, encode_nrzi(flip_bit(bits, position)))
+            for _ in range(4):
+                yield Tick("adat")
+
+        sim.add_sync_process(adat_process, domain="adat")
+        sim.add_sync_process(trace.process, domain="sync")
+        sim.add_sync_process(checker.process, domain="sync")
+        message = run_until_failure(sim, checker, vcd_file)
+
+    failed_bit = position - 11
+    assert message.startswith(f"bit {failed_bit}: received"), message
+    assert checker.count == failed_bit, f"the simulation went on until bit {checker.count}"
+    print(f"bit checker: stopped at flipped bit {failed_bit}")
+
+def test_gap_failure():
+    """a bit of the wrong value inside the shortest run of a Gap has to fail at once,
+       and a bit after the Gap has to be reported at its own index"""
+    checker = BitChecker(Signal(), Signal(), [[1, 0, 1], Gap(2, 4, value=0), [1, 1, 0]])
+    try:
+        for bit in [1, 0, 1, 0, 1]:
+            checker.check(bit)
+        raise AssertionError("the checker did not fail inside the gap")
+    except CheckFailure as failure:
+        assert str(failure).startswith("bit 4: received 1, expected 0"), str(failure)
+
+    checker = BitChecker(Signal(), Signal(), [[1], Gap(1, 4), [1], [0, 1, 1]])
+    try:
+        for bit in [1, 0, 1, 0, 0, 1]:
+            checker.check(bit)
+        raise AssertionError("the checker did not fail after the gap")
+    except CheckFailure as failure:
+        assert str(failure).startswith("bit 4: received 0, expected 1"), str(failure)
+    print("gap: failures reported at the right bits")
+
+if __name__ == "__main__":
+    test_receiver()
+    test_transmitter()
+    test_frame_checker_failure()
+    test_bit_checker_failure()
+    test_gap_failure()
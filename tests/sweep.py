@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+""" run a simulation bench for every point of a parameter grid, in parallel worker processes.
+
+    The grid maps the parameters of the bench function to lists of values,
+    every combination of values is one point, for example::
+
+        python tests/sweep.py loopback -p samplerate=44100,48000 -p clock_ratio=5,8,16 -p ppm=-100,0,100
+
+    ``clock_ratio`` is not passed to the bench, but sets ``clk_freq``
+    to that multiple of the ADAT bit rate of the point's sample rate.
+    The results are printed as a table row by row, as soon as each point finishes.
+    Every point runs in its own temporary working directory, so that the VCD files
+    of parallel points do not overwrite each other, and none are left behind.
+"""
+import os
+import io
+import sys
+import json
+import time
+import tempfile
+import argparse
+import warnings
+import itertools
+import contextlib
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor, as_completed
+sys.path.append('.')
+
+from amaranth.hdl.ir import UnusedElaboratable
+
+from adat.protocol import adat_freq
+
+# bench name: (bench file in this directory, function to run for every point,
+#              function checking the dict returned by it, if any)
+BENCHES = {
+    "nrzidecoder": ("nrzidecoder-bench.py",          "test_with_samplerate", None),
+    "receiver":    ("receiver-bench.py",             "test_with_samplerate", None),
+    "transmitter": ("transmitter-bench.py",          "test_with_samplerate", None),
+    "bitclock":    ("transmitter-bitclock-bench.py", "test_with_samplerate", None),
+    "loopback":    ("loopback-bench.py",             "run_loopback",         "check_result"),
+    "latency":     ("latency-bench.py",              "run_latency",          "check_result"),
+}
+
+DEFAULT_GRIDS = {
+    "nrzidecoder": {"samplerate": [44100, 48000], "clk_freq": [50e6, 100e6, 200e6], "pipelined": [False, True]},
+    "receiver":    {"samplerate": [44100, 48000], "clk_freq": [50e6, 100e6, 200e6], "pipelined": [False, True]},
+    "transmitter": {"samplerate": [44100, 48000], "serializer": ["mux", "shift"]},
+    "bitclock":    {"samplerate": [44100, 48000], "clk_freq": [25e6, 50e6, 100e6]},
+    "loopback":    {"samplerate": [44100, 48000], "clock_ratio": [5, 8, 16], "ppm": [-100, 100],
+                    "fifo_depth": [36, 72], "frames": [50]},
+    "latency":     {"samplerate": [44100, 48000], "latency_frames": [1, 2, 3], "jitter_frames": [0, 1]},
+}
+
+# columns of the result table, taken from the dict returned by the bench function, if any
+COUNTS = ["lost", "errored_frames", "bit_errors", "resyncs"]
+
+def points(grid: dict) -> list:
+    """expand the parameter grid into a list of parameter dicts"""
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+_modules = {}
+
+def bench_functions(bench: str) -> tuple:
+    """load the bench from its file, once per process, and return its run and check functions"""
+    filename, function, check = BENCHES[bench]
+    if filename not in _modules:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+        spec = importlib.util.spec_from_file_location(filename[:-3].replace("-", "_"), path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _modules[filename] = module
+    module = _modules[filename]
+    return getattr(module, function), check and getattr(module, check)
+
+def run_in_temporary_directory(run, parameters: dict):
+    """call run with parameters in a new temporary working directory, which is removed afterwards"""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            return run(**parameters)
+        finally:
+            os.chdir(cwd)
+
+def run_point(job: tuple) -> dict:
+    """run the bench for one point of the grid, returns the point and its result
+
+    The status is "pass", "fail" for a failed assertion, or "error" for any other exception.
+    The output of the bench is captured, so that it does not garble the result table.
+    """
+    bench, point = job
+    parameters = dict(point)
+    if "clock_ratio" in parameters:
+        parameters["clk_freq"] = parameters.pop("clock_ratio") * adat_freq(parameters.get("samplerate", 48000))
+
+    result = dict(point=point, status="pass", message="", wall_time=0.0)
+    start = time.perf_counter()
+    # a core, which fails to elaborate, warns about its unused submodules
+    with warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()):
+        warnings.simplefilter("ignore", UnusedElaboratable)
+        try:
+            run, check = bench_functions(bench)
+            returned = run_in_temporary_directory(run, parameters)
+            if isinstance(returned, dict):
+                result.update({key: returned[key] for key in COUNTS + ["simulated_time"] if key in returned})
+            if check is not None:
+                check(returned)
+        except AssertionError as e:
+            result.update(status="fail", message=str(e))
+        except Exception as e:
+            result.update(status="error", message=f"{type(e).__name__}: {e}")
+    result["wall_time"] = time.perf_counter() - start
+    return result
+
+def sweep(bench: str, grid: dict, jobs: int=None, stop_on_failure: bool=False):
+    """run the bench for all points of the grid, and yield the results in the order they finish
+
+    With stop_on_failure, the points which have not been started yet
+    are cancelled after the first point which did not pass.
+    """
+    if bench not in BENCHES:
+        raise ValueError(f"unknown bench '{bench}', available benches: {', '.join(BENCHES)}")
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(run_point, (bench, point)) for point in points(grid)]
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            result = future.result()
+            yield result
+            if stop_on_failure and result["status"] != "pass":
+                for pending in futures:
+                    pending.cancel()
+
+def format_value(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+class ResultTable:
+    """print results as rows of a table, and count them by status"""
+    def __init__(self, grid: dict):
+        self.names  = list(grid)
+        self.counts = {"pass": 0, "fail": 0, "error": 0}
+        self.widths = [max(len(name), *(len(format_value(value)) for value in grid[name])) for name in self.names]
+
+    def print_header(self):
+        columns = [name.ljust(width) for name, width in zip(self.names, self.widths)]
+        columns += ["status", "wall s", "sim ms"] + [f"{count:>8}" for count in COUNTS]
+        print("  ".join(columns))
+
+    def print_row(self, result: dict):
+        self.counts[result["status"]] += 1
+        columns = [format_value(result["point"][name]).ljust(width) for name, width in zip(self.names, self.widths)]
+        columns.append(result["status"].ljust(6))
+        columns.append(f"{result['wall_time']:6.1f}")
+        columns.append(f"{result['simulated_time'] * 1000:6.2f}" if "simulated_time" in result else "     -")
+        columns += [f"{result.get(count, '-'):>8}" for count in COUNTS]
+        print("  ".join(columns) + (f"  {result['message']}" if result["message"] else ""), flush=True)
+
+    def print_summary(self, total: int):
+        not_run = total - sum(self.counts.values())
+        summary = ", ".join(f"{count} {status}" for status, count in self.counts.items())
+        print(summary + (f", {not_run} not run" if not_run else ""))
+
+def parse_parameter(argument: str) -> tuple:
+    """parse name=value,value,... where each value is JSON, or a plain string"""
+    name, _, values = argument.partition("=")
+    if not values:
+        raise argparse.ArgumentTypeError(f"expected name=value,...: '{argument}'")
+
+    def parse_value(value: str):
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            return value
+    return name, [parse_value(value) for value in values.split(",")]
+
+def main(argv: list=None):
+    parser = argparse.ArgumentParser(description="run a simulation bench for every point of a parameter grid")
+    parser.add_argument("bench", choices=BENCHES)
+    parser.add_argument("-p", "--parameter", type=parse_parameter, action="append", default=[],
+                        metavar="NAME=VALUE,...", help="values of one parameter of the grid")
+    parser.add_argument("-c", "--config", help="JSON file with the parameter grid")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--stop-on-failure", action="store_true",
+                        help="do not start any more points after the first failure")
+    args = parser.parse_args(argv)
+
+    grid = DEFAULT_GRIDS[args.bench]
+    if args.config:
+        with open(args.config) as f:
+            grid = json.load(f)
+    grid = {**grid, **dict(args.parameter)}
+
+    table = ResultTable(grid)
+    table.print_header()
+    for result in sweep(args.bench, grid, args.jobs, args.stop_on_failure):
+        table.print_row(result)
+    table.print_summary(len(points(grid)))
+
+    if table.counts["fail"] or table.counts["error"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
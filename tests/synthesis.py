@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+"""synthesize cores with a local yosys to measure their resource usage,
+   and place and route them with a local nextpnr to measure their Fmax"""
+
+import os
+import json
+import shutil
+import subprocess
+import tempfile
+
+from amaranth.back import rtlil
+
+# cell name prefixes of each resource type, per FPGA family
+RESOURCE_CELLS = {
+    "ice40": {
+        "LUT":   ["SB_LUT4"],
+        "FF":    ["SB_DFF"],
+        "BRAM":  ["SB_RAM40_4K"],
+        "CARRY": ["SB_CARRY"],
+    },
+    "ecp5": {
+        "LUT":   ["LUT4", "TRELLIS_DPR16X4"],
+        "FF":    ["TRELLIS_FF"],
+        "BRAM":  ["DP16KD", "PDPW16KD"],
+        "CARRY": ["CCU2C"],
+    },
+}
+
+# nextpnr device arguments, per FPGA family.
+# The cores are placed without any pin constraints
+NEXTPNR_ARGS = {
+    "ice40": ["--hx8k", "--package", "ct256", "--pcf-allow-unconstrained"],
+    "ecp5":  ["--25k", "--package", "CABGA381", "--lpf-allow-unconstrained"],
+}
+
+def yosys_binary() -> str:
+    """find the yosys binary, the YOSYS environment variable takes precedence"""
+    return os.environ.get("YOSYS") or shutil.which("yosys")
+
+def nextpnr_binary(family: str="ice40") -> str:
+    """find the nextpnr binary of the given family, the NEXTPNR environment variable takes precedence"""
+    return os.environ.get("NEXTPNR") or shutil.which(f"nextpnr-{family}")
+
+def count_resources(cells: dict, family: str="ice40") -> dict:
+    """sum up the cells of a yosys statistic by resource type"""
+    return {
+        resource: sum(count for cell, count in cells.items()
+                      if any(cell.startswith(prefix) for prefix in prefixes))
+        for resource, prefixes in RESOURCE_CELLS[family].items()
+    }
+
+def synthesize(elaboratable, ports: list, family: str="ice40", workdir: str=None) -> dict:
+    """synthesize the given elaboratable and return its resource usage,
+       or None, if yosys is not available"""
+    yosys = yosys_binary()
+    if yosys is None:
+        return None
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = workdir or tmpdir
+        il_file   = os.path.join(workdir, "top.il")
+        stat_file = os.path.join(workdir, "stat.json")
+
+        with open(il_file, "w") as f:
+            f.write(rtlil.convert(elaboratable, name="top", ports=ports))
+
+        subprocess.run([yosys, "-q", "-p",
+                        f"read_rtlil {il_file}; synth_{family} -top top; tee -q -o {stat_file} stat -json"],
+                       check=True)
+
+        with open(stat_file) as f:
+            stat = json.load(f)
+
+    if "design" in stat:
+        cells = stat["design"]["num_cells_by_type"]
+    else:
+        cells = {}
+        for module in stat["modules"].values():
+            for cell, count in module["num_cells_by_type"].items():
+                cells[cell] = cells.get(cell, 0) + count
+
+    return count_resources(cells, family)
+
+def place_and_route(elaboratable, ports: list, family: str="ice40", target_freq: int=250, seed: int=1) -> dict:
+    """synthesize, place and route the given elaboratable and return
+       the achieved Fmax in MHz of each of its clocks,
+       or None, if yosys or nextpnr are not available"""
+    yosys   = yosys_binary()
+    nextpnr = nextpnr_binary(family)
+    if yosys is None or nextpnr is None:
+        return None
+
+    with tempfile.TemporaryDirectory() as workdir:
+        il_file     = os.path.join(workdir, "top.il")
+        json_file   = os.path.join(workdir, "top.json")
+        report_file = os.path.join(workdir, "report.json")
+
+        with open(il_file, "w") as f:
+            f.write(rtlil.convert(elaboratable, name="top", ports=ports))
+
+        subprocess.run([yosys, "-q", "-p",
+                        f"read_rtlil {il_file}; synth_{family} -top top -json {json_file}"],
+                       check=True)
+        subprocess.run([nextpnr, "-q", *NEXTPNR_ARGS[family],
+                        "--json", json_file, "--report", report_file,
+                        "--freq", str(target_freq), "--seed", str(seed)],
+                       check=True)
+
+        with open(report_file) as f:
+            report = json.load(f)
+
+    return {clock: fmax["achieved"] for clock, fmax in report["fmax"].items()}
+
+def print_resources(name: str, resources: dict):
+    """print the resource usage of one core in one line"""
+    if resources is None:
+        print(f"{name}: yosys not found, resource usage not measured")
+    else:
+        print(f"{name}: " + ", ".join(f"{resource}: {count}" for resource, count in resources.items()))
+
+def print_fmax(name: str, fmax: dict):
+    """print the achieved Fmax of each clock of one core in one line"""
+    if fmax is None:
+        print(f"{name}: yosys or nextpnr not found, Fmax not measured")
+    else:
+        print(f"{name}: " + ", ".join(f"{clock}: {freq:.1f} MHz" for clock, freq in sorted(fmax.items())))
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+""" send random frames through ADATReceiver and ADATTDMBridge,
+    decode the TDM8 or I2S output at the rising edges of its bit clock,
+    and check it bit by bit against the sent frames. Also compares the latency
+    from the ADAT input to the serial output with ``ADATTDMBridge.latency_bits``
+"""
+import sys
+import argparse
+sys.path.append('.')
+
+import numpy as np
+from amaranth     import Elaboratable, Signal, Module, Cat
+from amaranth.sim import Simulator
+
+from adat.protocol import adat_freq, CHANNELS, CHANNEL_BITS, SYNC_PAD_BITS, USER_BITS, FRAME_BITS
+from adat.receiver import ADATReceiver
+from adat.tdm      import ADATTDMBridge
+from adat.sim      import random_frames, encode_frames, encode_nrzi, drive_levels, LevelMonitor, compare_frames
+
+class TDMCapture(Elaboratable):
+    """ADATReceiver feeding ADATTDMBridge, the ADAT input is driven from the adat domain"""
+    def __init__(self, clk_freq: float, mode: str):
+        self.adat_in  = Signal()
+        self.receiver = ADATReceiver(clk_freq)
+        self.bridge   = ADATTDMBridge(mode)
+
+    def elaborate(self, platform) -> Module:
+        m = Module()
+        m.submodules.receiver = receiver = self.receiver
+        m.submodules.bridge   = bridge   = self.bridge
+        m.d.adat += receiver.adat_in.eq(self.adat_in)
+        m.d.comb += bridge.connect_receiver(receiver)
+        return m
+
+def decode_serial(levels, bridge: ADATTDMBridge) -> tuple:
+    """the frames in the recorded Cat(bclk_out, ws_out, data_out), sampled at the rising edges of bclk_out.
+       Returns the samples, the clock cycle of the MSB of every sample, and the clock cycle of every frame start"""
+    levels  = np.asarray(levels, dtype=np.int64)
+    bclk    = levels & 1
+    rising  = np.flatnonzero((bclk[1:] == 1) & (bclk[:-1] == 0)) + 1
+    ws      = (levels[rising] >> 1) & 1
+    data    = levels[rising] >> 2
+
+    if bridge.mode == "tdm8":
+        starts = np.flatnonzero(ws == 1)
+    else:
+        starts = np.flatnonzero((ws[1:] == 0) & (ws[:-1] == 1)) + 1
+
+    frame_bits = bridge.slots * bridge.SLOT_BITS
+    samples, msb_cycles = [], []
+    for start in starts[starts + frame_bits <= len(data)]:
+        frame  = np.zeros(CHANNELS, dtype=np.int64)
+        cycles = np.zeros(CHANNELS, dtype=np.int64)
+        for line in range(bridge.lines):
+            for slot in range(bridge.slots):
+                channel = slot if bridge.mode == "tdm8" else bridge.slots * line + slot
+                msb     = start + slot * bridge.SLOT_BITS + 1
+                for bit in (data[msb:msb + 24] >> line) & 1:
+                    frame[channel] = (frame[channel] << 1) | int(bit)
+                cycles[channel] = rising[msb]
+        samples.append(frame)
+        msb_cycles.append(cycles)
+    return np.array(samples).reshape(-1, CHANNELS), np.array(msb_cycles).reshape(-1, CHANNELS), rising[starts]
+
+def run_tdm(mode: str, frames: int=16, samplerate: int=48000, clk_freq: float=100e6, seed: int=0) -> dict:
+    """send random frames to the receiver, decode the serial output and measure the latency of every sample"""
+    samples, user_data = random_frames(frames, seed)
+    # one more frame, so that the receiver outputs the last channel of the last frame,
+    # and time for its serial frame to come out
+    levels = encode_nrzi(encode_frames(np.vstack([samples, np.zeros((2, CHANNELS), dtype=int)]),
+                                       np.append(user_data, [0, 0])))
+
+    dut    = TDMCapture(clk_freq, mode)
+    bridge = dut.bridge
+    sim    = Simulator(dut)
+    sim.add_clock(1.0/clk_freq, domain="sync")
+    sim.add_clock(1.0/adat_freq(samplerate), domain="adat")
+
+    cycles_per_bit = clk_freq / adat_freq(samplerate)
+    serial = LevelMonitor(Cat(bridge.bclk_out, bridge.ws_out, bridge.data_out), int(len(levels) * cycles_per_bit),
+                          domain="sync")
+
+    def adat_process():
+        yield from drive_levels(dut.adat_in, levels)
+
+    sim.add_sync_process(adat_process, domain="adat")
+    sim.add_sync_process(serial.process, domain="sync")
+    sim.run()
+
+    out_samples, msb_cycles, frame_starts = decode_serial(serial.result, bridge)
+    # the bridge outputs zeros, until the receiver has locked
+    received = np.any(out_samples != 0, axis=1)
+    out_samples, msb_cycles = out_samples[received], msb_cycles[received]
+    result = compare_frames(samples, np.zeros(frames), out_samples, np.zeros(len(out_samples)))
+
+    # the MSB starts half a serial bit before the rising edge of the bit clock
+    latency = []
+    for out_frame, sent in enumerate(samples_index(samples, out_samples)):
+        if sent < 0:
+            continue
+        first_bits = sent * FRAME_BITS + SYNC_PAD_BITS + USER_BITS + CHANNEL_BITS * np.arange(CHANNELS)
+        latency.append(msb_cycles[out_frame] / cycles_per_bit - bridge.ticks_per_bit / 2 - first_bits)
+    latency = np.array(latency)
+
+    return dict(
+        mode           = mode,
+        samplerate     = samplerate,
+        result         = result,
+        frames         = frames,
+        latency        = latency,
+        predicted      = np.array([bridge.latency_bits(channel) for channel in range(CHANNELS)]),
+        frame_periods  = np.diff(frame_starts[1:]) / cycles_per_bit,
+        buffer_frames  = bridge.buffer_frames,
+        bit_time       = 1e6 / adat_freq(samplerate),
+    )
+
+def samples_index(sent_samples, received_samples) -> list:
+    """the index of every received frame in the sent frames, or -1"""
+    return [int(match[0]) if len(match) else -1
+            for match in (np.flatnonzero(np.all(sent_samples == frame, axis=1)) for frame in received_samples)]
+
+def check_result(result: dict):
+    checked = result["result"]
+    # the receiver locks to the sync pad of the first frame
+    assert checked["received"] >= result["frames"] - 1, f"received {checked['received']} frames"
+    assert checked["lost"] == 0,       f"lost {checked['lost']} frames"
+    assert checked["bit_errors"] == 0, f"{checked['bit_errors']} bit errors"
+    # one serial frame per ADAT frame, give or take the jitter of the recovered bit strobes
+    assert np.all(np.abs(result["frame_periods"] - FRAME_BITS) <= 1), f"frame periods {result['frame_periods']}"
+
+    # the receiver outputs a sample about two bits after its end
+    excess = result["latency"] - result["predicted"]
+    assert np.all((excess >= 1) & (excess <= 3)), f"latency exceeds the prediction by {excess.min()} to {excess.max()} bits"
+
+def print_result(result: dict):
+    latency = result["latency"]
+    print(f"{result['mode']:>5}  {result['samplerate']:6}  {result['result']['received']:6}  "
+          f"{result['result']['bit_errors']:6}  {result['buffer_frames']:6}  "
+          f"{latency.min():6.1f} {latency.max():6.1f}  {latency.max() * result['bit_time']:6.2f}", flush=True)
+
+def test_tdm(modes: list, samplerates: list, **kwargs):
+    print(f"{'mode':>5}  {'rate':>6}  {'frames':>6}  {'errors':>6}  {'buffer':>6}  "
+          f"{'latency bits':>13}  {'max us':>6}")
+    for mode in modes:
+        for samplerate in samplerates:
+            result = run_tdm(mode, samplerate=samplerate, **kwargs)
+            print_result(result)
+            check_result(result)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TDM8 and I2S output of received ADAT frames")
+    parser.add_argument("-m", "--modes", nargs="+", default=list(ADATTDMBridge.MODES), choices=ADATTDMBridge.MODES)
+    parser.add_argument("-s", "--samplerate", type=int, nargs="+", default=[44100, 48000])
+    parser.add_argument("--clk-freq", type=float, default=100e6)
+    parser.add_argument("-n", "--frames", type=int, default=16)
+    args = parser.parse_args()
+
+    test_tdm(args.modes, args.samplerate, frames=args.frames, clk_freq=args.clk_freq)
+    print("Success!")
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+""" characterise the sustained throughput of the transmitter against the ratio
+    of the sync clock to the ADAT bit clock: a greedy producer writes a sample
+    whenever ready_out is high, and the bench reports the ready_out duty cycle,
+    the FIFO level statistics, the underflows and whether the line carried
+    every frame exactly once. Then it searches the minimum ratio, which sustains line rate.
+"""
+import sys
+import argparse
+sys.path.append('.')
+
+import numpy as np
+from amaranth     import Cat
+from amaranth.sim import Simulator
+
+from adat.protocol import adat_freq, FRAME_BITS
+from adat.sim      import ADATTransmitterTester, random_frames, drive_frames, LevelMonitor, \
+                          decode_nrzi, line_frames, compare_frames
+
+def run_ratio(ratio: float, samplerate: int=48000, frames: int=16, fifo_depth: int=9*4) -> dict:
+    """feed frames into the transmitter with a greedy producer, with the sync clock at ratio times the ADAT bit rate"""
+    samples, user_data = random_frames(frames)
+    bit_rate = adat_freq(samplerate)
+    clk_freq = ratio * bit_rate
+    dut = ADATTransmitterTester(fifo_depth=fifo_depth)
+
+    sim = Simulator(dut)
+    sim.add_clock(1.0/clk_freq, domain="sync")
+    sim.add_clock(1.0/bit_rate, domain="adat")
+
+    # all frames, plus the ones still in the FIFO, and the empty frame sent first
+    adat_cycles = (frames + fifo_depth // 9 + 2) * FRAME_BITS
+    line    = LevelMonitor(dut.adat_out, adat_cycles)
+    # one read per cycle: ready_out in bit 0, underflow_out in bit 1, the FIFO level above
+    status  = LevelMonitor(Cat(dut.ready_out, dut.underflow_out, dut.fifo_level_out),
+                           int(adat_cycles * ratio) + 1, domain="sync", dtype=np.uint16)
+    producer_done = []
+    # after the measured frames, keep the transmitter busy with other frames,
+    # so that the measured frames are followed by regular frames on the line
+    filler_samples, filler_user_data = random_frames(frames, seed=1)
+
+    def producer():
+        yield from drive_frames(dut, samples, user_data)
+        producer_done.append(status.count)
+        while line.count < adat_cycles:
+            yield from drive_frames(dut, filler_samples[:1], filler_user_data[:1])
+
+    sim.add_sync_process(producer, domain="sync")
+    sim.add_sync_process(line.process, domain="adat")
+    sim.add_sync_process(status.process, domain="sync")
+    sim.run()
+
+    # only while the producer had frames to write
+    window     = status.result[:producer_done[0]]
+    ready      = window & 1
+    underflows = (window >> 1) & 1
+    levels     = window >> 2
+
+    line_samples, line_user_data, _ = line_frames(decode_nrzi(line.result))
+    result    = compare_frames(samples, user_data, line_samples, line_user_data)
+    malformed = int(np.count_nonzero(line_samples[:, 0] < 0))
+    return dict(
+        ratio          = ratio,
+        clk_freq       = clk_freq,
+        ready_duty     = float(ready.mean()),
+        level_min      = int(levels.min()),
+        level_mean     = float(levels.mean()),
+        level_max      = int(levels.max()),
+        underflows     = int(underflows.sum()),
+        line_errors    = result["lost"] + result["repeated"] + result["errored_frames"] + malformed,
+        # every frame went out exactly once, and in order
+        line_rate      = result["first"] == 0 and result["not_received"] == 0 and
+                         result["lost"] + result["repeated"] + result["errored_frames"] + malformed == 0,
+    )
+
+def sustains(result: dict) -> bool:
+    return result["underflows"] == 0 and result["line_rate"]
+
+def print_result(result: dict):
+    print(f"{result['ratio']:7.4f}  {result['clk_freq'] / 1e6:8.3f}  {result['ready_duty'] * 100:6.1f}%  "
+          f"{result['level_min']:4} {result['level_mean']:6.1f} {result['level_max']:4}  "
+          f"{result['underflows']:10}  {result['line_errors']:11}  {'yes' if sustains(result) else 'no'}", flush=True)
+
+def test_throughput(ratios: list, samplerate: int=48000, frames: int=16, fifo_depth: int=9*4,
+                    bisect_steps: int=4) -> float:
+    """run all ratios, then bisect between the lowest sustaining one and the next lower one.
+       Returns the minimum ratio found, which sustains line rate"""
+    print(f"{'ratio':>7}  {'MHz':>8}  {'ready':>7}  {'FIFO min/mean/max':>17}  {'underflows':>10}  {'line errors':>11}  sustains")
+    results = []
+    for ratio in sorted(ratios, reverse=True):
+        results.append(run_ratio(ratio, samplerate, frames, fifo_depth))
+        print_result(results[-1])
+
+    sustaining = [result["ratio"] for result in results if sustains(result)]
+    failing    = [result["ratio"] for result in results if not sustains(result)]
+    assert sustaining, "no ratio sustains line rate"
+    low  = max([ratio for ratio in failing if ratio < min(sustaining)], default=None)
+    high = min(sustaining)
+
+    if low is not None:
+        for _ in range(bisect_steps):
+            middle = (low + high) / 2
+            result = run_ratio(middle, samplerate, frames, fifo_depth)
+            print_result(result)
+            if sustains(result):
+                high = middle
+            else:
+                low = middle
+
+    print(f"minimum ratio sustaining {samplerate} Hz: {high:.4f}, "
+          f"a sync clock of {high * adat_freq(samplerate) / 1e6:.3f} MHz")
+    return high
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="transmitter throughput against the sync clock to ADAT bit clock ratio")
+    parser.add_argument("-r", "--ratios", type=float, nargs="+", default=[4, 2, 1, 0.5, 0.25, 0.125, 0.0625, 0.03125])
+    parser.add_argument("-s", "--samplerate", type=int, nargs="+", default=[48000, 44100])
+    parser.add_argument("-n", "--frames", type=int, default=16)
+    parser.add_argument("--fifo-depth", type=int, default=9*4)
+    parser.add_argument("--bisect-steps", type=int, default=4)
+    args = parser.parse_args()
+
+    for samplerate in args.samplerate:
+        test_throughput(args.ratios, samplerate, args.frames, args.fifo_depth, args.bisect_steps)
@@ -12,9 +12,9 @@ from adat.transmitter import ADATTransmitter
 from adat.nrzidecoder import NRZIDecoder
 from testdata import *
 
-def test_with_samplerate(samplerate: int=48000):
+def test_with_samplerate(samplerate: int=48000, serializer: str="mux"):
     clk_freq = 50e6
-    dut = ADATTransmitter()
+    dut = ADATTransmitter(serializer=serializer)
     adat_freq = NRZIDecoder.adat_freq(samplerate)
     clockratio = clk_freq / adat_freq
 
@@ -100,8 +100,11 @@ def test_with_samplerate(samplerate: int=48000):
     sim.add_sync_process(sync_process, domain="sync")
     sim.add_sync_process(adat_process, domain="adat")
 
-    with sim.write_vcd(f'transmitter-smoke-test-{str(samplerate)}.vcd'):
+    # the gtkw file refers to the VCD of the mux serializer
+    serializer_suffix = "" if serializer == "mux" else f"-{serializer}"
+    with sim.write_vcd(f'transmitter-smoke-test-{str(samplerate)}{serializer_suffix}.vcd'):
         sim.run()
 
 if __name__ == "__main__":
-    test_with_samplerate(48000)
\ No newline at end of file
+    test_with_samplerate(48000)
+    test_with_samplerate(48000, serializer="shift")
\ No newline at end of file
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+import sys
+sys.path.append('.')
+
+import numpy as np
+from amaranth.sim import Simulator, Tick, Settle, Delay
+
+from adat.transmitter import ADATTransmitter
+from adat.nrzidecoder import NRZIDecoder
+from testdata         import decode_nrzi, adat_decode, print_assert_failure
+from generate         import transmitter_ports
+from synthesis        import synthesize, print_resources, yosys_binary
+
+def time_interval_error(edges, period: float) -> np.ndarray:
+    """the time interval error of each edge against the ideal clock, which fits the edges best.
+       The period is only used to number the edges, so that a constant frequency error,
+       like the rounding of the clock periods to the simulator time step, is not counted as jitter"""
+    edges = np.asarray(edges, dtype=float) - edges[0]
+    bits  = np.round(edges / period)
+    slope, offset = np.polyfit(bits, edges, 1)
+    return edges - (offset + slope * bits)
+
+def run_transmitter(samplerate: int=48000, clk_freq: float=50e6, single_domain: bool=True,
+                    no_frames: int=6, probe_period: float=1e-9, vcd_file: str=None) -> np.ndarray:
+    """send frames through the transmitter, running from the internal bit clock generator,
+       or from an ideal adat clock with two domains. adat_out is sampled every probe_period seconds,
+       and the frames are checked. Returns the time interval error of the output edges in seconds"""
+    adat_freq = NRZIDecoder.adat_freq(samplerate)
+    bit_period = 1.0 / adat_freq
+    dut = ADATTransmitter(clk_freq=clk_freq, samplerate=samplerate) if single_domain else ADATTransmitter()
+
+    sim = Simulator(dut)
+    sim.add_clock(1.0/clk_freq, domain="sync")
+    if not single_domain:
+        sim.add_clock(bit_period, domain="adat")
+
+    def write(addr: int, sample: int, last: bool = False):
+        yield Settle()
+        while (yield dut.ready_out == 0):
+            yield Tick("sync")
+            yield Settle()
+        yield dut.last_in.eq(last)
+        yield dut.addr_in.eq(addr)
+        yield dut.sample_in.eq(sample)
+        yield dut.valid_in.eq(1)
+        yield Tick("sync")
+        yield dut.valid_in.eq(0)
+        yield dut.last_in.eq(0)
+
+    def sync_process():
+        for frame in range(1, no_frames + 1):
+            yield dut.user_data_in.eq(frame)
+            for channel in range(8):
+                yield from write(channel, (channel << 20) | frame, channel == 7)
+
+    levels = np.zeros(int(bit_period * 256 * (no_frames + 3) / probe_period), dtype=np.uint8)
+
+    def probe_process():
+        # away from the clock edges
+        yield Delay(probe_period / 4)
+        for sample in range(len(levels)):
+            levels[sample] = yield dut.adat_out
+            yield Delay(probe_period)
+
+    sim.add_sync_process(sync_process, domain="sync")
+    sim.add_process(probe_process)
+    if vcd_file is None:
+        sim.run()
+    else:
+        with sim.write_vcd(vcd_file):
+            sim.run()
+
+    edges = (np.flatnonzero(np.diff(levels)) + 1) * probe_period
+
+    # the NRZI levels in the middle of the bits after the first edge
+    middle = ((edges[0] + (np.arange(int((len(levels) * probe_period - edges[0]) / bit_period)) + 0.5) * bit_period)
+              / probe_period).astype(int)
+    decoded = adat_decode(decode_nrzi(levels[middle].tolist()))
+    frames_sent = [frame for frame in decoded if frame[1:] != [0] * 8]
+    for frame in range(1, no_frames + 1):
+        expected = [frame] + [(channel << 20) | frame for channel in range(8)]
+        assert frames_sent[frame - 1] == expected, print_assert_failure(frames_sent[frame - 1], expected)
+
+    return time_interval_error(edges, bit_period)
+
+def test_with_samplerate(samplerate: int=48000, clk_freq: float=50e6, probe_period: float=1e-9):
+    """measure the output jitter of the transmitter with the internal bit clock generator and with two domains"""
+    adat_freq = NRZIDecoder.adat_freq(samplerate)
+    print(f"FPGA clock freq: {clk_freq}")
+    print(f"ADAT clock freq: {adat_freq}")
+    print(f"FPGA/ADAT freq: {clk_freq / adat_freq}")
+
+    for name, single_domain in [("single domain", True), ("two domains", False)]:
+        tie = run_transmitter(samplerate, clk_freq, single_domain, probe_period=probe_period,
+                              vcd_file=f"transmitter-bitclock-{samplerate}-{clk_freq / 1e6:.0f}MHz.vcd" if single_domain else None) * 1e9
+        jitter = tie.max() - tie.min()
+        print(f"{name}: jitter {jitter:.2f} ns peak to peak, {np.sqrt(np.mean(tie * tie)):.2f} ns RMS, "
+              f"bit period {1e9/adat_freq:.2f} ns, resolution {probe_period * 1e9:.2f} ns")
+
+        # the bit clock generator adds one sync clock period, the adat clock is ideal
+        allowed = 2 * probe_period + (1.0 / clk_freq if single_domain else 0.0)
+        assert jitter <= allowed * 1e9, f"{name}: jitter {jitter:.2f} ns, expected at most {allowed * 1e9:.2f} ns"
+
+    print("Success!")
+
+def compare_resources(clk_freq: float=50e6):
+    if yosys_binary() is None:
+        print("yosys not found, resource usage not measured")
+        return
+
+    two_domains = ADATTransmitter()
+    print_resources("two domains", synthesize(two_domains, transmitter_ports(two_domains)))
+    single_domain = ADATTransmitter(clk_freq=clk_freq)
+    print_resources("single domain", synthesize(single_domain, transmitter_ports(single_domain)))
+
+if __name__ == "__main__":
+    test_with_samplerate(48000)
+    test_with_samplerate(44100)
+    compare_resources()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Hans Baier <hansfbaier@gmail.com>
+# SPDX-License-Identifier: CERN-OHL-W-2.0
+#
+""" run a producer at the nominal sample rate against a transmitter, whose adat clock
+    is off by a ppm offset, long enough for the FIFO level to drift by more than a frame.
+    Without the servo, a fast adat clock has to underflow the FIFO, and a slow one
+    has to fill it up. With the servo, the producer inserts or drops frames
+    based on fifo_level_error_out and fifo_level_trend_out, and there must be no underflows.
+"""
+import sys
+import argparse
+sys.path.append('.')
+
+from amaranth     import Elaboratable, Signal, Module
+from amaranth.sim import Simulator, Tick, Settle, Delay
+
+from adat.transmitter import ADATTransmitter
+from adat.nrzidecoder import NRZIDecoder
+
+# the words a frame takes up in the transmit FIFO: eight samples and the user bits
+FRAME_WORDS = 9
+
+class CountingTransmitter(Elaboratable):
+    """ADATTransmitter, which counts the sync clock cycles, and its underflows while count_in is high,
+       so that the bench does not need to look at every cycle"""
+    def __init__(self, **kwargs):
+        self.transmitter    = ADATTransmitter(**kwargs)
+        self.count_in       = Signal()
+        self.cycles_out     = Signal(32)
+        self.underflows_out = Signal(32)
+
+    def elaborate(self, platform) -> Module:
+        m = Module()
+        m.submodules.transmitter = transmitter = self.transmitter
+        m.d.sync += self.cycles_out.eq(self.cycles_out + 1)
+        with m.If(transmitter.underflow_out & self.count_in):
+            m.d.sync += self.underflows_out.eq(self.underflows_out + 1)
+        return m
+
+def default_frames(ppm: float, drift_frames: float=1.5, warmup_frames: int=20) -> int:
+    """the number of frames, after which the producer is drift_frames ahead or behind"""
+    return warmup_frames + int(drift_frames / (abs(ppm) * 1e-6))
+
+def run_with_ppm_offset(ppm: float, servo: bool, samplerate: int=48000, no_frames: int=None,
+                        warmup_frames: int=20, clk_freq: float=25e6) -> dict:
+    """let a producer running at the nominal sample rate feed a transmitter
+       whose adat clock is off by the given ppm offset. Returns the number of underflows,
+       of inserted and dropped frames, and the FIFO level error after the warmup and at the end"""
+    if no_frames is None:
+        no_frames = default_frames(ppm, warmup_frames=warmup_frames)
+
+    dut = CountingTransmitter()
+    transmitter = dut.transmitter
+    adat_freq = NRZIDecoder.adat_freq(samplerate) * (1 + ppm * 1e-6)
+    frame_period = clk_freq / samplerate
+
+    sim = Simulator(dut)
+    sim.add_clock(1.0/clk_freq, domain="sync")
+    sim.add_clock(1.0/adat_freq, domain="adat")
+
+    # the servo only acts, when the smoothed FIFO level
+    # is more than a threshold off target
+    threshold = 4
+    # wait until an insertion or drop shows up in the smoothed FIFO level
+    holdoff_frames = 8
+
+    stats = dict(inserted=0, dropped=0)
+
+    def wait_until(cycle: float):
+        # skip most of the cycles at once, instead of stopping at every clock edge
+        cycles = cycle - (yield dut.cycles_out)
+        if cycles > 2:
+            yield Delay((int(cycles) - 2) / clk_freq)
+        while (yield dut.cycles_out) < cycle:
+            yield Tick("sync")
+
+    def write_frame(frame: int):
+        yield transmitter.user_data_in.eq(frame & 0xf)
+        for channel in range(8):
+            yield Settle()
+            while (yield transmitter.ready_out) == 0:
+                yield Tick("sync")
+                yield Settle()
+            yield transmitter.addr_in.eq(channel)
+            yield transmitter.sample_in.eq((channel << 20) | frame)
+            yield transmitter.valid_in.eq(1)
+            yield transmitter.last_in.eq(channel == 7)
+            yield Tick("sync")
+        yield transmitter.valid_in.eq(0)
+        yield transmitter.last_in.eq(0)
+
+    def producer_process():
+        next_frame_at = 0.0
+        holdoff = 0
+        for frame in range(no_frames):
+            yield from wait_until(next_frame_at)
+            next_frame_at += frame_period
+
+            error = yield transmitter.fifo_level_error_out
+            trend = yield transmitter.fifo_level_trend_out
+            if frame == warmup_frames:
+                yield dut.count_in.eq(1)
+                stats["start_error"] = error
+
+            if holdoff > 0:
+                holdoff -= 1
+            elif servo and error < -threshold and trend <= 0:
+                # the FIFO drains: insert a frame
+                yield from write_frame(frame)
+                stats["inserted"] += 1
+                holdoff = holdoff_frames
+            elif servo and error > threshold and trend >= 0:
+                # the FIFO fills up: drop this frame
+                stats["dropped"] += 1
+                holdoff = holdoff_frames
+                continue
+
+            yield from write_frame(frame)
+
+        stats["end_error"]  = yield transmitter.fifo_level_error_out
+        stats["underflows"] = yield dut.underflows_out
+
+    sim.add_sync_process(producer_process, domain="sync")
+    sim.run()
+
+    print(f"{ppm:+} ppm, {no_frames} frames, servo {'on ' if servo else 'off'}: {stats['underflows']} underflows, "
+          f"{stats['inserted']} frames inserted, {stats['dropped']} frames dropped, "
+          f"FIFO level error {stats['start_error']:+} -> {stats['end_error']:+}", flush=True)
+    return dict(stats, ppm=ppm, servo=servo, no_frames=no_frames, warmup_frames=warmup_frames, threshold=threshold)
+
+def check_result(result: dict):
+    ppm = result["ppm"]
+    if result["servo"]:
+        assert result["underflows"] == 0, f"{ppm:+} ppm: {result['underflows']} underflows with the servo"
+        assert abs(result["end_error"]) <= result["threshold"] + FRAME_WORDS, \
+            f"{ppm:+} ppm: FIFO level error {result['end_error']} with the servo"
+        return
+
+    # the offset has to do harm without the servo, so that the check above means something
+    if ppm > 0:
+        assert result["underflows"] > 0, f"{ppm:+} ppm: no underflows without the servo"
+    else:
+        drift_words = -ppm * 1e-6 * (result["no_frames"] - result["warmup_frames"]) * FRAME_WORDS
+        assert result["end_error"] - result["start_error"] >= drift_words / 2, \
+            f"{ppm:+} ppm: the FIFO level did not rise without the servo"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="keep the transmit FIFO level with the servo outputs")
+    parser.add_argument("--ppm", type=float, default=100, help="offset of the adat clock, run with + and -")
+    parser.add_argument("-n", "--frames", type=int, default=None,
+                        help="defaults to the frames needed to drift by one and a half frames")
+    parser.add_argument("-s", "--samplerate", type=int, default=48000)
+    parser.add_argument("--clk-freq", type=float, default=25e6)
+    args = parser.parse_args()
+
+    for offset in [args.ppm, -args.ppm]:
+        for servo in [False, True]:
+            check_result(run_with_ppm_offset(offset, servo, samplerate=args.samplerate, no_frames=args.frames,
+                                             clk_freq=args.clk_freq))
+    print("Success!")